@@ -2,12 +2,16 @@
 import argparse
 from collections import OrderedDict, deque
 from copy import copy
+import heapq
 import logging
+import math
 import time
-from typing import List, Dict, Set, Any, TypeVar
-import requests
+from typing import List, Dict, Set, Any, Tuple, TypeVar
+
+import numpy as np
 
 from common.game_elements import Pos, GameState, Dir, State, VisitNode , Map
+from common.transport import StreamClient
 import common.tiles as tiles
 
 logging.basicConfig(filename='log.txt',
@@ -29,12 +33,40 @@ MOVES = 'moves'
 INPUT = 'input'
 COMMAND = 'command_'
 END = 'end'
+RETRY_AFTER = 'retry_after'
+
+# Padding around the flat maps of KnownMap, a code no tile uses
+OUTSIDE = tiles.CODE_TO_TYPE.index(None)
+# What check_path() looks for and the tiles it doesn't go through
+SEARCH_GOALS = (tiles.Exit.code, tiles.UnknownTile.code)
+PORTAL_FLAGS = bytes(tiles.CODE_TO_TYPE[code] == tiles.Portal for code in range(256))
+BLOCKING = bytes(code == OUTSIDE or tiles.CODE_TO_TYPE[code] in [tiles.Wall, tiles.BackwardTrap, tiles.RewindTrap]
+                 for code in range(256))
+
+# Cost of stepping on each tile for the frontier planner, None for the ones it never steps on. A MovesTrap costs the
+# moves it takes from the next round, a trap that may push the agent somewhere else costs about a round
+TRAP_PENALTY = 10
+STEP_COSTS: List[int | None] = [None] * 256
+for code, tile_type in enumerate(tiles.CODE_TO_TYPE):
+    if tile_type in [tiles.Path, tiles.Entrance, tiles.Exit, tiles.Xray, tiles.Fog, tiles.Tower, tiles.Portal]:
+        STEP_COSTS[code] = 1
+    elif tile_type == tiles.MovesTrap:
+        STEP_COSTS[code] = 1 + code - tile_type.base_code
+    elif tile_type in [tiles.UnknownTrap, tiles.ForwardTrap]:
+        STEP_COSTS[code] = 1 + TRAP_PENALTY
+# How many moves showing one more unknown tile is worth
+GAIN_WEIGHT = 2
+# Where the agent may end up after stepping on these isn't known, so nothing is planned after them
+STOPS = bytes(tiles.CODE_TO_TYPE[code] in [tiles.UnknownTrap, tiles.ForwardTrap] for code in range(256))
 
 TOTAL_ROUNDS = 0
 TOTAL_MOVES = 0
 TOTAL_XRAY = 0
 START_TIME = 0
 
+# Set when the agent talks to the server over the persistent stream instead of HTTP
+TRANSPORT: StreamClient | None = None
+
 def get_parser():
     # Create the argument parser
     parser = argparse.ArgumentParser(description="Start this agent.")
@@ -59,6 +91,18 @@ def get_parser():
         action="store_true",
         help="Run in manual mode (the user plays as the agent)"
     )
+    parser.add_argument(
+        "--stream-port",
+        type=int,
+        help="Talk to the server over its persistent stream transport on this port instead of HTTP"
+    )
+    parser.add_argument(
+        "--planner",
+        choices=["dfs", "frontier"],
+        default="dfs",
+        help="How rounds are planned: a depth first search stopping at the first unknown tile, or whole rounds to the "
+             "tiles showing the most unknown ones for their cost"
+    )
 
     return parser
 
@@ -77,51 +121,121 @@ def get_temp(map, dict: Dict[Pos, T], pos: Pos) -> T:
 
     return dict[pos]
 
-def check_path(map: Map, visited, temp_visited: Dict[Pos, VisitNode], pos: Pos, parent: Pos):
+class KnownMap:
+    """ Copy of the tiles of an agent map, flat and padded with OUTSIDE, so that check_path() can search it with plain
+    integers instead of going through Map and Pos for every neighbor. Made once per map, then only the windows of the
+    views written since are copied again (see GameState.view_windows), along with the portals in them """
+    def __init__(self, map: Map):
+        self.map = map
+        self.arr = np.asarray(map)
+        self.width = map.shape[1] + 2
+        self.codes = bytearray(np.pad(self.arr, 1, constant_values=OUTSIDE).tobytes())
+        self.grid = np.frombuffer(self.codes, dtype=np.uint8).reshape(map.shape[0] + 2, self.width) # same memory
+        self.offsets = (-self.width, self.width, -1, 1) # N, S, W, E
+
+        self.portals: Dict[int, Set[int]] = {} # indices of the portals of each code
+        self._add_portals(self.grid, 0, 0)
+
+    def index(self, pos: Pos) -> int:
+        return (pos[0] + 1) * self.width + pos[1] + 1
+
+    def pos(self, index: int) -> Pos:
+        x, y = divmod(index, self.width)
+        return Pos(x - 1, y - 1)
+
+    def refresh(self, pos: Pos, visibility: int):
+        """ Copies the tiles of the map around `pos`, where a view was written """
+        height, width = self.arr.shape
+        top, bottom = max(pos[0] - visibility, 0), min(pos[0] + visibility + 1, height)
+        left, right = max(pos[1] - visibility, 0), min(pos[1] + visibility + 1, width)
+
+        window = self.grid[top + 1:bottom + 1, left + 1:right + 1]
+        window[:] = self.arr[top:bottom, left:right]
+        # A portal stays a portal once seen, only new ones have to be looked for
+        self._add_portals(window, top + 1, left + 1)
+
+    def portal_pair(self, index: int) -> Pos | None:
+        """ Map.portals[pos], without searching the whole map """
+        first, *others = sorted(self.portals[self.codes[index]])
+        if not others:
+            return None
+        return self.pos(others[0] if index == first else first)
+
+    def _add_portals(self, window: np.ndarray, top: int, left: int):
+        found = window.tobytes().translate(PORTAL_FLAGS)
+        index = found.find(1)
+        while index >= 0:
+            x, y = divmod(index, window.shape[1])
+            self.portals.setdefault(int(window[x, y]), set()).add((top + x) * self.width + left + y)
+            index = found.find(1, index + 1)
+
+def known_map(game_state: GameState, known_maps: Dict[int, KnownMap]) -> KnownMap:
+    """ The KnownMap of the current map of the game state, after bringing all of them up to date """
+    if game_state.view_windows is None:
+        game_state.view_windows = []
+
+    # Consecutive moves (bounces and pushes even more) often write the same window
+    for map_id, pos, visibility in {(id(map), pos, visibility) for map, pos, visibility in game_state.view_windows}:
+        known = known_maps.get(map_id)
+        if known is not None:
+            known.refresh(pos, visibility)
+    game_state.view_windows.clear()
+
+    # The maps live as long as the game state, so their ids are not reused
+    known = known_maps.get(id(game_state.current_map))
+    if known is None:
+        known = known_maps[id(game_state.current_map)] = KnownMap(game_state.current_map)
+    return known
+
+def check_path(known: KnownMap, visited, temp_visited: Dict[Pos, VisitNode], pos: Pos, parent: Pos):
+    """ Whether going to `pos` from `parent` can still lead somewhere new: the exit, an unknown tile or an unexplored
+    portal, without going back through `parent` nor further than the VISITED tiles """
+    map = known.map
     if map[pos] == tiles.Exit.code:
         return True
 
-    DISCOVERED = tiles.CODE_TO_TYPE.index(None) # use an unused value to mark discovered nodes
-    discovered: Dict[Pos, int] = {}
-    discovered[pos] = DISCOVERED
-    discovered[parent] = DISCOVERED # deny going to the parent
+    codes = known.codes
+    start = known.index(pos)
+    discovered = {start, known.index(parent)} # deny going to the parent
+    # The nodes changed while planning this round, over their committed version in `visited`
+    temp_states = {known.index(temp_pos): node.state for temp_pos, node in temp_visited.items()}
 
-    queue = deque([pos])
+    queue = deque([start])
 
     while queue:
-        pos = queue.popleft()
+        index = queue.popleft()
 
-        for dir in [Dir.N, Dir.S, Dir.W, Dir.E]:
-            neigh = Dir.move(pos, dir)
+        state = temp_states.get(index)
+        if state is None:
+            state = visited[known.pos(index)].state
+        searched = state != State.VISITED # the neighbors of visited tiles are discovered, but not searched
 
-            if not map.in_map(neigh):
+        for neigh in [index + offset for offset in known.offsets]:
+            if neigh in discovered:
                 continue
+            discovered.add(neigh)
 
-            neigh_code = get_temp(map, discovered, neigh)
-            discovered[neigh] = DISCOVERED
+            if searched:
+                neigh_code = codes[neigh]
+                if neigh_code in SEARCH_GOALS:
+                    return True
 
-            if get_temp(visited, temp_visited, pos).state == State.VISITED:
-                neigh_code = DISCOVERED
+                if not BLOCKING[neigh_code]:
+                    queue.append(neigh)
 
-            if neigh_code in [tiles.Exit.code, tiles.UnknownTile.code]:
-                return True
-
-            if neigh_code != DISCOVERED and tiles.CODE_TO_TYPE[neigh_code] not in [tiles.Wall, tiles.BackwardTrap, tiles.RewindTrap]:
-                queue.append(neigh)
-
-        if tiles.CODE_TO_TYPE[map[pos]] == tiles.Portal:
-            portal_pair = map.portals[pos]
+        if tiles.CODE_TO_TYPE[codes[index]] == tiles.Portal:
+            portal_pair = known.portal_pair(index)
             if portal_pair is None:
                 return True
 
-            portal_pair_node = get_temp(visited, temp_visited, portal_pair)
+            portal_pair_node = temp_visited.get(portal_pair) or visited[portal_pair]
             if portal_pair_node.state == State.NEW:
                 return True
 
     return False
 
 
-def dfs(game_state: GameState, temp_visited: Dict[Pos, VisitNode], visited_pos: List[Pos], pos: Pos):
+def dfs(game_state: GameState, known: KnownMap, temp_visited: Dict[Pos, VisitNode], visited_pos: List[Pos], pos: Pos):
     # If we just stepped on a trap (that is not a MovesTrap), don't make another move until we find out what just happened
     tile = tiles.from_code(game_state.current_map[pos])
     if isinstance(tile, tiles.Trap) and tile.type != tiles.MovesTrap:
@@ -143,7 +257,10 @@ def dfs(game_state: GameState, temp_visited: Dict[Pos, VisitNode], visited_pos:
     else:
         node.p_visited = True
 
-    for dir in dirs:
+    i = 0
+    while i < len(dirs):
+        dir = dirs[i]
+        i += 1
         if dir == 'P':
             node.p_visited = True
 
@@ -151,7 +268,7 @@ def dfs(game_state: GameState, temp_visited: Dict[Pos, VisitNode], visited_pos:
                 # found the same code portal that we originally entered in, avoid infinite teleport loop
                 continue
 
-            portal_pair = game_state.current_map.portals[pos]
+            portal_pair = known.portal_pair(known.index(pos))
 
             if portal_pair is not None and get_temp(game_state.visited, temp_visited, portal_pair).state != State.NEW:
                 continue
@@ -159,7 +276,7 @@ def dfs(game_state: GameState, temp_visited: Dict[Pos, VisitNode], visited_pos:
             return dir
 
         new_pos = Dir.move(pos, dir)
-        if new_pos != node.parent and game_state.current_map.in_map(new_pos):
+        if new_pos != node.parent and known.codes[known.index(new_pos)] != OUTSIDE:
             # Don't make another move if we find an UnknownTile, wait for more info from the server
             if game_state.current_map[new_pos] == tiles.UnknownTile.code:
                 # if this is the last direction and it is unknown, wait for more info; otherwise, try another (possibly known) direction
@@ -172,7 +289,8 @@ def dfs(game_state: GameState, temp_visited: Dict[Pos, VisitNode], visited_pos:
             if tiles.CODE_TO_TYPE[game_state.current_map[new_pos]] in [tiles.BackwardTrap, tiles.RewindTrap]:
                 new_pos_node.state = State.WALL
 
-            if new_pos_node.state in [State.NEW, State.OPEN] and check_path(game_state.current_map, game_state.visited, temp_visited, new_pos, pos):
+            if new_pos_node.state in [State.NEW, State.OPEN] and \
+                    check_path(known, game_state.visited, temp_visited, new_pos, pos):
                 visited_pos.append(new_pos)
                 new_pos_node.state = State.OPEN
 
@@ -181,8 +299,11 @@ def dfs(game_state: GameState, temp_visited: Dict[Pos, VisitNode], visited_pos:
 
                 return dir
 
+        # Nothing to do that way: drop it and look at the remaining directions again from the first one, as the unknown
+        # ones skipped so far may now be the last ones left
         visit_node(node, dir)
-        return dfs(game_state, temp_visited, visited_pos, pos)
+        dirs.pop(i - 1)
+        i = 0
 
     node.state = State.VISITED
     prev_pos: Pos = node.parent
@@ -196,8 +317,13 @@ def dfs(game_state: GameState, temp_visited: Dict[Pos, VisitNode], visited_pos:
     return undo_move
 
 def connect(game_state: GameState | None, url, uuid, discovered_forward_traps: Set[Pos]):
-    response = requests.post(url + REGISTER, json={UUID: uuid} if uuid else {})
-    resp: dict = response.json()
+    if TRANSPORT is not None:
+        resp: dict = TRANSPORT.request({UUID: uuid} if uuid else {})
+    else:
+        import requests # only the HTTP transport needs it
+
+        response = requests.post(url + REGISTER, json={UUID: uuid} if uuid else {})
+        resp: dict = response.json()
 
     if not uuid and UUID in resp:
         uuid = resp[UUID]
@@ -223,23 +349,31 @@ def send_commands(url, uuid, commands: list) -> Dict[str, Any]:
     logger.debug(f"Sending '{commands_str}'")
     commands_json = {INPUT : commands_str, UUID: uuid}
 
-    response = requests.post(url + SEND_MOVES, json=commands_json)
+    while True:
+        if TRANSPORT is not None:
+            response = TRANSPORT.request(commands_json)
+        else:
+            import requests # only the HTTP transport needs it
+
+            response = requests.post(url + SEND_MOVES, json=commands_json).json()
 
-    logger.debug(f"Received {response}")
-    return response.json()
+        logger.debug(f"Received {response}")
+        if RETRY_AFTER not in response:
+            return response
 
-def run(game_state: GameState, url, uuid, discovered_forward_traps: Set[Pos], wait_for_input=False):
-    global TOTAL_ROUNDS
-    global TOTAL_MOVES
-    global TOTAL_XRAY
-    global START_TIME
+        # The server is overloaded or we are over our rate limit, the round was not played
+        time.sleep(float(response[RETRY_AFTER]))
 
+def plan(game_state: GameState, known_maps: Dict[int, KnownMap]) -> Tuple[List[str], Dict[Pos, VisitNode], List[Pos]]:
+    """ The commands of the next round, along with the copies of the nodes they changed and the positions they go
+    through, both only committed to the game state by update(). `known_maps` is kept from one round to the next """
     commands = []
     pos = game_state.pos
+    known = known_map(game_state, known_maps)
     temp_visited: Dict[Pos, VisitNode] = OrderedDict()
     visited_pos: List[Pos] = []
     for _ in range(game_state.moves):
-        direction = dfs(game_state, temp_visited, visited_pos, pos)
+        direction = dfs(game_state, known, temp_visited, visited_pos, pos)
         if direction is None:
             break
         commands.append(direction)
@@ -250,11 +384,195 @@ def run(game_state: GameState, url, uuid, discovered_forward_traps: Set[Pos], wa
     if len(commands) == 0:
         if game_state.xray_points > 0:
             commands = ['X']
-            TOTAL_XRAY += 1
         else:
             # Just try a random move and see what happens
             commands = [Dir.N]
 
+    return commands, temp_visited, visited_pos
+
+class FrontierPlanner:
+    """ Plans whole rounds over the known tiles. Goes to the exit once it is seen, else to the tile whose view shows the
+    most unknown tiles for the cheapest way there, then on from there while the next one is worth its cost and the
+    moves of the round last. The unknown tiles that the views on the way will show are not counted again. Portals are
+    only entered once there is nothing left to see in the current map. """
+    def __init__(self, game_state: GameState, known_maps: Dict[int, KnownMap]):
+        self.game_state = game_state
+        self.known_maps = known_maps
+        self.open_maps: Dict[int, bool] = {} # whether the maps behind the portals still have something to see, by id
+        self.visibility = 0 # of the views from the tiles that are neither Fog nor Tower
+        self.max_gain = 0 # the most unknown tiles a view can show
+
+    def plan(self) -> List[str]:
+        game_state = self.game_state
+        known = known_map(game_state, self.known_maps)
+        index = known.index(game_state.pos)
+        self.open_maps = {} # the maps change every round
+        self.visibility = game_state.visibility() - game_state.xray_on - self.tile_visibility(known, index)
+        self.max_gain = (2 * (self.visibility + 1) + 1) ** 2 # from a Tower
+        directions = dict(zip(known.offsets, [Dir.N, Dir.S, Dir.W, Dir.E]))
+        covered: Set[int] = set() # unknown tiles shown by the views of the commands planned so far
+
+        commands = []
+        while len(commands) < game_state.moves:
+            found = self.search(known, index, covered, worth_it=bool(commands))
+            if found is None:
+                break
+
+            path, enter_portal = found
+            for next_index in path[:game_state.moves - len(commands)]:
+                commands.append(directions[next_index - index])
+                index = next_index
+                covered.update(self.unknown_in_view(known, index, covered))
+                if STOPS[known.codes[index]]:
+                    return commands
+
+            if path and index != path[-1]:
+                break # out of moves on the way
+            if enter_portal:
+                if len(commands) < game_state.moves:
+                    commands.append('P')
+                break
+
+        if not commands:
+            if game_state.xray_points > 0:
+                commands = ['X']
+            else:
+                commands = [Dir.N]
+        return commands
+
+    @staticmethod
+    def tile_visibility(known: KnownMap, index: int) -> int:
+        """ What the tile at `index` adds to the visibility, GameState.visibility() without the rest """
+        tile_type = tiles.CODE_TO_TYPE[known.codes[index]]
+        return (tile_type == tiles.Tower) - (tile_type == tiles.Fog)
+
+    def unknown_in_view(self, known: KnownMap, index: int, covered: Set[int]) -> List[int]:
+        """ The unknown tiles the view from `index` will show, besides the `covered` ones """
+        codes = known.codes
+        visibility = self.visibility + self.tile_visibility(known, index)
+        row, col = divmod(index, known.width)
+        # Clipped to the map, the rows of `codes` follow each other
+        left, right = max(col - visibility, 0), min(col + visibility + 1, known.width)
+        top, bottom = max(row - visibility, 0), min(row + visibility + 1, len(codes) // known.width)
+
+        unknown = []
+        for row in range(top, bottom):
+            start, end = row * known.width + left, row * known.width + right
+            found = codes.find(tiles.UnknownTile.code, start, end)
+            while found >= 0:
+                if found not in covered:
+                    unknown.append(found)
+                found = codes.find(tiles.UnknownTile.code, found + 1, end)
+        return unknown
+
+    def search(self, known: KnownMap, start: int, covered: Set[int], worth_it: bool = False,
+               back: bool = True) -> Tuple[List[int], bool] | None:
+        """ Dijkstra from `start` to the best target, returns the tiles of the way there (without `start`) and whether
+        it ends by entering a portal. With `worth_it`, only a target that shows more than it costs is taken. With
+        `back`, goes back through the portal this map was entered by when there is nothing left to see in it. """
+        codes = known.codes
+        anchor = known.index(known.map.anchor)
+        back_portal = anchor if back and known.map.prev_map is not None else None
+        # Every map entered through a portal is a new one, even when the portal leads to tiles seen in another map, so
+        # the portals of a code already taken to get here are left alone or the maps would go on forever
+        entered = set()
+        map = known.map
+        while map.prev_map is not None:
+            entered.add(int(map[map.anchor]))
+            map = map.prev_map
+        back_portal_found = False
+        portal = None # the closest one to another map with something to see
+        exit_seen = codes.find(tiles.Exit.code) >= 0 # then it is the target, if the known tiles lead to it
+
+        best_score, best = 0 if worth_it else math.inf, None
+        dist = {start: 0}
+        parents: Dict[int, int] = {}
+        heap = [(0, start)]
+        while heap:
+            cost, index = heapq.heappop(heap)
+            if cost > dist[index]:
+                continue
+            if not exit_seen and cost - GAIN_WEIGHT * self.max_gain >= best_score:
+                break # nothing further can be better
+
+            if index == back_portal:
+                back_portal_found = True
+            elif index != start:
+                if codes[index] == tiles.Exit.code:
+                    return self.path(parents, start, index), False
+
+                gain = len(self.unknown_in_view(known, index, covered))
+                score = cost - GAIN_WEIGHT * gain
+                if gain and score < best_score:
+                    best_score, best = score, index
+
+                if (portal is None and tiles.CODE_TO_TYPE[codes[index]] == tiles.Portal and
+                        codes[index] not in entered and self.is_open(known.map.portal2maps.get(known.pos(index)))):
+                    portal = index
+
+            for offset in known.offsets:
+                neighbor = index + offset
+                step_cost = STEP_COSTS[codes[neighbor]]
+                if step_cost is None:
+                    continue
+
+                neighbor_cost = cost + step_cost
+                if neighbor_cost < dist.get(neighbor, neighbor_cost + 1):
+                    dist[neighbor] = neighbor_cost
+                    parents[neighbor] = index
+                    heapq.heappush(heap, (neighbor_cost, neighbor))
+
+        if best is not None:
+            return self.path(parents, start, best), False
+        if worth_it:
+            return None
+        if portal is not None:
+            return self.path(parents, start, portal), True
+        if back_portal_found:
+            return self.path(parents, start, back_portal), True
+        return None
+
+    def is_open(self, portal_map: Tuple[Map, Any] | None) -> bool:
+        """ Whether entering a portal leads to something to see, always the case the first time """
+        if portal_map is None:
+            return True
+
+        map = portal_map[0]
+        if id(map) not in self.open_maps:
+            known = self.known_maps.get(id(map))
+            self.open_maps[id(map)] = True # in case the maps lead to each other
+            if known is not None:
+                self.open_maps[id(map)] = self.search(known, known.index(map.anchor), set(), back=False) is not None
+        return self.open_maps[id(map)]
+
+    @staticmethod
+    def path(parents: Dict[int, int], start: int, end: int) -> List[int]:
+        path = []
+        while end != start:
+            path.append(end)
+            end = parents[end]
+        return path[::-1]
+
+def update_frontier(game_state: GameState, response: Dict[str, Any]):
+    """ update() for the frontier planner, which keeps nothing but the maps """
+    play_commands(game_state, server_commands(response))
+    game_state.next_round_moves = int(response[MOVES])
+    game_state.new_round()
+
+def run(game_state: GameState, url, uuid, discovered_forward_traps: Set[Pos], known_maps: Dict[int, KnownMap],
+        wait_for_input=False, planner: FrontierPlanner | None = None):
+    global TOTAL_ROUNDS
+    global TOTAL_MOVES
+    global TOTAL_XRAY
+    global START_TIME
+
+    if planner is not None:
+        commands = planner.plan()
+    else:
+        commands, temp_visited, visited_pos = plan(game_state, known_maps)
+    if commands == ['X']:
+        TOTAL_XRAY += 1
+
     TOTAL_MOVES += len(commands)
     TOTAL_ROUNDS += 1
 
@@ -278,26 +596,45 @@ def run(game_state: GameState, url, uuid, discovered_forward_traps: Set[Pos], wa
 
         exit()
 
-    commands = sorted([(int(key[len(COMMAND):]), val) for key, val in response.items() if key.startswith(COMMAND)])
-    game_state.first_trap = None
-    all_visited_pos = []
-    prev_pos = game_state.pos
+    if planner is not None:
+        update_frontier(game_state, response)
+    else:
+        update(game_state, response, temp_visited, visited_pos, discovered_forward_traps)
 
-    # Save these in case we step in a portal
-    current_map = game_state.current_map
-    current_visited = game_state.visited
-    for _, command_dict in commands:
+def server_commands(response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """ The commands played by the server, in order, with their views """
+    return [val for _, val in sorted((int(key[len(COMMAND):]), val) for key, val in response.items()
+                                     if key.startswith(COMMAND))]
+
+def play_commands(game_state: GameState, commands: List[Dict[str, Any]]) -> List[Pos]:
+    """ Plays the commands on the game state, returns the positions they went through """
+    all_visited_pos = []
+    for command_dict in commands:
         views = command_dict[VIEW]
-        command = command_dict['name']
 
         if isinstance(views, str):
             views = [views]
 
-        game_state.perform_command(command, views=views)
+        game_state.perform_command(command_dict['name'], views=views)
         all_visited_pos.extend(game_state.current_move_visited_pos)
 
+    return all_visited_pos
+
+def update(game_state: GameState, response: Dict[str, Any], temp_visited: Dict[Pos, VisitNode], visited_pos: List[Pos],
+           discovered_forward_traps: Set[Pos]):
+    """ Plays the commands the server answered with on the game state and commits what plan() found out about the
+    positions they went through """
+    commands = server_commands(response)
+    game_state.first_trap = None
+    prev_pos = game_state.pos
+
+    # Save these in case we step in a portal
+    current_map = game_state.current_map
+    current_visited = game_state.visited
+    all_visited_pos = play_commands(game_state, commands)
+
     # Check if last command was entering a portal
-    if commands and command == 'P' and command_dict["successful"] == "1":
+    if commands and commands[-1]['name'] == 'P' and commands[-1]["successful"] == "1":
         entered_portal = True
         all_visited_pos.pop() # remove portal pos (will be treated separately)
     else:
@@ -381,7 +718,13 @@ def main(args=None):
     if not url.startswith('http://'):
         url = 'http://' + url
 
+    global TRANSPORT
+    if args.stream_port is not None:
+        TRANSPORT = StreamClient(args.address.removeprefix('http://').split(':')[0], args.stream_port)
+
     game_state, uuid, discovered_forward_traps = connect(None, url, None, None)
+    known_maps: Dict[int, KnownMap] = {}
+    planner = FrontierPlanner(game_state, known_maps) if args.planner == "frontier" else None
 
     START_TIME = time.time()
     while True:
@@ -389,7 +732,7 @@ def main(args=None):
         if args.manual:
             run_manual(game_state, url, uuid)
         else:
-            run(game_state, url, uuid, discovered_forward_traps, args.wait_for_input)
+            run(game_state, url, uuid, discovered_forward_traps, known_maps, args.wait_for_input, planner)
         # except Exception as e: # TODO
         #     logger.exception(e)
         #     # print(e, trace)
@@ -0,0 +1,140 @@
+"""Computes difficulty metrics of a corpus of mazes in parallel and writes them to one CSV or JSON file"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from common.game_elements import Map
+from common.graph import MazeGraph
+from common.solver import Solver
+import common.tiles as tiles
+
+FIELDS = ['file', 'width', 'height', 'path_count', 'solution_length', 'dead_ends', 'junctions', 'branching_factor',
+          'traps', 'trap_density', 'portals', 'portal_density', 'optimal_rounds', 'optimal_commands']
+
+def open_degrees(arr: np.ndarray) -> np.ndarray:
+    """ Number of open (not wall) neighbors of every cell, 0 on the walls """
+    is_open = arr != tiles.Wall.code
+    padded = np.pad(is_open, 1).astype(np.uint8)
+    degrees = padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+    return np.where(is_open, degrees, 0)
+
+def analyze(maze: Map | np.ndarray, solve: bool = True) -> Dict[str, Any]:
+    arr = np.asarray(maze)
+    graph = MazeGraph(arr)
+    path_count = len(graph)
+
+    degrees = open_degrees(arr)
+    junctions = degrees >= 3
+    num_traps = len(graph.traps)
+    num_portals = int(np.count_nonzero((graph.codes >= tiles.Portal.first_portal()) &
+                                       (graph.codes <= tiles.Portal.last_portal())))
+    # Ways out of the cells where the agent has to choose
+    branching_factor = float(degrees[junctions].mean()) if junctions.any() else 0.0
+
+    # None when the maze has no entrance or no exit, or they aren't connected
+    solution_length = None
+    if graph.entrance >= 0 and graph.exit >= 0:
+        distance = int(graph.bfs([graph.entrance]).dist[graph.exit])
+        solution_length = distance if distance >= 0 else None
+
+    metrics = {
+        'width': arr.shape[1],
+        'height': arr.shape[0],
+        'path_count': path_count,
+        'solution_length': solution_length,
+        'dead_ends': int((degrees == 1).sum()),
+        'junctions': int(junctions.sum()),
+        'branching_factor': round(branching_factor, 4),
+        'traps': num_traps,
+        'trap_density': round(num_traps / path_count, 6),
+        'portals': num_portals,
+        'portal_density': round(num_portals / path_count, 6),
+        'optimal_rounds': None,
+        'optimal_commands': None,
+    }
+
+    if solve and solution_length is not None:
+        solution = Solver(arr).solve()
+        if solution is not None:
+            metrics['optimal_rounds'] = solution.rounds
+            metrics['optimal_commands'] = solution.num_commands
+
+    return metrics
+
+def analyze_file(task) -> Dict[str, Any]:
+    path, solve = task
+    return {'file': path.name, **analyze(Map.load_from_file(path), solve)}
+
+def find_mazes(paths: List[Path]) -> List[Path]:
+    mazes = []
+    for path in paths:
+        mazes.extend(sorted(path.glob('*.png')) if path.is_dir() else [path])
+    return mazes
+
+def write_results(output: Path, results: List[Dict[str, Any]]):
+    if output.suffix == '.csv':
+        with open(output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+def get_parser():
+    # Create the argument parser
+    parser = argparse.ArgumentParser(description="Compute difficulty metrics of mazes across a pool of processes.")
+
+    # Add arguments
+    parser.add_argument(
+        "mazes",
+        type=Path,
+        nargs="+",
+        help="Maze files, or directories whose .png files are all mazes."
+    )
+    parser.add_argument(
+        "--output", "-o",
+        type=Path,
+        required=True,
+        help="Where the metrics are saved, CSV if it ends with .csv, else JSON."
+    )
+    parser.add_argument(
+        "--no-solve",
+        action="store_true",
+        help="Skip the solver (optimal rounds and commands), by far the slowest metric on large mazes."
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes."
+    )
+
+    return parser
+
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+
+    tasks = [(path, not args.no_solve) for path in find_mazes(args.mazes)]
+    if not tasks:
+        parser.error('No mazes found')
+
+    if args.jobs <= 1:
+        results = [analyze_file(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(analyze_file, tasks, chunksize=max(1, len(tasks) // (4 * args.jobs))))
+
+    write_results(args.output, results)
+    print(f'Analyzed {len(results)} mazes into {args.output}')
+    return results
+
+if __name__ == "__main__":
+    main()
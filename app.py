@@ -1,17 +1,33 @@
 """This file contains the implementation of the server"""
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, Response, request, jsonify
+import logging
+import numpy as np
 import json
+import os
 from pathlib import Path
-from typing import List, Dict
+from typing import Any, List, Dict
 import time
 import threading
-import viewerV2
+import socketserver
+import distances
+import events
+import journal
 import maze
+import metrics
+import sessions
 import queue
 import random
+import scheduler
+import socket
+import struct
+import uuid
+from werkzeug.serving import BaseWSGIServer
 
 from common.game_elements import Map, GameState, Pos, serialize_view, deserialize_view
+from common.pushes import PushTable
+from common.transport import encode_frame, decode_frame
 import common.tiles as tiles
 
 def get_parser():
@@ -43,6 +59,111 @@ def get_parser():
         help="Set viewers to show fog on areas not viewed by agent"
     )
 
+    parser.add_argument(
+        "--stream-port",
+        type=int,
+        help="Also serve agents over a persistent newline-delimited JSON stream on this port"
+    )
+
+    parser.add_argument(
+        "--race",
+        action="store_true",
+        help="Race mode: all agents play the same maze simultaneously, no viewers are started"
+    )
+
+    parser.add_argument(
+        "--journal",
+        type=Path,
+        help="Directory where a binary journal of every session is written (see journal.py to replay them)"
+    )
+
+    parser.add_argument(
+        "--sessions",
+        help="Keep sessions serialized in a store shared by workers: 'memory' or 'sqlite:<path>'"
+    )
+
+    parser.add_argument(
+        "--seed", "-s",
+        type=int,
+        default=DEFAULT_SEED,
+        help="Seed of the maze generated in race mode, when no maze is given"
+    )
+
+    parser.add_argument(
+        "--max-traps",
+        type=int,
+        default=DEFAULT_NOF_TRAPS,
+        help="Max number of traps of each type in the mazes generated by the server"
+    )
+
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        help="Address the server listens on"
+    )
+
+    parser.add_argument(
+        "--port", "-p",
+        type=int,
+        default=DEFAULT_PORT,
+        help="Port the HTTP server listens on"
+    )
+
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="Serve without the debugger and the reloader, with a fixed pool of worker threads. No viewer windows are "
+             "started, viewers can still follow the agents through /events"
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=DEFAULT_THREADS,
+        help="Number of worker threads in production mode. Every open viewer event stream holds one of them"
+    )
+
+    parser.add_argument(
+        "--max-content-length",
+        type=int,
+        default=DEFAULT_MAX_CONTENT_LENGTH,
+        help="Largest request body accepted, in bytes. Bigger requests are refused with 413"
+    )
+
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Rounds per second allowed for each agent on average, more are refused with 429 (default: no limit)"
+    )
+
+    parser.add_argument(
+        "--burst",
+        type=int,
+        default=DEFAULT_BURST,
+        help="Rounds an agent may send in a burst above its rate limit"
+    )
+
+    parser.add_argument(
+        "--max-concurrent-rounds",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENT_ROUNDS,
+        help="Rounds simulated at the same time, the others wait their turn"
+    )
+
+    parser.add_argument(
+        "--max-waiting-rounds",
+        type=int,
+        default=DEFAULT_MAX_WAITING_ROUNDS,
+        help="Rounds allowed to wait for their turn, more are refused with 429"
+    )
+
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=DEFAULT_MAX_WAIT,
+        help="Seconds a round may wait for its turn before being refused with 429"
+    )
+
     return parser
 
 server = Flask(__name__)
@@ -52,7 +173,7 @@ COMMAND_NAME_FIELD = 'name'
 COMMAND_RESULT_FIELD = 'successful'
 VIEW_FIELD = 'view'
 MOVES_FIELD = 'moves'
-UUID_CURRENT_COUNTER = 0 # TODO change to a more suitable, random UUID scheme
+LAST_AGENT_UUID: str | None = None # the agent followed by viewers that don't ask for one
 AGENTS : Dict[str, GameState] = {} # dict to identify agents using uuid
 AGENT_VIEWER: Dict[str, bool] = {}
 AGENTS_TIME : Dict[str, float] = {} # dict to identify the agent and the connection time
@@ -61,7 +182,30 @@ MAZE = None
 ARGS = None
 EVENT_QUEUE = queue.Queue()
 
-EVENT_QUEUES : Dict[str, queue.Queue]= {}
+EVENT_LOGS : Dict[str, events.EventLog] = {} # events of each agent, read by any number of viewers
+EVENT_KEEPALIVE = 15 # seconds without events before a comment is sent to check the viewer is still there
+EVENT_PACING = 0.1 # seconds between events sent to a viewer, so it can animate them
+
+# In race mode all the agents play the same maze at the same time, without viewers
+RACE_MODE = False
+REGISTRATION_LOCK = threading.Lock()
+AGENTS_STATS : Dict[str, Dict[str, Any]] = {} # per agent statistics shown on the leaderboard
+
+MAZE_SEED = None # seed of MAZE, when it was generated by the server
+MAZE_ID = None # id of MAZE, see Map.digest()
+MAZES : Dict[bytes, Map] = {} # all the mazes served by this process, by id
+PUSH_TABLES : Dict[bytes, PushTable] = {} # chains of the push traps of MAZES, resolved once for all the agents
+DISTANCES_TO_EXIT : Dict[bytes, np.ndarray] = {} # steps from every cell of MAZES to their exit, for the leaderboard
+MAZE_AGENTS : Dict[bytes, int] = {} # number of agents playing each of MAZES, the ones no agent plays are freed
+
+# When set, game states are kept serialized in this store instead of AGENTS, so any worker can resume any session
+SESSION_STORE: sessions.SessionStore | None = None
+AGENTS_MAZE_ID : Dict[str, bytes] = {}
+MAZE_SHAPE = struct.Struct('<II') # height and width, before the tiles of a maze kept in SESSION_STORE
+# Before the game state in SESSION_STORE: last activity, start and end (-1 while playing) times, rounds, moves and
+# X-Rays used, closest distance to the exit (-1 if unknown), so that no worker restarts the clock or the stats
+SESSION_HEADER = struct.Struct('<dddIIIi')
+JOURNAL: journal.JournalWriter | None = None
 
 # Maximum time allowed for a client in seconds. It will take in account the time of
 # the client's first request until a request that comes after this value.
@@ -75,51 +219,215 @@ CLIENT_GAME_STATE = None
 
 DEFAULT_MAZE_HEIGHT = 50
 DEFAULT_MAZE_WIDTH  = 40
-DEFAULT_NOF_TRAPS = 0
+DEFAULT_NOF_TRAPS = 10
 DEFAULT_SEED = None
 
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5000
+DEFAULT_THREADS = 16
+DEFAULT_MAX_CONTENT_LENGTH = 16 * 1024 # a request carries at most 10 commands
+DEFAULT_BURST = 20
+DEFAULT_MAX_CONCURRENT_ROUNDS = 4 # rounds are CPU bound, more threads running them only contend for the GIL
+DEFAULT_MAX_WAITING_ROUNDS = 256
+DEFAULT_MAX_WAIT = 1.0
+
 AWAIT_FOR_INPUT = False
 VIEWER_FOG = False
+VIEWER_SERVER_URL = f'http://{DEFAULT_HOST}:{DEFAULT_PORT}' # where the viewers reach this server
+
+# Admission control: rounds are simulated by at most SCHEDULER.max_running threads at a time, agents take turns
+# and each one is limited by its own token bucket when a rate limit is set
+SCHEDULER = scheduler.FairScheduler(DEFAULT_MAX_CONCURRENT_ROUNDS, DEFAULT_MAX_WAITING_ROUNDS,
+                                    max_wait=DEFAULT_MAX_WAIT)
+RATE_LIMITS : Dict[str, scheduler.TokenBucket] = {}
+RETRY_AFTER_FIELD = 'retry_after'
+
+REQUEST_DURATION = metrics.Histogram(
+    'maze_request_duration_seconds', 'Time spent handling a request, by route', ('route',))
+CHECK_MOVES_DURATION = metrics.Histogram(
+    'maze_check_moves_duration_seconds', 'Time spent simulating a round of commands')
+DISGUISE_TRAPS_DURATION = metrics.Histogram(
+    'maze_disguise_traps_duration_seconds', 'Time spent building a serialized view')
+VIEW_DURATION = metrics.Histogram('maze_view_duration_seconds', 'Time spent extracting a view from the map')
+MAZE_GENERATION_DURATION = metrics.Histogram(
+    'maze_generation_duration_seconds', 'Time spent generating a maze on registration',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+COMMANDS = metrics.Counter('maze_commands', 'Commands received from agents')
+VIEW_CACHE_HITS = metrics.Counter('maze_view_cache_hits', 'Views reused within a round instead of being rebuilt')
+REJECTED_ROUNDS = metrics.Counter('maze_rejected_rounds', 'Rounds refused because of overload, by reason', ('reason',))
+RUNNING_ROUNDS = metrics.Gauge('maze_running_rounds', 'Rounds being simulated')
+WAITING_ROUNDS = metrics.Gauge('maze_waiting_rounds', 'Rounds waiting for their turn to be simulated')
+ACTIVE_SESSIONS = metrics.Gauge('maze_active_sessions', 'Registered agents that have not timed out')
+EVENT_LOG_SIZE = metrics.Gauge('maze_event_log_size', 'Events kept for the viewers of all the agents')
+
+ACTIVE_SESSIONS.set_function(
+    lambda: sum(1 for last_seen in list(AGENTS_TIME.values()) if time.time() - last_seen <= MAX_TIME_ALLOWED)
+)
+# A label per agent would keep a series for every agent that ever played
+EVENT_LOG_SIZE.set_function(lambda: sum(len(event_log) for event_log in list(EVENT_LOGS.values())))
+RUNNING_ROUNDS.set_function(lambda: SCHEDULER.running)
+WAITING_ROUNDS.set_function(lambda: SCHEDULER.waiting)
 
 @server.route('/api/register_agent', methods=['POST'])
+@REQUEST_DURATION.labels(route='register').time()
 def register_agent():
-    global UUID_CURRENT_COUNTER
-    global MAZE
-    global FRIENDLY_MODE
-
     if request.is_json:
         if not request.get_json(): # Request is empty
-            UUID_CURRENT_COUNTER += 1
-            # Suppose we have maximum number of next_round_moves available
-            if ARGS.maze is None:
-                m = maze.generate_maze(random.randint(20,60), random.randint(20,60))
-                m.write_to_file("temp.png")
-                MAZE = Map.load_from_file("temp.png")
-                
-            AGENTS[str(UUID_CURRENT_COUNTER)] = GameState(maps=[MAZE], moves=10, next_round_moves=10, xray_points=10)
-            AGENT_VIEWER[str(UUID_CURRENT_COUNTER)] = False
-
-            EVENT_QUEUES[str(UUID_CURRENT_COUNTER)] = queue.Queue()
-
-            threading.Thread(target=viewerV2.create_viewer, args=(AWAIT_FOR_INPUT,VIEWER_FOG)).start()
-            
-            # Register the first time the client contacted the server
-            AGENTS_TIME[str(UUID_CURRENT_COUNTER)] = int(time.time())
-            
-            if FRIENDLY_MODE:
-                return jsonify(create_friendly_response()), 200
-            else:
-                return jsonify({'UUID': str(UUID_CURRENT_COUNTER)}), 200
+            return jsonify(register_new_agent()), 200
 
     return jsonify({}), 400
 
-def create_friendly_response():
+def register_new_agent():
+    """ Creates the game state of a new agent and returns the registration response """
+    global LAST_AGENT_UUID
+    global MAZE
+    global MAZE_SEED
+    global FRIENDLY_MODE
+
+    with REGISTRATION_LOCK:
+        # Random, so that the UUIDs given by different workers sharing a session store don't collide
+        agent_uuid = LAST_AGENT_UUID = uuid.uuid4().hex
+
+        # Suppose we have maximum number of next_round_moves available
+        if ARGS.maze is None and not RACE_MODE:
+            MAZE_SEED = random.getrandbits(32)
+            with MAZE_GENERATION_DURATION.time():
+                m = maze.generate_maze(random.randint(20,60), random.randint(20,60), MAZE_SEED,
+                                       max_traps=ARGS.max_traps)
+            m.write_to_file("temp.png")
+            set_maze(Map.load_from_file("temp.png"))
+
+        # All the agents share the same map, tiles they change are kept in their own overlay
+        AGENTS[agent_uuid] = GameState(maps=[MAZE], moves=10, next_round_moves=10, xray_points=10, shared_map=True,
+                                       push_table=PUSH_TABLES[MAZE_ID])
+        AGENT_VIEWER[agent_uuid] = False
+        AGENTS_STATS[agent_uuid] = {'rounds': 0, 'moves': 0, 'xray': 0, 'start': time.time(), 'end': None,
+                                    'distance_to_exit': int(DISTANCES_TO_EXIT[MAZE_ID][MAZE.entrance])}
+        use_maze(agent_uuid, MAZE_ID)
+
+        if not RACE_MODE:
+            EVENT_LOGS[agent_uuid] = events.EventLog()
+
+        # Register the first time the client contacted the server
+        AGENTS_TIME[agent_uuid] = int(time.time())
+
+        if SESSION_STORE is not None:
+            save_session(agent_uuid)
+
+        if JOURNAL is not None:
+            JOURNAL.open_session(agent_uuid, MAZE, MAZE_SEED)
+
+    # A production server is usually headless, its viewers connect to /events from elsewhere
+    if not RACE_MODE and not ARGS.production:
+        import viewerV2 # pulls in tkinter, only needed when viewers are started
+        viewerV2.SERVER_URL = VIEWER_SERVER_URL
+
+        threading.Thread(target=viewerV2.create_viewer, args=(AWAIT_FOR_INPUT,VIEWER_FOG,agent_uuid)).start()
+
+    if FRIENDLY_MODE:
+        return create_friendly_response(agent_uuid)
+    else:
+        return {'UUID': agent_uuid}
+
+def set_maze(new_maze: Map, path: Path | None = None):
+    """ Makes `new_maze` the maze of the new agents, `path` is the file it was loaded from (its distances are cached
+    next to it) """
+    global MAZE
+    global MAZE_ID
+
+    previous_id = MAZE_ID
+    MAZE = new_maze
+    MAZE_ID = add_maze(new_maze, path)
+    if SESSION_STORE is not None:
+        SESSION_STORE.put_maze(MAZE_ID, maze_to_bytes(new_maze))
+
+    # It was only kept for the new agents
+    if previous_id is not None and previous_id != MAZE_ID and previous_id not in MAZE_AGENTS:
+        forget_maze(previous_id)
+
+def add_maze(new_maze: Map, path: Path | None = None) -> bytes:
+    """ Prepares a maze to be played on, returns its id """
+    maze_id = new_maze.digest()
+    MAZES[maze_id] = new_maze
+    PUSH_TABLES[maze_id] = PushTable(new_maze)
+
+    fields = distances.load(path, new_maze) if path is not None else distances.compute(new_maze)
+    DISTANCES_TO_EXIT[maze_id] = fields.to_exit
+    return maze_id
+
+def forget_maze(maze_id: bytes):
+    MAZES.pop(maze_id, None)
+    PUSH_TABLES.pop(maze_id, None)
+    DISTANCES_TO_EXIT.pop(maze_id, None)
+
+def use_maze(agent_uuid: str, maze_id: bytes):
+    """ Makes `maze_id` the maze of an agent, counting the agents of every maze """
+    previous_id = AGENTS_MAZE_ID.get(agent_uuid)
+    if previous_id == maze_id:
+        return
+
+    AGENTS_MAZE_ID[agent_uuid] = maze_id
+    MAZE_AGENTS[maze_id] = MAZE_AGENTS.get(maze_id, 0) + 1
+    if previous_id is not None:
+        release_maze(previous_id)
+
+def release_maze(maze_id: bytes):
+    """ One agent less on a maze, which is freed when no agent plays it and it isn't the one of the new agents """
+    MAZE_AGENTS[maze_id] -= 1
+    if MAZE_AGENTS[maze_id] == 0:
+        del MAZE_AGENTS[maze_id]
+        if maze_id != MAZE_ID:
+            forget_maze(maze_id)
+
+def maze_to_bytes(maze_map: Map) -> bytes:
+    return MAZE_SHAPE.pack(*maze_map.shape) + np.ascontiguousarray(maze_map, dtype=np.uint8).tobytes()
+
+def maze_from_bytes(data: bytes) -> Map:
+    height, width = MAZE_SHAPE.unpack_from(data)
+    return Map(nparr=np.frombuffer(data, dtype=np.uint8, offset=MAZE_SHAPE.size).reshape(height, width).copy())
+
+def load_session(agent_uuid: str) -> bool:
+    """ Loads the game state, times and stats of an agent from the session store, returns False if it doesn't exist """
+    data = SESSION_STORE.get(agent_uuid)
+    if data is None:
+        return False
+    if len(data) < SESSION_HEADER.size:
+        raise ValueError("Not a session record")
+
+    last_seen, start, end, rounds, moves, xray, distance = SESSION_HEADER.unpack_from(data)
+    data = data[SESSION_HEADER.size:]
+
+    # The maze was generated or loaded by another worker
+    maze_id = GameState.maze_id_of(data)
+    if maze_id not in MAZES:
+        stored_maze = SESSION_STORE.get_maze(maze_id)
+        if stored_maze is not None:
+            add_maze(maze_from_bytes(stored_maze))
+
+    AGENTS[agent_uuid] = GameState.from_bytes(data, MAZES)
+    use_maze(agent_uuid, maze_id)
+    AGENTS[agent_uuid].push_table = PUSH_TABLES[AGENTS_MAZE_ID[agent_uuid]]
+    AGENTS_TIME[agent_uuid] = last_seen
+    AGENTS_STATS[agent_uuid] = {'rounds': rounds, 'moves': moves, 'xray': xray, 'start': start,
+                                'end': end if end >= 0 else None,
+                                'distance_to_exit': distance if distance >= 0 else None}
+    return True
+
+def save_session(agent_uuid: str):
+    stats = AGENTS_STATS[agent_uuid]
+    end = stats['end'] if stats['end'] is not None else -1
+    distance = stats.get('distance_to_exit')
+    header = SESSION_HEADER.pack(AGENTS_TIME[agent_uuid], stats['start'], end, stats['rounds'], stats['moves'],
+                                 stats['xray'], distance if distance is not None else -1)
+    SESSION_STORE.put(agent_uuid, header + AGENTS[agent_uuid].to_bytes(AGENTS_MAZE_ID[agent_uuid]))
+
+def create_friendly_response(agent_uuid: str):
     global MAZE
-    global UUID_CURRENT_COUNTER
     global AGENTS
 
     response = {
-        'UUID': str(UUID_CURRENT_COUNTER),
+        'UUID': agent_uuid,
         'x': '',
         'y': '',
         'width': '',
@@ -127,7 +435,7 @@ def create_friendly_response():
         'view': '',
         'moves': '10' # default number of moves
     }
-    current_game_state = AGENTS[str(UUID_CURRENT_COUNTER)]
+    current_game_state = AGENTS[agent_uuid]
 
     response['x'] = str(int(current_game_state.pos.x))
     response['y'] = str(int(current_game_state.pos.y))
@@ -140,48 +448,87 @@ def create_friendly_response():
     response['view'] = disguise_traps(current_game_state)
 
     if VIEWER_FOG:
-        game_state = AGENTS[str(UUID_CURRENT_COUNTER)]
-        visibility = game_state.visibility()
-        first_pos  = (int(game_state.pos.x - visibility), int(game_state.pos.y - visibility))
-        second_pos = (int(game_state.pos.x + visibility), int(game_state.pos.y + visibility))
+        visibility = current_game_state.visibility()
+        first_pos  = (int(current_game_state.pos.x - visibility), int(current_game_state.pos.y - visibility))
+        second_pos = (int(current_game_state.pos.x + visibility), int(current_game_state.pos.y + visibility))
 
         # Format is {"view": [x1, y1, x2, y2]}
-        EVENT_QUEUES[str(UUID_CURRENT_COUNTER)].put(json.dumps({'view': [*first_pos, *second_pos]}))
+        publish_event(agent_uuid, {'view': [*first_pos, *second_pos]})
 
     return response
 
+def publish_event(agent_uuid: str, event: dict):
+    """ Adds an event to the log read by the viewers of an agent, if the agent has one """
+    event_log = EVENT_LOGS.get(agent_uuid)
+    if event_log is not None:
+        event_log.publish(json.dumps(event))
+
 
 @server.route('/api/receive_moves', methods=['POST'])
+@REQUEST_DURATION.labels(route='receive_moves').time()
 def receive_client_moves():
     """ 
         This method will receive the moves from the agent, parse the JSON
         and create an array with the moves.
     """
-    global UUID_CURRENT_WORKER
-
     if request.is_json:
         # print(request.remote_addr)
         agent_uuid = request.get_json()['UUID']
 
         # print("Am primit de la agentul asta: " + agent_uuid)
 
-        if time.time() - AGENTS_TIME.get(agent_uuid, 0) > MAX_TIME_ALLOWED:
-            # TODO: when a client gets over the allowed time limit, maybe remove the UUID and reset the connection
-            return jsonify({'end':'0'}), 200
-
-        AGENTS_TIME[agent_uuid] = time.time()
-
-        moves = request.get_json()['input']
-
-        if len(moves) > 10:
-            return jsonify({"error": "Invalid number of moves"}), 400
-        
-        if AWAIT_FOR_INPUT:
-            while AGENT_VIEWER[agent_uuid] is False:
-                continue
-            AGENT_VIEWER[agent_uuid] = False
-
-        return jsonify(check_moves(agent_uuid, moves)), 200
+        response, status = process_moves(agent_uuid, request.get_json()['input'])
+        if RETRY_AFTER_FIELD in response:
+            return jsonify(response), status, {'Retry-After': str(max(1, round(response[RETRY_AFTER_FIELD])))}
+        return jsonify(response), status
+
+def process_moves(agent_uuid: str, moves: str):
+    """ Runs one round of commands for an agent, returns the response and its HTTP status code """
+    if SESSION_STORE is not None:
+        try:
+            if not load_session(agent_uuid):
+                return {"error": "Unknown UUID"}, 400
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+    if time.time() - AGENTS_TIME.get(agent_uuid, 0) > MAX_TIME_ALLOWED:
+        # TODO: when a client gets over the allowed time limit, maybe remove the UUID and reset the connection
+        end_game(agent_uuid)
+        return {'end':'0'}, 200
+
+    if not isinstance(moves, str):
+        return {"error": "The input must be a string of commands"}, 400
+    if len(moves) > 10:
+        return {"error": "Invalid number of moves"}, 400
+
+    if ARGS is not None and ARGS.rate_limit is not None:
+        bucket = RATE_LIMITS.get(agent_uuid)
+        if bucket is None:
+            bucket = RATE_LIMITS.setdefault(agent_uuid, scheduler.TokenBucket(ARGS.rate_limit, ARGS.burst))
+
+        retry_after = bucket.take()
+        if retry_after:
+            REJECTED_ROUNDS.labels(reason='rate_limit').inc()
+            return {"error": "Rate limit exceeded", RETRY_AFTER_FIELD: round(retry_after, 3)}, 429
+
+    if AWAIT_FOR_INPUT:
+        while AGENT_VIEWER[agent_uuid] is False:
+            continue
+        AGENT_VIEWER[agent_uuid] = False
+
+    try:
+        with SCHEDULER.slot(agent_uuid):
+            # Only rounds that are played keep the agent alive
+            AGENTS_TIME[agent_uuid] = time.time()
+            response = check_moves(agent_uuid, moves)
+    except scheduler.Rejected as e:
+        REJECTED_ROUNDS.labels(reason='overload').inc()
+        return {"error": e.reason, RETRY_AFTER_FIELD: e.retry_after}, 429
+
+    if SESSION_STORE is not None and agent_uuid in AGENTS: # else end_game() saved it
+        save_session(agent_uuid)
+
+    return response, 200
 
 def create_response_json(moves: List[str]):
     """ Will create the response json, empty for now"""
@@ -212,10 +559,12 @@ def check_neigh(curr_i: int, curr_j: int, searched_i: int, searched_j: int):
 
     return False
 
+@DISGUISE_TRAPS_DURATION.time()
 def disguise_traps(game_state: GameState, pos: Pos | None = None):
     global FRIENDLY_MODE
 
-    view = game_state.view(pos)
+    with VIEW_DURATION.time():
+        view = game_state.view(pos)
     # Assume we receive a square matrix with an odd length
     agent_pos = Pos(len(view) // 2, len(view) // 2)
 
@@ -234,22 +583,42 @@ def disguise_traps(game_state: GameState, pos: Pos | None = None):
 
     return serialize_view(view)
 
+def round_view(game_state: GameState, pos: Pos, views_cache: Dict[tuple, str]):
+    """ disguise_traps() memoized for one round: bounces, rewinds and pushes often come back to the same position,
+    whose view is the same as long as the visibility and the tiles of the game state did not change """
+    key = (pos, game_state.visibility(pos), game_state.tiles_version)
+    view = views_cache.get(key)
+    if view is None:
+        view = views_cache[key] = disguise_traps(game_state, pos)
+    else:
+        VIEW_CACHE_HITS.inc()
+    return view
+
+@CHECK_MOVES_DURATION.time()
 def check_moves(agent_uuid: str, moves: List[str]):
     """"""
     global AGENTS
 
+    COMMANDS.inc(len(moves))
+
     response = create_response_json(moves)
     end_reached = False
+    results = []
+    visited_positions = []
+    views_cache: Dict[tuple, str] = {}
+    fog_published = set()
 
     for i, move in enumerate(moves):
         command_no = f"command_{i + 1}"
 
         command_result = AGENTS[agent_uuid].perform_command(move)
         response[command_no][COMMAND_RESULT_FIELD] = str(1 if command_result is None else command_result)
+        results.append(response[command_no][COMMAND_RESULT_FIELD])
+        visited_positions.extend(AGENTS[agent_uuid].current_move_visited_pos)
 
         for pos in AGENTS[agent_uuid].current_move_visited_pos:
             # Format is {"pos": [x, y]}
-            EVENT_QUEUES[agent_uuid].put(json.dumps({'pos': [int(pos.x), int(pos.y)]}))
+            publish_event(agent_uuid, {'pos': [int(pos.x), int(pos.y)]})
 
         # Check if after the previous move, the agent reached the exit
         agent_pos = AGENTS[agent_uuid].pos
@@ -262,15 +631,18 @@ def check_moves(agent_uuid: str, moves: List[str]):
 
         views = []
         for pos in AGENTS[agent_uuid].current_move_visited_pos:
-            views.append(disguise_traps(AGENTS[agent_uuid], pos))
+            views.append(round_view(AGENTS[agent_uuid], pos, views_cache))
 
             if VIEWER_FOG:
                 visibility = AGENTS[agent_uuid].visibility(pos)
-                first_pos  = (int(pos.x - visibility), int(pos.y - visibility))
-                second_pos = (int(pos.x + visibility), int(pos.y + visibility))
+                fog_rect = (int(pos.x - visibility), int(pos.y - visibility),
+                            int(pos.x + visibility), int(pos.y + visibility))
 
-                # Format is {"view": [x1, y1, x2, y2]}
-                EVENT_QUEUES[agent_uuid].put(json.dumps({'view': [*first_pos, *second_pos]}))
+                # The viewer already cleared the fog of a rectangle sent in this round
+                if fog_rect not in fog_published:
+                    fog_published.add(fog_rect)
+                    # Format is {"view": [x1, y1, x2, y2]}
+                    publish_event(agent_uuid, {'view': list(fog_rect)})
 
         if len(views) == 1:
             views = views[0]
@@ -281,18 +653,82 @@ def check_moves(agent_uuid: str, moves: List[str]):
     response[MOVES_FIELD] = str(AGENTS[agent_uuid].next_round_moves)
     AGENTS[agent_uuid].new_round()
 
+    stats = AGENTS_STATS[agent_uuid]
+    stats['rounds'] += 1
+    stats['moves'] += len(moves)
+    stats['xray'] += sum(1 for command in response.values()
+                         if isinstance(command, dict)
+                         and command[COMMAND_NAME_FIELD] == 'X' and command[COMMAND_RESULT_FIELD] == '1')
+    if end_reached and stats['end'] is None:
+        stats['end'] = time.time()
+
+    # Closest the agent got to the exit, at the end of a round
+    distance = int(DISTANCES_TO_EXIT[AGENTS_MAZE_ID[agent_uuid]][AGENTS[agent_uuid].pos])
+    best = stats.get('distance_to_exit')
+    if distance >= 0 and (best is None or distance < best):
+        stats['distance_to_exit'] = distance
+
+    if JOURNAL is not None:
+        JOURNAL.record_round(agent_uuid, ''.join(moves[:len(results)]), ''.join(results), int(response[MOVES_FIELD]),
+                             visited_positions)
+        if end_reached:
+            JOURNAL.record_end(agent_uuid)
+
     if end_reached:
+        end_game(agent_uuid)
         return {"end":"1"}
 
     return response
 
+def end_game(agent_uuid: str):
+    """ Frees what the session of an agent whose game is over holds: its game state and its maze when no other agent
+    plays it. Its stats stay for the leaderboard. """
+    if SESSION_STORE is not None and agent_uuid in AGENTS:
+        save_session(agent_uuid)
+
+    for agent_state in [AGENTS, AGENTS_TIME, AGENT_VIEWER, RATE_LIMITS]:
+        agent_state.pop(agent_uuid, None)
+
+    maze_id = AGENTS_MAZE_ID.pop(agent_uuid, None)
+    if maze_id is not None:
+        release_maze(maze_id)
+
+@server.route('/leaderboard')
+def leaderboard():
+    """ Lists all the agents, the ones that reached the exit first, ordered by rounds, moves and time taken, then the
+    others by how close they got to the exit """
+    now = time.time()
+    entries = []
+    for agent_uuid, stats in list(AGENTS_STATS.items()):
+        end = stats['end']
+        entries.append({
+            'UUID': agent_uuid,
+            'finished': end is not None,
+            'rounds': stats['rounds'],
+            'moves': stats['moves'],
+            'xray': stats['xray'],
+            'time': round((end if end is not None else now) - stats['start'], 3),
+            'distance_to_exit': 0 if end is not None else stats.get('distance_to_exit'),
+        })
+
+    def rank(entry):
+        distance = entry['distance_to_exit']
+        return (not entry['finished'], distance if distance is not None else float('inf'), entry['rounds'],
+                entry['moves'], entry['time'])
+
+    entries.sort(key=rank)
+    return jsonify(entries), 200
+
 @server.route('/character_position')
 def initial_data():
+    """ Where the viewer of the agent given by the agent_uuid parameter starts, the last agent registered if none """
     response = {}
 
-    response["agent_uuid"] = str(UUID_CURRENT_COUNTER)
-    response["entrance_x"] = str(MAZE.entrance[0])
-    response["entrance_y"] = str(MAZE.entrance[1])
+    agent_uuid = request.args.get('agent_uuid', LAST_AGENT_UUID)
+    agent_maze = MAZES.get(AGENTS_MAZE_ID.get(agent_uuid), MAZE)
+    response["agent_uuid"] = agent_uuid
+    response["entrance_x"] = str(agent_maze.entrance[0])
+    response["entrance_y"] = str(agent_maze.entrance[1])
 
     if ARGS.maze is not None:
         response["maze_file"] = str(ARGS.maze)
@@ -301,12 +737,15 @@ def initial_data():
 
     return jsonify(response)
 
-def generate_events(agent_uuid):
-    while True:
-        if agent_uuid in EVENT_QUEUES.keys():
-            event = EVENT_QUEUES[agent_uuid].get()
-            time.sleep(0.1)
-            yield f"data: {event}\n\n"
+def generate_events(event_log: events.EventLog, last_event_id: int):
+    for item in event_log.subscribe(last_event_id, timeout=EVENT_KEEPALIVE):
+        if item is None:
+            yield ": keep-alive\n\n"
+            continue
+
+        seq, event = item
+        time.sleep(EVENT_PACING)
+        yield f"id: {seq}\ndata: {event}\n\n"
 
 @server.route('/wait_for_input/<agent_uuid>')
 def wait_for_input(agent_uuid):
@@ -315,7 +754,110 @@ def wait_for_input(agent_uuid):
 
 @server.route('/events/<agent_uuid>')
 def stream(agent_uuid):
-    return Response(generate_events(agent_uuid), content_type='text/event-stream')
+    """ Streams the events of an agent. Reconnecting viewers send the id of the last event they got in the
+    Last-Event-ID header (or the last_event_id parameter) and resume after it """
+    event_log = EVENT_LOGS.get(agent_uuid)
+    if event_log is None:
+        return jsonify({"error": "Unknown UUID"}), 404
+
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', request.args.get('last_event_id', 0)))
+    except ValueError:
+        last_event_id = 0
+
+    return Response(generate_events(event_log, last_event_id), content_type='text/event-stream')
+
+@server.route('/healthz')
+def healthz():
+    """ Liveness probe, answers as long as a worker is free to handle requests """
+    return jsonify({'status': 'ok', 'sessions': len(AGENTS_TIME)}), 200
+
+@server.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+class AgentStreamHandler(socketserver.StreamRequestHandler):
+    """ Serves one agent over a persistent connection. Each line received is a JSON request and gets exactly
+    one JSON line back: an empty object registers a new agent, otherwise it carries the UUID and the input. """
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                message = decode_frame(line)
+            except ValueError:
+                response = {"error": "Invalid JSON"}
+            else:
+                response = handle_stream_message(message)
+
+            self.wfile.write(encode_frame(response))
+
+def handle_stream_message(message: Any):
+    if not isinstance(message, dict):
+        return {"error": "A request must be a JSON object"}
+
+    if not message:
+        return register_new_agent()
+
+    if 'UUID' not in message or 'input' not in message:
+        return {"error": "Missing UUID or input"}
+
+    response, _ = process_moves(str(message['UUID']), message['input'])
+    return response
+
+class AgentStreamServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+def start_stream_server(host: str, port: int):
+    stream_server = AgentStreamServer((host, port), AgentStreamHandler)
+    threading.Thread(target=stream_server.serve_forever, daemon=True).start()
+    return stream_server
+
+class PooledWSGIServer(BaseWSGIServer):
+    """ werkzeug's development server, with connections handled by a fixed pool of threads instead of a new thread
+    each. When all the workers are busy, new connections wait in the listen backlog. """
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int):
+        super().__init__(host, port, app)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='worker')
+        self.free_workers = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        self.free_workers.acquire()
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.free_workers.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+def run_production_server(host: str, port: int, threads: int):
+    # Logging every request costs more than handling most of them
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    http_server = PooledWSGIServer(host, port, server, threads)
+    print(f' * Serving on http://{host}:{port} with {threads} worker threads')
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
 
 def main(args=None):
     global ARGS
@@ -333,10 +875,44 @@ def main(args=None):
     global VIEWER_FOG
     VIEWER_FOG = ARGS.f
 
+    global RACE_MODE
+    RACE_MODE = ARGS.race
+
+    global JOURNAL
+    if ARGS.journal is not None:
+        JOURNAL = journal.JournalWriter(ARGS.journal)
+
+    global MAZE_SEED
+
+    global SESSION_STORE
+    if ARGS.sessions is not None:
+        SESSION_STORE = sessions.open_store(ARGS.sessions)
+
     if ARGS.maze is not None:
-        MAZE = Map.load_from_file(ARGS.maze)
+        set_maze(Map.load_from_file(ARGS.maze), ARGS.maze)
+    elif RACE_MODE:
+        MAZE_SEED = ARGS.seed
+        with MAZE_GENERATION_DURATION.time():
+            generated = maze.generate_maze(DEFAULT_MAZE_WIDTH, DEFAULT_MAZE_HEIGHT, ARGS.seed, max_traps=ARGS.max_traps)
+        set_maze(Map(nparr=np.asarray(generated))) # rebuild it to find the entrance and exit
+
+    server.config['MAX_CONTENT_LENGTH'] = ARGS.max_content_length
+
+    global SCHEDULER
+    SCHEDULER = scheduler.FairScheduler(ARGS.max_concurrent_rounds, ARGS.max_waiting_rounds, max_wait=ARGS.max_wait)
 
-    server.run(debug=True, threaded=True) # TODO add port arg
+    global VIEWER_SERVER_URL
+    viewer_host = '127.0.0.1' if ARGS.host in ('0.0.0.0', '::', '') else ARGS.host
+    VIEWER_SERVER_URL = f'http://{viewer_host}:{ARGS.port}'
+
+    # With debug on, werkzeug re-runs this in a child process, only the child should bind the stream port
+    if ARGS.stream_port is not None and (ARGS.production or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        start_stream_server(ARGS.host, ARGS.stream_port)
+
+    if ARGS.production:
+        run_production_server(ARGS.host, ARGS.port, ARGS.threads)
+    else:
+        server.run(host=ARGS.host, port=ARGS.port, debug=True, threaded=True)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,227 @@
+"""Measures the time agentV2 spends planning each round, playing a whole game against an in-process server, next to the
+planner it replaced (a recursive dfs() over a check_path() searching the Map itself), which must take the same
+decisions"""
+import argparse
+from collections import OrderedDict, deque
+from pathlib import Path
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import agentV2
+from agentV2 import get_temp, visit_node
+import app
+from common.game_elements import Dir, GameState, Map, Pos, State, VisitNode
+import common.tiles as tiles
+import maze
+from tests.conftest import register_agent, start_race_server
+
+def reference_check_path(map: Map, visited, temp_visited: Dict[Pos, VisitNode], pos: Pos, parent: Pos):
+    """ agentV2.check_path() as it was, copying every code and node it looks at """
+    if map[pos] == tiles.Exit.code:
+        return True
+
+    DISCOVERED = tiles.CODE_TO_TYPE.index(None)
+    discovered: Dict[Pos, int] = {}
+    discovered[pos] = DISCOVERED
+    discovered[parent] = DISCOVERED
+
+    queue = deque([pos])
+    while queue:
+        pos = queue.popleft()
+
+        for dir in [Dir.N, Dir.S, Dir.W, Dir.E]:
+            neigh = Dir.move(pos, dir)
+            if not map.in_map(neigh):
+                continue
+
+            neigh_code = get_temp(map, discovered, neigh)
+            discovered[neigh] = DISCOVERED
+            if get_temp(visited, temp_visited, pos).state == State.VISITED:
+                neigh_code = DISCOVERED
+
+            if neigh_code in [tiles.Exit.code, tiles.UnknownTile.code]:
+                return True
+            if neigh_code != DISCOVERED and \
+                    tiles.CODE_TO_TYPE[neigh_code] not in [tiles.Wall, tiles.BackwardTrap, tiles.RewindTrap]:
+                queue.append(neigh)
+
+        if tiles.CODE_TO_TYPE[map[pos]] == tiles.Portal:
+            portal_pair = map.portals[pos]
+            if portal_pair is None:
+                return True
+            if get_temp(visited, temp_visited, portal_pair).state == State.NEW:
+                return True
+
+    return False
+
+def recursive_dfs(game_state: GameState, temp_visited: Dict[Pos, VisitNode], visited_pos: List[Pos], pos: Pos):
+    """ agentV2.dfs() as it was, entering itself again after every direction it gives up on """
+    tile = tiles.from_code(game_state.current_map[pos])
+    if isinstance(tile, tiles.Trap) and tile.type != tiles.MovesTrap:
+        return None
+
+    node: VisitNode = get_temp(game_state.visited, temp_visited, pos)
+    dirs = []
+
+    if not node.w_visited:
+        dirs.append(Dir.W)
+    if not node.e_visited:
+        dirs.append(Dir.E)
+    if not node.n_visited:
+        dirs.append(Dir.N)
+    if not node.s_visited:
+        dirs.append(Dir.S)
+    if not node.p_visited and tiles.CODE_TO_TYPE[game_state.current_map[pos]] == tiles.Portal:
+        dirs.append('P')
+    else:
+        node.p_visited = True
+
+    for dir in dirs:
+        if dir == 'P':
+            node.p_visited = True
+            if game_state.current_map[game_state.current_map.anchor] == game_state.current_map[pos]:
+                continue
+            portal_pair = game_state.current_map.portals[pos]
+            if portal_pair is not None and get_temp(game_state.visited, temp_visited, portal_pair).state != State.NEW:
+                continue
+            return dir
+
+        new_pos = Dir.move(pos, dir)
+        if new_pos != node.parent and game_state.current_map.in_map(new_pos):
+            if game_state.current_map[new_pos] == tiles.UnknownTile.code:
+                if dirs[-1] == dir or (dirs[-1] == 'P' and dirs[-2] == dir):
+                    return None
+                continue
+
+            new_pos_node = get_temp(game_state.visited, temp_visited, new_pos)
+            if tiles.CODE_TO_TYPE[game_state.current_map[new_pos]] in [tiles.BackwardTrap, tiles.RewindTrap]:
+                new_pos_node.state = State.WALL
+
+            if new_pos_node.state in [State.NEW, State.OPEN] and \
+                    reference_check_path(game_state.current_map, game_state.visited, temp_visited, new_pos, pos):
+                visited_pos.append(new_pos)
+                new_pos_node.state = State.OPEN
+                if new_pos_node.parent is None:
+                    new_pos_node.parent = pos
+                return dir
+
+        visit_node(node, dir)
+        return recursive_dfs(game_state, temp_visited, visited_pos, pos)
+
+    node.state = State.VISITED
+    prev_pos: Pos = node.parent
+    if prev_pos is None and tiles.CODE_TO_TYPE[game_state.current_map[pos]] == tiles.Portal:
+        return 'P'
+
+    visited_pos.append(prev_pos)
+    return Dir.get_direction(pos, prev_pos)
+
+def reference_plan(game_state: GameState) -> List[str]:
+    commands = []
+    pos = game_state.pos
+    temp_visited: Dict[Pos, VisitNode] = OrderedDict()
+    visited_pos: List[Pos] = []
+    for _ in range(game_state.moves):
+        direction = recursive_dfs(game_state, temp_visited, visited_pos, pos)
+        if direction is None:
+            break
+        commands.append(direction)
+        if direction == 'P':
+            break
+        pos = Dir.move(pos, direction)
+
+    return commands or (['X'] if game_state.xray_points > 0 else [Dir.N])
+
+def play(uuid: str, game_state: GameState, repeat: int):
+    """ Plays a whole game, planning every round with both versions, returns the planning times of both and the
+    last response """
+    times, reference_times = [], []
+    discovered_forward_traps = set()
+    known_maps = {}
+    while True:
+        # Copying the views of the last round happens once per round, only the first plan() would pay for it
+        start = time.perf_counter()
+        agentV2.known_map(game_state, known_maps)
+        refresh = time.perf_counter() - start
+
+        elapsed, (commands, temp_visited, visited_pos) = best_time(lambda: agentV2.plan(game_state, known_maps), repeat)
+        times.append(refresh + elapsed)
+
+        elapsed, reference = best_time(lambda: reference_plan(game_state), repeat)
+        reference_times.append(elapsed)
+        if reference != commands:
+            sys.exit(f'Round {len(times)}: planned {commands}, the previous planner planned {reference}')
+
+        response = app.check_moves(uuid, ''.join(commands))
+        if 'end' in response:
+            break
+        agentV2.update(game_state, response, temp_visited, visited_pos, discovered_forward_traps)
+
+    return times, reference_times, response
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Time the per round planning of agentV2 over a whole game.")
+    parser.add_argument(
+        "--maze", "-m",
+        type=Path,
+        help="Maze to play, a generated one if missing."
+    )
+    parser.add_argument(
+        "--size", "-s",
+        type=int,
+        default=201,
+        help="Width and height of the generated maze."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=7,
+        help="Seed of the generated maze."
+    )
+    parser.add_argument(
+        "--repeat", "-r",
+        type=int,
+        default=3,
+        help="Times every round is planned by each version, the best time is kept."
+    )
+    return parser
+
+def best_time(function, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+
+    if args.maze is not None:
+        maze_map = Map.load_from_file(args.maze)
+    else:
+        np.random.seed(args.seed)
+        maze_map = Map(nparr=np.asarray(maze.generate_maze(args.size, args.size, 10, max_traps=args.size // 4)))
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        uuid, game_state = register_agent(start_race_server(monkeypatch, maze_map))
+        times, reference_times, response = play(uuid, game_state, args.repeat)
+
+    print(f'{len(times)} rounds, {"solved" if int(response["end"]) else "failed"}, same commands every round')
+    print(f'{"planner":<12} {"total [ms]":>11} {"mean [us]":>10} {"median [us]":>12} {"max [us]":>10}')
+    for name, times in [('previous', reference_times), ('current', times)]:
+        print(f'{name:<12} {sum(times) * 1e3:>11.1f} {statistics.mean(times) * 1e6:>10.1f} '
+              f'{statistics.median(times) * 1e6:>12.1f} {max(times) * 1e6:>10.1f}')
+    print(f'speedup {sum(reference_times) / sum(times):.2f}x')
+
+if __name__ == "__main__":
+    main()
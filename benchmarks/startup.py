@@ -0,0 +1,74 @@
+"""Measures the cold start of the server: import time of the main modules and time to the first served round"""
+import argparse
+import json
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Dependencies that a headless server or simulation should never load
+HEAVY_MODULES = ['tkinter', 'PIL', 'requests', 'sseclient_local', 'viewerV2']
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import app
+app.ARGS = app.get_parser().parse_args(['--maze', {maze!r}, '--race'])
+app.RACE_MODE = True
+app.set_maze(app.Map.load_from_file(app.ARGS.maze))
+client = app.server.test_client()
+uuid = client.post('/api/register_agent', json={{}}).get_json()['UUID']
+client.post('/api/receive_moves', json={{'UUID': uuid, 'input': 'NSEWX'}})
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Measure import and first request time in fresh interpreters.")
+    parser.add_argument(
+        "--repeat", "-r",
+        type=int,
+        default=5,
+        help="Number of fresh interpreters per measurement."
+    )
+    parser.add_argument(
+        "--maze", "-m",
+        type=Path,
+        default=ROOT / 'tests' / 'test_maze.png',
+        help="Maze served for the first request measurement."
+    )
+    return parser
+
+def measure(snippet: str, repeat: int):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', snippet], cwd=ROOT, capture_output=True, text=True, check=True)
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    seconds = [run['seconds'] for run in runs]
+    return min(seconds), statistics.median(seconds), runs[-1]['heavy']
+
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+
+    cases = [(f'import {module}', IMPORT_SNIPPET.format(module=module, heavy=HEAVY_MODULES))
+             for module in ['common.game_elements', 'maze', 'app', 'agentV2']]
+    cases.append(('first request', FIRST_REQUEST_SNIPPET.format(maze=str(args.maze.resolve()), heavy=HEAVY_MODULES)))
+
+    print(f'{"case":<30} {"min [ms]":>10} {"median [ms]":>12}  heavy modules loaded')
+    for name, snippet in cases:
+        best, median, heavy = measure(snippet, args.repeat)
+        print(f'{name:<30} {best * 1000:>10.1f} {median * 1000:>12.1f}  {", ".join(heavy) or "-"}')
+
+if __name__ == "__main__":
+    main()
@@ -47,15 +47,10 @@ class XrayEffect(Effect):
     def activate(self, game_state: 'ge.GameState', *, views: list=None, max_num_traps_redirect:int|None=None):
         first_trap(game_state)
 
-        def undo_xray(state: 'ge.GameState', pos: ge.Pos, xray_points: int):
-            state.current_map[pos] = tiles.Xray.code # restore xray point
-            state.xray_points = xray_points
-
-        undo_func = (lambda state, pos, xray_points: lambda: undo_xray(state, pos, xray_points))(game_state, game_state.pos, game_state.xray_points)
-        game_state.current_move.append(undo_func)
+        game_state.current_move.append(ge.UndoRecord(ge.Undo.XRAY, game_state.pos, game_state.xray_points, None))
 
         game_state.xray_points += 1
-        game_state.current_map[game_state.pos] = tiles.Path.code # "delete" xray tile when first stepped on
+        game_state.set_tile(game_state.pos, tiles.Path.code) # "delete" xray tile when first stepped on
 
 class RewindEffect(TrapEffect):
     def activate(self, game_state: 'ge.GameState', *, views: list=None, max_num_traps_redirect:int|None=None):
@@ -75,10 +70,9 @@ class RewindEffect(TrapEffect):
                     game_state.add_view(views.pop(0), pos=pos)
                 game_state.current_move_visited_pos.append(pos)
 
-            undo_funcs = game_state.prev_moves.pop()
-            while undo_funcs:
-                func = undo_funcs.pop()
-                func()
+            undo_records = game_state.prev_moves.pop()
+            while undo_records:
+                game_state.undo(undo_records.pop())
 
         game_state.in_rewind = prev_in_rewind
         game_state.current_move_visited_pos.append(game_state.pos)
@@ -86,8 +80,18 @@ class RewindEffect(TrapEffect):
             game_state.add_view(views[0])
 
 class PushForwardEffect(TrapEffect):
+    def __init__(self, direction, n: int) -> None:
+        super().__init__(direction, n)
+        self._incoming = direction # the direction the agent stepped on the trap, the key of its PushTable entry
+
     def activate(self, game_state: 'ge.GameState', *, views: list=None, max_num_traps_redirect:int|None=None):
         first_trap(game_state)
+
+        # The whole chain is known in advance unless it needs views (agents) or depends on the history
+        if not views and game_state.push_table is not None:
+            if game_state.push_table.apply(game_state, self._incoming, max_num_traps_redirect):
+                return
+
         max_num_traps_redirect = None if max_num_traps_redirect is None else max_num_traps_redirect - 1
     
         # Keeps it from dropping the number of moves of the agent for hitting walls due to trap
@@ -103,3 +107,4 @@ class PushBackwardEffect(PushForwardEffect):
     def __init__(self, direction, n: int) -> None:
         # simply changed the direction of the previous class to implement this one
         super().__init__(ge.Dir.OPPOSITE[direction], n)
+        self._incoming = direction
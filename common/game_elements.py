@@ -1,16 +1,30 @@
 #!/usr/bin/env python3
 from collections import namedtuple
-from collections.abc import Callable
 from enum import Enum
+import hashlib
 import numpy as np
 import logging
-from PIL import Image
-from typing import List, Dict, Tuple, Union, Any
+import struct
+from typing import List, Dict, Tuple, Union, TYPE_CHECKING
 
 import common.tiles as tiles
 
+if TYPE_CHECKING:
+    # PIL is only imported when images are actually read or written, pure simulation doesn't need it
+    from PIL import Image
+
+    from common.pushes import PushTable
+
 Pos = namedtuple("Pos", "x y")
 
+# An entry of the undo history of a GameState, see GameState.undo()
+UndoRecord = namedtuple("UndoRecord", "kind pos xray_points next_round_moves")
+
+class Undo(int, Enum):
+    TELEPORT = 0 # restore position, X-Ray points and next round moves
+    PORTAL   = 1 # go back through the portal that was entered
+    XRAY     = 2 # put back a picked up X-Ray point
+
 class State(int, Enum):
     NEW     = 0
     OPEN    = 1
@@ -151,7 +165,14 @@ class Map(np.ndarray):
 
         return pos.x >= 0 and pos.y >= 0 and pos.x < len(self) and pos.y < len(self[0])
 
+    def digest(self) -> bytes:
+        """ Returns a 16 byte id of the content of this map, the same for a map and its saved/loaded copy """
+        content = np.ascontiguousarray(self, dtype=np.uint8)
+        return hashlib.blake2b(content.tobytes(), digest_size=16, key=struct.pack('<II', *content.shape)).digest()
+
     def write_to_file(self, path):
+        from PIL import Image
+
         img = Image.fromarray(self, mode="L")  # "L" mode is for 8-bit grayscale
         img.save(path)
 
@@ -186,6 +207,8 @@ class Map(np.ndarray):
         return portals_dict
 
     def to_color_image(self):
+        from PIL import Image
+
         rgb = np.zeros((*self.shape, 3), dtype=np.uint8)
 
         for code, type in enumerate(tiles.CODE_TO_TYPE):
@@ -196,10 +219,12 @@ class Map(np.ndarray):
 
     @classmethod
     def load_from_file(cls, path):
+        from PIL import Image
+
         return cls.load_from_image(Image.open(path))
 
     @classmethod
-    def load_from_image(cls, img: Image.Image):
+    def load_from_image(cls, img: 'Image.Image'):
         img = img.convert("L") # Ensure it's in grayscale mode ("L")
         return cls(nparr=np.array(img, dtype=np.uint8))
 
@@ -223,6 +248,8 @@ class GameState:
         width: int | None = None,
         height: int | None = None,
         view: str | None = None,
+        shared_map: bool = False,
+        push_table: Union['PushTable', None] = None,
     ) -> None:
         self.maps = maps if maps else [Map(anchor=pos, agent_map=agent, width=width, height=height)] # list of maps; all parts except the agent will contain only one map, the current one
         self.current_map = self.maps[-1] # the only map actually used, except for the AI (might not get the chance to actually implement that after all)
@@ -247,11 +274,23 @@ class GameState:
 
         self.portals: Dict[int, Tuple] = portals if portals else {}
 
+        # When the map is shared between several game states (e.g. all the agents of a server), tiles changed
+        # by this game state (picked up X-Ray points) are kept in this overlay instead of being written in the map
+        self.shared_map = shared_map
+        self.overlay: Dict[Pos, int] = {}
+        # Incremented on every set_tile(), so views computed before a tile changed can be told apart
+        self.tiles_version = 0
+        # Chains of the push traps of the map, when it is complete and doesn't change (see common.pushes)
+        self.push_table = push_table
+        # When a list, add_view() appends the map, position and visibility of every view it writes, so that copies
+        # of the map can be kept up to date without comparing it all (see agentV2.KnownMap)
+        self.view_windows: List[Tuple[Map, Pos, int]] | None = None
+
         self._visibility = visibility
         self.xray_on = 0
 
         # List of previous moves (used for rewinding)
-        self.prev_moves: List[List[Callable[[], Any]]] = []
+        self.prev_moves: List[List[UndoRecord]] = []
 
         # List of visited positions in the last move (since the last perform_command() call)
         self.prev_moves_visited_pos: List[List[Pos]] = []
@@ -277,6 +316,9 @@ class GameState:
 
         view: List[List[int]] = deserialize_view(view)
         visibility = len(view) // 2
+        if self.view_windows is not None:
+            self.view_windows.append((self.current_map, pos, visibility))
+
         view_i = 0
         view_j = 0
         for i in range(pos.x - visibility, pos.x + visibility + 1):
@@ -304,6 +346,19 @@ class GameState:
             view_j = 0
             view_i += 1
 
+    def tile(self, pos: Pos) -> int:
+        """ Returns the code of the tile at `pos`, as seen by this game state """
+        if self.overlay:
+            return self.overlay.get(pos, self.current_map[pos])
+        return self.current_map[pos]
+
+    def set_tile(self, pos: Pos, code: int):
+        self.tiles_version += 1
+        if self.shared_map:
+            self.overlay[pos] = code
+        else:
+            self.current_map[pos] = code
+
     def perform_command(self, move: str, *, views: list=None, max_num_traps_redirect:int|None=None):
         """ Applies a command on this game state """
         self.moves -= 1
@@ -317,8 +372,8 @@ class GameState:
         self.current_move_visited_pos = self.prev_moves_visited_pos[-1]
         self.prev_moves_visited_pos = self.prev_moves_visited_pos[-self.MAX_NUM_PREV_MOVES:]
 
-        undo_func = teleport_undo_func(self, self.pos, self.xray_points, self.next_round_moves)
-        self.current_move.append(undo_func)
+        undo_record = UndoRecord(Undo.TELEPORT, self.pos, self.xray_points, self.next_round_moves)
+        self.current_move.append(undo_record)
 
         match move:
             case 'X': # TODO support greater size xray
@@ -326,8 +381,8 @@ class GameState:
             case 'N' | 'S' | 'E' | 'W':
                 return self.move(move, views=views, max_num_traps_redirect=max_num_traps_redirect)
             case 'P':
-                undo_func = self.enter_portal
-                self.current_move[-1] = undo_func # overwrite the "default" undo_func
+                undo_record = UndoRecord(Undo.PORTAL, None, None, None)
+                self.current_move[-1] = undo_record # overwrite the "default" undo record
                 return self.enter_portal(views=views)
             case '': # empty command
                 self.prev_moves.pop() # remove empty move if it was just added
@@ -336,6 +391,19 @@ class GameState:
             case _:
                 raise ValueError(f'"{move}" is not a valid move')
 
+    def undo(self, record: UndoRecord):
+        """ Reverts one change recorded in the undo history (used for rewinding) """
+        match record.kind:
+            case Undo.TELEPORT:
+                self.pos = record.pos
+                self.xray_points = record.xray_points
+                self.next_round_moves = record.next_round_moves
+            case Undo.PORTAL:
+                self.enter_portal()
+            case Undo.XRAY:
+                self.set_tile(record.pos, tiles.Xray.code)
+                self.xray_points = record.xray_points
+
     def move(self, direction, *, views: list=None, max_num_traps_redirect:int|None=None):
         """ Applies a move command on this game state (not X-Ray) """
 
@@ -356,7 +424,7 @@ class GameState:
             self.add_view(views.pop(0))
 
         logging.debug(f'Moved into tile {self.current_map[self.pos]}')
-        effect = tiles.from_code(self.current_map[self.pos]).visit(direction)
+        effect = tiles.from_code(self.tile(self.pos)).visit(direction)
         if effect.activate(self, views=views, max_num_traps_redirect=max_num_traps_redirect) is not None:
             return '0'
         return '1'
@@ -454,8 +522,145 @@ class GameState:
             matrix_i += 1
             matrix_j = 0
 
+        for (i, j), code in self.overlay.items():
+            if abs(i - x) <= visibility and abs(j - y) <= visibility:
+                current_visibility[i - x + visibility][j - y + visibility] = code
+
         return current_visibility
 
+    _STATE_MAGIC = b'GS1'
+    # maze id, pos, moves, next round moves, X-Ray points, visibility, xray_on, flags, first trap
+    _STATE_HEADER = struct.Struct('<16siiiiiBBBii')
+    _COUNT = struct.Struct('<H')
+    _POS = struct.Struct('<ii')
+    _OVERLAY_ENTRY = struct.Struct('<iiB')
+    _UNDO_RECORD = struct.Struct('<Biiii')
+
+    def to_bytes(self, maze_id: bytes) -> bytes:
+        """ Serializes this (server side) game state; the map itself is not included, only `maze_id`, the id of the
+        map this state was created on, and the tiles changed by this state (the overlay) """
+        if self.agent:
+            raise ValueError("Only server side game states can be serialized")
+
+        first_trap = self.first_trap if self.first_trap is not None else Pos(-1, -1)
+        current_move = getattr(self, 'current_move', None)
+        flags = (self.in_rewind
+                 | self.reduce_moves_switch << 1
+                 | self.shared_map << 2
+                 | (self.first_trap is not None) << 3
+                 | (current_move is not None) << 4
+                 | (bool(self.prev_moves) and current_move is self.prev_moves[-1]) << 5
+                 | (bool(self.prev_moves_visited_pos)
+                    and self.current_move_visited_pos is self.prev_moves_visited_pos[-1]) << 6)
+
+        parts = [self._STATE_MAGIC, self._STATE_HEADER.pack(
+            maze_id, int(self.pos.x), int(self.pos.y), self.moves, self.next_round_moves, self.xray_points,
+            self._visibility, self.xray_on, flags, int(first_trap.x), int(first_trap.y)
+        )]
+
+        def pack_positions(positions: List[Pos]):
+            parts.append(self._COUNT.pack(len(positions)))
+            parts.extend(self._POS.pack(int(pos.x), int(pos.y)) for pos in positions)
+
+        def pack_records(records: List[UndoRecord]):
+            parts.append(self._COUNT.pack(len(records)))
+            for record in records:
+                pos = record.pos if record.pos is not None else Pos(-1, -1)
+                parts.append(self._UNDO_RECORD.pack(
+                    record.kind, int(pos.x), int(pos.y),
+                    record.xray_points if record.xray_points is not None else -1,
+                    record.next_round_moves if record.next_round_moves is not None else -1
+                ))
+
+        parts.append(struct.pack('<I', len(self.overlay)))
+        parts.extend(self._OVERLAY_ENTRY.pack(int(pos.x), int(pos.y), code) for pos, code in self.overlay.items())
+
+        parts.append(self._COUNT.pack(len(self.prev_moves)))
+        for records in self.prev_moves:
+            pack_records(records)
+        pack_records(current_move if current_move is not None else [])
+
+        parts.append(self._COUNT.pack(len(self.prev_moves_visited_pos)))
+        for positions in self.prev_moves_visited_pos:
+            pack_positions(positions)
+        pack_positions(self.current_move_visited_pos)
+
+        return b''.join(parts)
+
+    @classmethod
+    def maze_id_of(cls, data: bytes) -> bytes:
+        """ Returns the id of the map a serialized game state was created on """
+        return cls._STATE_HEADER.unpack_from(data, len(cls._STATE_MAGIC))[0]
+
+    @classmethod
+    def from_bytes(cls, data: bytes, mazes: Dict[bytes, Map]) -> 'GameState':
+        """ Rebuilds a game state serialized with `to_bytes()`, on top of its map looked up by id in `mazes` """
+        if data[:len(cls._STATE_MAGIC)] != cls._STATE_MAGIC:
+            raise ValueError("Not a serialized game state")
+        offset = len(cls._STATE_MAGIC)
+
+        (maze_id, x, y, moves, next_round_moves, xray_points, visibility, xray_on, flags,
+         first_trap_x, first_trap_y) = cls._STATE_HEADER.unpack_from(data, offset)
+        offset += cls._STATE_HEADER.size
+
+        maze = mazes.get(maze_id)
+        if maze is None:
+            raise ValueError(f"The game state was serialized on an unknown maze ({maze_id.hex()})")
+
+        state = cls(maps=[maze], pos=Pos(x, y), moves=moves, next_round_moves=next_round_moves,
+                    xray_points=xray_points, visibility=visibility, shared_map=bool(flags & 4))
+        state.xray_on = xray_on
+        state.in_rewind = bool(flags & 1)
+        state.reduce_moves_switch = bool(flags & 2)
+        state.first_trap = Pos(first_trap_x, first_trap_y) if flags & 8 else None
+
+        def unpack_count():
+            nonlocal offset
+            count, = cls._COUNT.unpack_from(data, offset)
+            offset += cls._COUNT.size
+            return count
+
+        def unpack_positions():
+            nonlocal offset
+            positions = [Pos(*cls._POS.unpack_from(data, offset + i * cls._POS.size)) for i in range(unpack_count())]
+            offset += len(positions) * cls._POS.size
+            return positions
+
+        def unpack_records():
+            nonlocal offset
+            records = []
+            for _ in range(unpack_count()):
+                kind, pos_x, pos_y, xray, next_moves = cls._UNDO_RECORD.unpack_from(data, offset)
+                offset += cls._UNDO_RECORD.size
+                records.append(UndoRecord(
+                    Undo(kind), Pos(pos_x, pos_y) if kind != Undo.PORTAL else None,
+                    xray if xray >= 0 else None, next_moves if next_moves >= 0 else None
+                ))
+            return records
+
+        overlay_size, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        for _ in range(overlay_size):
+            pos_x, pos_y, code = cls._OVERLAY_ENTRY.unpack_from(data, offset)
+            offset += cls._OVERLAY_ENTRY.size
+            state.overlay[Pos(pos_x, pos_y)] = code
+
+        state.prev_moves = [unpack_records() for _ in range(unpack_count())]
+        current_move = unpack_records()
+        if flags & 32:
+            state.current_move = state.prev_moves[-1]
+        elif flags & 16:
+            state.current_move = current_move
+
+        state.prev_moves_visited_pos = [unpack_positions() for _ in range(unpack_count())]
+        current_move_visited_pos = unpack_positions()
+        if flags & 64:
+            state.current_move_visited_pos = state.prev_moves_visited_pos[-1]
+        else:
+            state.current_move_visited_pos = current_move_visited_pos
+
+        return state
+
 def serialize_view(view: List[List[int]]) -> str:
     return '[' + "; ".join([", ".join([str(i) for i in row]) for row in view]) + ']'
 
@@ -467,10 +672,3 @@ def deserialize_view(view: str) -> List[List[int]]:
     view_int = [[int(s.strip(chars)) for s in row] for row in view_str]
 
     return view_int
-
-def teleport_undo_func(game_state: GameState, pos: Pos, xray_points: int, next_round_moves: int) -> Callable[[], Any]:
-    def set_pos(game_state: GameState, pos: Pos, xray_points: int, next_round_moves: int):
-        game_state.pos = pos
-        game_state.xray_points = xray_points
-        game_state.next_round_moves = next_round_moves
-    return lambda: set_pos(game_state, pos, xray_points, next_round_moves)
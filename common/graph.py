@@ -0,0 +1,120 @@
+""" Adjacency of the open cells of a maze in compressed sparse row (CSR) form, built once with numpy and shared by the
+searches, the distance fields, the solver and the analysis tools """
+from array import array
+from typing import Sequence
+
+import numpy as np
+
+from common.game_elements import Map, Pos
+from common.search import SearchResult
+import common.tiles as tiles
+
+TRAP_CODES = (tiles.MovesTrap.base_code + 1, tiles.BackwardTrap.base_code + 5) # first and last trap codes
+
+class MazeGraph:
+    """ Every cell that isn't a wall is a node, numbered in row-major order. The neighbors of node `i` are
+    `indices[indptr[i]:indptr[i + 1]]`: the open cells N, W, S and E of it, in that order, then the other end of its
+    portal if it has a pair (entering a portal is one command, like a step).
+
+    Nodes keep the code of their tile in `codes`, so traps can be told apart without going back to the map. """
+    def __init__(self, maze: Map | np.ndarray, portals: bool = True):
+        arr = np.asarray(maze)
+        self.shape = arr.shape
+
+        is_open = arr != tiles.Wall.code
+        self.cells = np.argwhere(is_open).astype(np.int32) # (x, y) of every node
+        self.codes = arr[is_open]
+
+        self.ids = np.full(self.shape, -1, dtype=np.int32)
+        self.ids[is_open] = np.arange(len(self.cells), dtype=np.int32)
+
+        # The id of the neighbor of every node in each direction (-1 for walls and outside the map)
+        padded = np.pad(self.ids, 1, constant_values=-1)
+        x, y = self.cells[:, 0] + 1, self.cells[:, 1] + 1
+        arcs = [padded[x - 1, y], padded[x, y - 1], padded[x + 1, y], padded[x, y + 1]]
+
+        self.portal_pairs = np.full(len(self.cells), -1, dtype=np.int32)
+        if portals:
+            first_portal, last_portal = tiles.Portal.first_portal(), tiles.Portal.last_portal()
+            portal_nodes = np.flatnonzero((self.codes >= first_portal) & (self.codes <= last_portal))
+            for code in np.unique(self.codes[portal_nodes]).tolist():
+                pair = portal_nodes[self.codes[portal_nodes] == code]
+                if len(pair) == 2:
+                    self.portal_pairs[pair] = pair[::-1]
+            arcs.append(self.portal_pairs)
+
+        arcs = np.stack(arcs, axis=1)
+        has_arc = arcs >= 0
+        self.indptr = np.zeros(len(self.cells) + 1, dtype=np.int32)
+        np.cumsum(has_arc.sum(axis=1), out=self.indptr[1:])
+        self.indices = arcs[has_arc].astype(np.int32) # row-major, so grouped by node in the order above
+
+        is_trap = (self.codes >= TRAP_CODES[0]) & (self.codes <= TRAP_CODES[1])
+        self.traps = np.flatnonzero(is_trap).astype(np.int32)
+
+        self.entrance = self._find(tiles.Entrance.code)
+        self.exit = self._find(tiles.Exit.code)
+
+    def __len__(self):
+        return len(self.cells)
+
+    @property
+    def num_arcs(self) -> int:
+        return len(self.indices)
+
+    def _find(self, code: int) -> int:
+        nodes = np.flatnonzero(self.codes == code)
+        return int(nodes[0]) if len(nodes) else -1
+
+    def node(self, pos: Pos) -> int:
+        """ The node of the cell at `pos`, -1 for walls """
+        return int(self.ids[pos[0], pos[1]])
+
+    def pos(self, node: int) -> Pos:
+        x, y = self.cells[node]
+        return Pos(int(x), int(y))
+
+    def neighbors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def bfs(self, sources: Sequence[int]) -> SearchResult:
+        """ Same as FlatGrid.bfs(), over node ids (and through portals) """
+        size = len(self.cells)
+        indptr = self.indptr.tolist() # plain lists are much faster to index one element at a time
+        indices = self.indices.tolist()
+
+        dist = array('i', [-1]) * size
+        parent = array('i', [-1]) * size
+        queue = array('i', [0]) * size
+        head = tail = 0
+
+        for source in sources:
+            if dist[source] < 0:
+                dist[source] = 0
+                queue[tail] = source
+                tail += 1
+
+        while head < tail:
+            node = queue[head]
+            head += 1
+            next_dist = dist[node] + 1
+
+            for neighbor in indices[indptr[node]:indptr[node + 1]]:
+                if dist[neighbor] < 0:
+                    dist[neighbor] = next_dist
+                    parent[neighbor] = node
+                    queue[tail] = neighbor
+                    tail += 1
+
+        return SearchResult(
+            np.frombuffer(dist, dtype=np.int32),
+            np.frombuffer(parent, dtype=np.int32),
+            np.frombuffer(queue, dtype=np.int32)[:tail],
+        )
+
+    def field(self, values: np.ndarray, fill: int = -1) -> np.ndarray:
+        """ Spreads per node values (e.g. SearchResult.dist) over the shape of the maze, `fill` on the walls """
+        values = np.asarray(values)
+        result = np.full(self.shape, fill, dtype=values.dtype)
+        result[self.cells[:, 0], self.cells[:, 1]] = values
+        return result
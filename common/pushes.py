@@ -0,0 +1,131 @@
+""" Precomputed chains of the push traps (ForwardTrap, BackwardTrap) of a complete map: where an agent stepping on a
+trap from a given direction ends up, and everything that happens on the way """
+from enum import Enum
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+import common.game_elements as ge
+import common.tiles as tiles
+
+MAX_CHAIN_STEPS = 256 # a chain moving the agent more than this is stuck in a loop
+
+class Outcome(int, Enum):
+    LANDED = 0
+    WALL = 1    # a ForwardTrap pushes the agent into a wall, GameState.move() raises
+    REWIND = 2  # the chain steps on a RewindTrap, which depends on the history of the agent
+    ENDLESS = 3 # the traps push the agent around forever
+
+class Push(NamedTuple):
+    outcome: Outcome
+    landing: 'ge.Pos | None'
+    visited: Tuple['ge.Pos', ...] # appended to GameState.current_move_visited_pos, in order
+    xrays: Tuple['ge.Pos', ...]   # X-Ray tiles stepped on, picked up if they still are X-Rays
+    moves_lost: int               # by MovesTraps, walls hit during a push don't cost moves
+    redirects: int                # nested push traps counted by max_num_traps_redirect
+
+class _Stop(Exception):
+    def __init__(self, outcome: Outcome):
+        super().__init__(outcome.name)
+        self.outcome = outcome
+
+class _Chain:
+    def __init__(self, trap: 'ge.Pos'):
+        self.visited: List[ge.Pos] = [trap] # the agent is on the trap when its effect starts
+        self.xrays: List[ge.Pos] = []
+        self.moves_lost = 0
+        self.redirects = 0
+        self.steps = 0
+
+class PushTable:
+    """ The outcome of every (push trap, incoming direction) of a map, resolved the first time it is needed with the
+    same rules as GameState.move() and the effects of the tiles, so replaying a chain doesn't simulate it again.
+
+    The map must not change afterwards; picked up X-Rays are fine, they don't change where the agent goes. Chains that
+    end on a wall or a rewind are only flagged, they must still be simulated to get the same errors and undo
+    history. """
+    def __init__(self, maze: 'ge.Map | np.ndarray'):
+        self.maze = np.asarray(maze)
+        self.pushes: Dict[Tuple[ge.Pos, str], Push] = {}
+
+    def get(self, trap: 'ge.Pos', incoming: str) -> Push | None:
+        """ The chain started by stepping on `trap` going `incoming`, None if there is no push trap there. Any
+        direction can be asked, even from a wall: bouncing off a wall steps on the trap again the other way. """
+        key = (trap, incoming)
+        push = self.pushes.get(key)
+        if push is None:
+            if tiles.CODE_TO_TYPE[self.maze[trap]] not in (tiles.ForwardTrap, tiles.BackwardTrap):
+                return None
+            push = self.pushes[key] = self._resolve(ge.Pos(int(trap[0]), int(trap[1])), incoming)
+        return push
+
+    def apply(self, game_state: 'ge.GameState', incoming: str, max_num_traps_redirect: int | None = None) -> bool:
+        """ Applies the chain of the trap the game state is on, returns False if it has to be simulated instead """
+        push = self.get(game_state.pos, incoming)
+        if push is None or push.outcome in (Outcome.WALL, Outcome.REWIND):
+            return False
+        if push.outcome == Outcome.ENDLESS:
+            raise ValueError("Endless chain of trap pushes")
+        if max_num_traps_redirect is not None and push.redirects > max_num_traps_redirect:
+            raise ValueError("Too many trap redirects")
+
+        game_state.current_move_visited_pos.extend(push.visited)
+        for pos in push.xrays:
+            if game_state.tile(pos) == tiles.Xray.code:
+                game_state.current_move.append(ge.UndoRecord(ge.Undo.XRAY, pos, game_state.xray_points, None))
+                game_state.xray_points += 1
+                game_state.set_tile(pos, tiles.Path.code)
+        if push.moves_lost:
+            game_state.decrease_next_round_moves(push.moves_lost)
+
+        game_state.pos = push.landing
+        return True
+
+    def _resolve(self, trap: 'ge.Pos', incoming: str) -> Push:
+        chain = _Chain(trap)
+        try:
+            landing = self._effect(trap, incoming, 0, chain)
+        except _Stop as stop:
+            return Push(stop.outcome, None, (), (), 0, 0)
+
+        return Push(Outcome.LANDED, landing, tuple(chain.visited[1:]), tuple(chain.xrays), chain.moves_lost,
+                    chain.redirects)
+
+    def _move(self, pos: 'ge.Pos', direction: str, depth: int | None, chain: _Chain) -> 'ge.Pos':
+        """ GameState.move(), `depth` being how many push traps passed max_num_traps_redirect down (None if a wall
+        dropped it) """
+        chain.steps += 1
+        if chain.steps > MAX_CHAIN_STEPS:
+            raise _Stop(Outcome.ENDLESS)
+
+        new_pos = ge.Dir.move(pos, direction)
+        if tiles.CODE_TO_TYPE[self.maze[pos]] == tiles.ForwardTrap and self.maze[new_pos] == tiles.Wall.code:
+            raise _Stop(Outcome.WALL)
+
+        if chain.visited[-1] != new_pos:
+            chain.visited.append(new_pos)
+        return self._effect(new_pos, direction, depth, chain)
+
+    def _effect(self, pos: 'ge.Pos', direction: str, depth: int | None, chain: _Chain) -> 'ge.Pos':
+        """ The effect of the tile at `pos` when entered going `direction`, returns where the agent ends up """
+        code = int(self.maze[pos])
+        tile_type = tiles.CODE_TO_TYPE[code]
+
+        if tile_type == tiles.Wall:
+            chain.visited.pop()
+            return self._move(pos, ge.Dir.OPPOSITE[direction], None, chain)
+        elif tile_type == tiles.MovesTrap:
+            chain.moves_lost += code - tile_type.base_code
+        elif tile_type == tiles.Xray:
+            chain.xrays.append(pos)
+        elif tile_type == tiles.RewindTrap:
+            raise _Stop(Outcome.REWIND)
+        elif tile_type in (tiles.ForwardTrap, tiles.BackwardTrap):
+            push = direction if tile_type == tiles.ForwardTrap else ge.Dir.OPPOSITE[direction]
+            if depth is not None:
+                depth += 1
+                chain.redirects = max(chain.redirects, depth)
+            for _ in range(code - tile_type.base_code):
+                pos = self._move(pos, push, depth, chain)
+
+        return pos
@@ -0,0 +1,104 @@
+""" Breadth-first search over a maze stored as flat indices, shared by the generator, the validators and the
+distance tools """
+from array import array
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+from common.game_elements import Map, Pos
+import common.tiles as tiles
+
+class SearchResult(NamedTuple):
+    dist: np.ndarray   # int32 distance of every flat index to the closest source, -1 if unreachable
+    parent: np.ndarray # int32 flat index each cell was reached from, -1 for the sources and unreachable cells
+    order: np.ndarray  # int32 flat indices in the order they were reached, so order[-1] is one of the furthest
+
+class FlatGrid:
+    """ The passable cells of a maze, padded with a border of walls and flattened, so the neighbors of index `i` are
+    `i + offset` for each of `offsets` (N, W, S, E) without any bounds checks """
+    def __init__(self, maze: Map | np.ndarray, passable: np.ndarray | None = None):
+        self.height, self.width = maze.shape
+        self.stride = self.width + 2
+        self.offsets = (-self.stride, -1, self.stride, 1)
+
+        if passable is None:
+            passable = np.asarray(maze) != tiles.Wall.code
+        padded = np.zeros((self.height + 2, self.stride), dtype=np.uint8)
+        padded[1:-1, 1:-1] = passable
+        self.passable = bytearray(padded.tobytes())
+
+    def __len__(self):
+        return len(self.passable)
+
+    def index(self, pos: Pos) -> int:
+        return (int(pos[0]) + 1) * self.stride + int(pos[1]) + 1
+
+    def pos(self, index: int) -> Pos:
+        x, y = divmod(int(index), self.stride)
+        return Pos(x - 1, y - 1)
+
+    def coords(self, indices: np.ndarray):
+        """ Vectorized pos(): returns the x and y arrays of the given flat indices """
+        x, y = np.divmod(np.asarray(indices), self.stride)
+        return x - 1, y - 1
+
+    def unpad(self, values: np.ndarray) -> np.ndarray:
+        """ Reshapes an array indexed by flat index (e.g. SearchResult.dist) into the shape of the maze """
+        return np.asarray(values).reshape(self.height + 2, self.stride)[1:-1, 1:-1]
+
+    def bfs(self, sources: Sequence[int]) -> SearchResult:
+        size = len(self.passable)
+        passable = self.passable
+        offsets = self.offsets
+
+        dist = array('i', [-1]) * size
+        parent = array('i', [-1]) * size
+        queue = array('i', [0]) * size
+        head = tail = 0
+
+        for source in sources:
+            if dist[source] < 0:
+                dist[source] = 0
+                queue[tail] = source
+                tail += 1
+
+        while head < tail:
+            cell = queue[head]
+            head += 1
+            next_dist = dist[cell] + 1
+
+            for offset in offsets:
+                neighbor = cell + offset
+                if passable[neighbor] and dist[neighbor] < 0:
+                    dist[neighbor] = next_dist
+                    parent[neighbor] = cell
+                    queue[tail] = neighbor
+                    tail += 1
+
+        return SearchResult(
+            np.frombuffer(dist, dtype=np.int32),
+            np.frombuffer(parent, dtype=np.int32),
+            np.frombuffer(queue, dtype=np.int32)[:tail],
+        )
+
+    def path(self, result: SearchResult, target: int) -> np.ndarray:
+        """ Returns the flat indices from `target` back to the source it was reached from, both included """
+        parent = memoryview(result.parent) # much faster to index one element at a time than the numpy array
+        path = array('i', [0]) * (int(result.dist[target]) + 1)
+        for i in range(len(path)):
+            path[i] = target
+            target = parent[target]
+        return np.frombuffer(path, dtype=np.int32)
+
+    def furthest(self, result: SearchResult) -> int:
+        """ The furthest index reached by a search, the last in maze order (highest x, then y) if there are more """
+        order = result.order
+        last = result.dist[order[-1]]
+        return int(order[result.dist[order] == last].max())
+
+    def diameter_path(self, start: int) -> np.ndarray:
+        """ Returns a longest shortest path of the component of `start` (its diameter, when it is a tree), found by
+        searching from `start` to the furthest cell and from there to the cell furthest from it """
+        end = self.furthest(self.bfs([start]))
+        result = self.bfs([end])
+        return self.path(result, self.furthest(result))
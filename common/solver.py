@@ -0,0 +1,186 @@
+""" Full-information solver: finds the fewest rounds (then commands) needed to get from the entrance to the exit of a
+complete map, following the same rules as the server """
+import heapq
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from common.game_elements import GameState, Map, Pos
+from common.pushes import Outcome, PushTable
+from common.search import FlatGrid
+import common.tiles as tiles
+
+DIRECTIONS = ['N', 'W', 'S', 'E'] # same order as FlatGrid.offsets
+
+# What stepping on a tile does, by tile code
+NOTHING, WALL, MOVES, REWIND, FORWARD, BACKWARD = range(6)
+KIND = [NOTHING] * 256
+POWER = [0] * 256
+for _code, _type in enumerate(tiles.CODE_TO_TYPE):
+    if _type is tiles.Wall:
+        KIND[_code] = WALL
+    elif _type in (tiles.MovesTrap, tiles.RewindTrap, tiles.ForwardTrap, tiles.BackwardTrap):
+        KIND[_code] = {tiles.MovesTrap: MOVES, tiles.RewindTrap: REWIND,
+                       tiles.ForwardTrap: FORWARD, tiles.BackwardTrap: BACKWARD}[_type]
+        POWER[_code] = _type(_code).n
+
+class Solution(NamedTuple):
+    rounds: int
+    commands: List[str] # the commands sent in every round
+
+    @property
+    def num_commands(self) -> int:
+        return sum(len(round_commands) for round_commands in self.commands)
+
+class Rejected(Exception):
+    """ The command can't be part of a solution: it triggers a rewind, or it would break the server """
+
+class Solver:
+    """ Searches (position, moves left, moves of the next round) states in order of (rounds, commands), keeping for
+    every cell only the states not dominated by another one (fewer rounds and commands and at least as many moves).
+
+    Rewinds are never needed: a RewindTrap puts the agent back in a state it was in before, only later, so commands
+    that trigger one are skipped, as are X-Rays (useless with the full map) and commands that leave the agent where it
+    was (they only cost moves). """
+    def __init__(self, maze: Map | np.ndarray):
+        maze = np.asarray(maze)
+        self.grid = FlatGrid(maze)
+        padded = np.full((self.grid.height + 2, self.grid.stride), tiles.Wall.code, dtype=np.uint8)
+        padded[1:-1, 1:-1] = maze
+        self.codes = bytes(padded.tobytes())
+        self.pushes = PushTable(maze)
+
+        self.entrance = self.grid.index(Pos(*np.argwhere(maze == tiles.Entrance.code)[0]))
+        self.exit = self.grid.index(Pos(*np.argwhere(maze == tiles.Exit.code)[0]))
+
+        self.portals: Dict[int, int] = {}
+        first_portal, last_portal = tiles.Portal.first_portal(), tiles.Portal.last_portal()
+        for code in np.unique(maze[(maze >= first_portal) & (maze <= last_portal)]).tolist():
+            pair = [self.grid.index(Pos(*pos)) for pos in np.argwhere(maze == code)]
+            if len(pair) == 2:
+                self.portals[pair[0]], self.portals[pair[1]] = pair[1], pair[0]
+
+        self._moves: Dict[Tuple[int, int], Tuple[int, int] | None] = {}
+        self._successors: Dict[int, List[Tuple[str, int, int]]] = {}
+
+    def resolve(self, pos: int, direction: int) -> Tuple[int, int] | None:
+        """ Returns where a move command from `pos` ends and by how much it decreases the moves of the next round,
+        or None if the command is rejected. Only depends on the map, so it is computed once per cell and direction. """
+        key = (pos, direction)
+        if key not in self._moves:
+            lost = [0]
+            try:
+                self._moves[key] = (self._move(pos, direction, lost), lost[0])
+            except Rejected:
+                self._moves[key] = None
+        return self._moves[key]
+
+    def _move(self, pos: int, direction: int, lost: List[int]) -> int:
+        """ GameState.move() and the effects of the tiles, on flat indices """
+        codes = self.codes
+        new_pos = pos + self.grid.offsets[direction]
+
+        code = codes[new_pos]
+        kind = KIND[code]
+        if kind == WALL:
+            # Bounce back, which activates the tile we came from again
+            new_pos = self._move(new_pos, (direction + 2) % 4, lost)
+            lost[0] += 1
+        elif kind == MOVES:
+            lost[0] += POWER[code]
+        elif kind == REWIND:
+            raise Rejected("Rewind")
+        elif kind == FORWARD or kind == BACKWARD:
+            push = self.pushes.get(self.grid.pos(new_pos), DIRECTIONS[direction])
+            if push.outcome != Outcome.LANDED:
+                raise Rejected(push.outcome.name)
+            new_pos = self.grid.index(push.landing)
+            lost[0] += push.moves_lost
+
+        return new_pos
+
+    def successors(self, pos: int) -> List[Tuple[str, int, int]]:
+        """ Returns (command, new position, moves lost) for the useful commands from `pos` """
+        result = self._successors.get(pos)
+        if result is None:
+            result = self._successors[pos] = []
+            for direction, command in enumerate(DIRECTIONS):
+                move = self.resolve(pos, direction)
+                if move is not None and move[0] != pos:
+                    result.append((command, *move))
+
+            if pos in self.portals:
+                result.append(('P', self.portals[pos], 0))
+        return result
+
+    def solve(self, moves: int = GameState.MAX_MOVES_PER_TURN) -> Solution | None:
+        full_moves = GameState.MAX_MOVES_PER_TURN
+        # Labels are (round, commands, moves left in this round, moves of the next round), kept per cell. Every label
+        # also records the label it came from and its command ('' when it starts a new round), to rebuild the path.
+        start = (1, 0, moves, full_moves)
+        kept: Dict[int, List[Tuple[int, int, int, int]]] = {self.entrance: [start]}
+        parents: List[Tuple[int, int, str]] = [(self.entrance, -1, '')]
+        heap = [(1, 0, -moves, -full_moves, 0)]
+
+        def dominated(pos: int, label: Tuple[int, int, int, int]) -> bool:
+            round, commands, moves, next_moves = label
+            for other in kept.get(pos, ()):
+                if other[1] > commands or other[0] > round:
+                    continue
+                if other[0] == round:
+                    if other[2] >= moves and other[3] >= next_moves:
+                        return True
+                    continue
+
+                # An agent can always end a round early: after one round it has `next_moves` moves, after two all
+                # of them. Those idle labels are searched too, so only prune what they beat strictly.
+                if other[0] + 1 == round:
+                    idle_moves = other[3]
+                elif other[0] + 2 == round:
+                    idle_moves = full_moves
+                else:
+                    return True
+                if idle_moves >= moves and (other[1], idle_moves, full_moves) != label[1:]:
+                    return True
+            return False
+
+        def push(pos: int, label: Tuple[int, int, int, int], parent: int, command: str):
+            if dominated(pos, label):
+                return
+            kept.setdefault(pos, []).append(label)
+            parents.append((pos, parent, command))
+            heapq.heappush(heap, (label[0], label[1], -label[2], -label[3], len(parents) - 1))
+
+        while heap:
+            round, commands, moves, next_moves, index = heapq.heappop(heap)
+            moves, next_moves = -moves, -next_moves
+            pos = parents[index][0]
+            if pos == self.exit:
+                return self._solution(parents, index)
+
+            # End the round (forced when there are no moves left)
+            push(pos, (round + 1, commands, next_moves, full_moves), index, '')
+            if moves == 0:
+                continue
+
+            for command, new_pos, lost in self.successors(pos):
+                push(new_pos, (round, commands + 1, moves - 1, max(0, next_moves - lost)), index, command)
+
+        return None
+
+    def _solution(self, parents: List[Tuple[int, int, str]], index: int) -> Solution:
+        rounds = [[]]
+        while parents[index][1] >= 0:
+            _, parent, command = parents[index]
+            if command:
+                rounds[-1].append(command)
+            else:
+                rounds.append([])
+            index = parent
+
+        commands = [''.join(reversed(round_commands)) for round_commands in reversed(rounds)]
+        return Solution(len(commands), commands)
+
+def solve(maze: Map | np.ndarray) -> Solution | None:
+    """ Returns the fastest way through a maze, or None if its exit can't be reached """
+    return Solver(maze).solve()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+""" This module contains the newline-delimited JSON stream transport shared by the server and the agents """
+import json
+import socket
+from typing import Any, Dict
+
+ENCODING = 'utf-8'
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    """ Serializes a message as a single line of JSON """
+    return json.dumps(message, separators=(',', ':')).encode(ENCODING) + b'\n'
+
+def decode_frame(line: bytes) -> Dict[str, Any]:
+    return json.loads(line.decode(ENCODING))
+
+class StreamClient:
+    """ Client side of the stream transport: one long-lived socket, one request/response frame pair per round.
+    Sending an empty message registers a new agent, exactly like an empty POST on the REST API. """
+    def __init__(self, host: str, port: int, timeout: float | None = None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+
+    def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        self.sock.sendall(encode_frame(message))
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("Stream closed by the server")
+        return decode_frame(line)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
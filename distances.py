@@ -0,0 +1,94 @@
+"""Computes how far every cell of a maze is from its exit and from its entrance, and caches the result next to the
+maze file"""
+import argparse
+import logging
+from pathlib import Path
+from typing import NamedTuple
+import zipfile
+
+import numpy as np
+
+from common.game_elements import Map
+from common.graph import MazeGraph
+
+CACHE_SUFFIX = '.distances.npz'
+# What reading a missing, truncated or corrupt cache raises, the fields are computed again then
+CACHE_READ_ERRORS = (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile)
+
+class DistanceFields(NamedTuple):
+    to_exit: np.ndarray     # int32 steps from every cell to the exit (portals included), -1 for walls/unreachable
+    to_entrance: np.ndarray # same, to the entrance
+
+def compute(maze: Map | np.ndarray, graph: MazeGraph | None = None) -> DistanceFields:
+    if graph is None:
+        graph = MazeGraph(maze)
+
+    # Arcs go both ways (portals too), so the distance to a cell is the distance from it
+    return DistanceFields(
+        graph.field(graph.bfs([graph.exit]).dist),
+        graph.field(graph.bfs([graph.entrance]).dist),
+    )
+
+def cache_path(maze_path: Path) -> Path:
+    maze_path = Path(maze_path)
+    return maze_path.with_name(maze_path.stem + CACHE_SUFFIX)
+
+def save(path: Path, maze: Map, fields: DistanceFields):
+    with open(path, 'wb') as f: # np.savez would add .npz to a path that doesn't end with it
+        np.savez_compressed(f, maze_id=np.frombuffer(maze.digest(), dtype=np.uint8), **fields._asdict())
+
+def load(maze_path: Path, maze: Map | None = None, *, force: bool = False) -> DistanceFields:
+    """ Returns the distance fields of the maze saved at `maze_path`, from its cache when it was computed for the same
+    maze, else computes them and updates the cache. The cache is only a shortcut: when it can't be read (e.g. it is
+    corrupt) the fields are computed and cached again, when it can't be written (e.g. the maze is in a read-only
+    directory) they are only kept in memory. """
+    if maze is None:
+        maze = Map.load_from_file(maze_path)
+
+    path = cache_path(maze_path)
+    if path.exists() and not force:
+        try:
+            with np.load(path) as cached:
+                if cached['maze_id'].tobytes() == maze.digest():
+                    return DistanceFields(*(cached[name] for name in DistanceFields._fields))
+        except CACHE_READ_ERRORS as e:
+            logging.warning(f'Could not read the distances cached in {path}: {e}')
+
+    fields = compute(maze)
+    try:
+        save(path, maze, fields)
+    except OSError as e:
+        logging.warning(f'Could not cache the distances in {path}: {e}')
+    return fields
+
+def get_parser():
+    # Create the argument parser
+    parser = argparse.ArgumentParser(description="Compute the distance fields of mazes and cache them next to them.")
+
+    # Add arguments
+    parser.add_argument(
+        "mazes",
+        type=Path,
+        nargs="+",
+        help="Maze files."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Compute the fields again even if they are cached."
+    )
+
+    return parser
+
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+
+    for maze_path in args.mazes:
+        maze = Map.load_from_file(maze_path)
+        fields = load(maze_path, maze, force=args.force)
+        print(f'{maze_path}: exit {fields.to_exit[maze.entrance]} steps from the entrance, '
+              f'furthest cell {fields.to_exit.max()} from the exit -> {cache_path(maze_path)}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""This file contains the per session event log that viewers, recorders and other subscribers read from"""
+import collections
+import itertools
+import threading
+from typing import Deque, Iterator, List, Tuple
+
+DEFAULT_CAPACITY = 4096
+
+class EventLog:
+    """ Keeps the last `capacity` events of a session, numbered from 1. Events are never consumed: every subscriber
+    reads at its own cursor (the last sequence number it saw), so any number of them can follow the same session and
+    a subscriber that reconnects resumes where it left off. A subscriber that falls more than `capacity` events
+    behind skips the ones that were dropped. """
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._events: Deque[str] = collections.deque(maxlen=capacity)
+        self._last_seq = 0
+        self._condition = threading.Condition()
+        self.closed = False
+
+    def __len__(self):
+        return len(self._events)
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def publish(self, event: str) -> int:
+        """ Appends an event and wakes up the subscribers, returns its sequence number """
+        with self._condition:
+            self._events.append(event)
+            self._last_seq += 1
+            self._condition.notify_all()
+            return self._last_seq
+
+    def read(self, after: int, timeout: float | None = None) -> List[Tuple[int, str]]:
+        """ Returns the retained events numbered after `after`, waiting up to `timeout` seconds for one to arrive.
+        An empty list means the wait timed out or the log was closed. """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._last_seq > after or self.closed, timeout):
+                return []
+
+            first_seq = self._last_seq - len(self._events) + 1
+            start = max(after + 1, first_seq)
+            return list(zip(itertools.count(start), itertools.islice(self._events, start - first_seq, None)))
+
+    def subscribe(self, after: int = 0, timeout: float | None = None) -> Iterator[Tuple[int, str] | None]:
+        """ Yields (sequence number, event) for every event after `after` as they are published, until the log is
+        closed and every event published before that was yielded. With a timeout, yields None each time nothing was
+        published for that long. """
+        if after > self._last_seq:
+            after = 0 # the cursor comes from an earlier log (e.g. before a server restart)
+
+        while True:
+            events = self.read(after, timeout)
+            if not events:
+                if self.closed: # nothing left after the cursor
+                    return
+                yield None
+                continue
+
+            for seq, event in events:
+                yield seq, event
+            after = events[-1][0]
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
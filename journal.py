@@ -0,0 +1,286 @@
+"""This file contains the binary game journal written by the server, and the tool that replays it"""
+import argparse
+import logging
+from pathlib import Path
+import queue
+import struct
+import threading
+import time
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Tuple
+
+from common.game_elements import Map, GameState, Pos
+from common.pushes import PushTable
+import common.tiles as tiles
+
+MAGIC = b'MZJ1'
+
+# maze id, has seed, seed, width, height
+HEADER = struct.Struct('<16sBqHH')
+# record type, number of commands
+RECORD = struct.Struct('<cB')
+# moves granted for the next round, number of positions visited
+ROUND_TAIL = struct.Struct('<BH')
+POSITION = struct.Struct('<HH')
+MAX_BYTE, MAX_SHORT = 0xFF, 0xFFFF
+
+ROUND_RECORD = b'R'
+END_RECORD = b'E' # the agent reached the exit in the previous round
+
+BUFFER_SIZE = 64 * 1024
+
+class JournalHeader(NamedTuple):
+    maze_id: bytes
+    seed: int | None
+    width: int
+    height: int
+
+class JournalRound(NamedTuple):
+    commands: str
+    results: str
+    moves: int
+    positions: List[Pos]
+
+def maze_path(directory: Path, maze_id: bytes) -> Path:
+    return Path(directory) / f'{maze_id.hex()}.png'
+
+def encode_header(maze_id: bytes, seed: int | None, width: int, height: int) -> bytes:
+    return MAGIC + HEADER.pack(maze_id, seed is not None, seed if seed is not None else 0, width, height)
+
+def encode_round(commands: str, results: str, moves: int, positions: List[Pos]) -> bytes:
+    if len(commands) > MAX_BYTE or not 0 <= moves <= MAX_BYTE or len(positions) > MAX_SHORT:
+        raise ValueError(f'A round of {len(commands)} commands, {moves} moves and {len(positions)} positions '
+                         f'does not fit in a journal record')
+    for pos in positions:
+        if not (0 <= pos.x <= MAX_SHORT and 0 <= pos.y <= MAX_SHORT):
+            raise ValueError(f'{pos} does not fit in a journal record')
+
+    parts = [RECORD.pack(ROUND_RECORD, len(commands)), commands.encode('ascii'), results.encode('ascii'),
+             ROUND_TAIL.pack(moves, len(positions))]
+    parts.extend(POSITION.pack(int(pos.x), int(pos.y)) for pos in positions)
+    return b''.join(parts)
+
+class JournalWriter:
+    """ Writes one journal file per session. Records are handed to a single background thread through a queue,
+    so the request threads never touch the disk; files are buffered and flushed whenever the queue runs dry.
+    A record that can't be written (I/O error, value out of range) is logged and ends the journal of its session
+    only, the thread goes on with the others. """
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._queue: queue.Queue = queue.Queue()
+        self._files: Dict[str, BinaryIO] = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def open_session(self, agent_uuid: str, maze: Map, seed: int | None = None):
+        self._queue.put(('open', agent_uuid, maze, seed))
+
+    def record_round(self, agent_uuid: str, commands: str, results: str, moves: int, positions: List[Pos]):
+        self._queue.put(('round', agent_uuid, commands, results, moves, positions))
+
+    def record_end(self, agent_uuid: str):
+        self._queue.put(('end', agent_uuid))
+
+    def close(self):
+        """ Writes everything still queued and closes all the files """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                self._flush()
+                continue
+
+            if item is None:
+                break
+
+            try:
+                self._handle(item)
+            except Exception:
+                # The rounds after a missing one would not replay, so the journal of the session stops here
+                logging.exception(f'Could not journal {item[0]} of agent {item[1]}, its journal stops here')
+                self._close(item[1])
+
+            if self._queue.empty():
+                self._flush()
+
+        for agent_uuid in list(self._files):
+            self._close(agent_uuid)
+
+    def _handle(self, item: tuple):
+        kind, agent_uuid = item[0], item[1]
+
+        if kind == 'open':
+            _, _, maze, seed = item
+            maze_id = maze.digest()
+            path = maze_path(self.directory, maze_id)
+            if not path.exists():
+                maze.write_to_file(path)
+
+            self._close(agent_uuid)
+
+            file = open(self.directory / f'{int(time.time())}-{agent_uuid}.mzj', 'wb', buffering=BUFFER_SIZE)
+            file.write(encode_header(maze_id, seed, maze.shape[1], maze.shape[0]))
+            self._files[agent_uuid] = file
+            return
+
+        file = self._files.get(agent_uuid)
+        if file is None:
+            return
+
+        if kind == 'round':
+            file.write(encode_round(*item[2:]))
+        elif kind == 'end':
+            file.write(RECORD.pack(END_RECORD, 0))
+
+    def _close(self, agent_uuid: str):
+        file = self._files.pop(agent_uuid, None)
+        if file is not None:
+            try:
+                file.close()
+            except OSError:
+                logging.exception(f'Could not close the journal of agent {agent_uuid}')
+
+    def _flush(self):
+        for agent_uuid, file in list(self._files.items()):
+            try:
+                file.flush()
+            except OSError:
+                logging.exception(f'Could not write the journal of agent {agent_uuid}, it stops here')
+                self._close(agent_uuid)
+
+def read_journal(path: Path) -> Tuple[JournalHeader, Iterator[JournalRound | None]]:
+    """ Returns the header of a journal and an iterator over its rounds; `None` marks that the exit was reached """
+    data = Path(path).read_bytes()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'"{path}" is not a maze journal')
+
+    maze_id, has_seed, seed, width, height = HEADER.unpack_from(data, len(MAGIC))
+    header = JournalHeader(maze_id, seed if has_seed else None, width, height)
+
+    def rounds():
+        offset = len(MAGIC) + HEADER.size
+        while offset < len(data):
+            kind, num_commands = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+
+            if kind == END_RECORD:
+                yield None
+                continue
+
+            commands = data[offset : offset + num_commands].decode('ascii')
+            offset += num_commands
+            results = data[offset : offset + num_commands].decode('ascii')
+            offset += num_commands
+
+            moves, num_positions = ROUND_TAIL.unpack_from(data, offset)
+            offset += ROUND_TAIL.size
+            positions = [Pos(*POSITION.unpack_from(data, offset + i * POSITION.size)) for i in range(num_positions)]
+            offset += num_positions * POSITION.size
+
+            yield JournalRound(commands, results, moves, positions)
+
+    return header, rounds()
+
+def replay_round(game_state: GameState, commands: str) -> Tuple[JournalRound, bool]:
+    """ Runs a round of commands the same way the server does, returns what the journal should contain """
+    results = []
+    positions = []
+    end_reached = False
+
+    for move in commands:
+        command_result = game_state.perform_command(move)
+        results.append(str(1 if command_result is None else command_result))
+        positions.extend(game_state.current_move_visited_pos)
+
+        if game_state.current_map[game_state.pos] == tiles.Exit.code:
+            end_reached = True
+            break
+
+    moves = game_state.next_round_moves
+    game_state.new_round()
+    return JournalRound(commands, ''.join(results), moves, positions), end_reached
+
+def replay(path: Path, maze_dir: Path | None = None) -> Dict[str, int | float]:
+    """ Re-executes a journal through a fresh GameState, raises ValueError at the first divergence """
+    header, rounds = read_journal(path)
+    maze = Map.load_from_file(maze_path(maze_dir if maze_dir is not None else Path(path).parent, header.maze_id))
+    if maze.digest() != header.maze_id:
+        raise ValueError(f'The maze found for "{path}" does not match the one it was recorded on')
+
+    game_state = GameState(maps=[maze], shared_map=True, push_table=PushTable(maze))
+
+    start = time.perf_counter()
+    num_rounds = 0
+    num_commands = 0
+    solved = False
+    for index, recorded in enumerate(rounds):
+        if recorded is None:
+            solved = True
+            continue
+
+        replayed, _ = replay_round(game_state, recorded.commands)
+        if replayed != recorded:
+            raise ValueError(f'"{path}" diverges in round {index + 1}: recorded {recorded}, replayed {replayed}')
+
+        num_rounds += 1
+        num_commands += len(recorded.commands)
+
+    return {
+        'rounds': num_rounds,
+        'commands': num_commands,
+        'solved': solved,
+        'seconds': time.perf_counter() - start,
+    }
+
+def iter_positions(path: Path) -> Iterator[Pos]:
+    """ Yields every position visited in a journal, in order (e.g. to feed a viewer offline) """
+    _, rounds = read_journal(path)
+    for recorded in rounds:
+        if recorded is not None:
+            yield from recorded.positions
+
+def get_parser():
+    # Create the argument parser
+    parser = argparse.ArgumentParser(description="Replay game journals recorded by the server and check them.")
+
+    # Add arguments
+    parser.add_argument(
+        "journals",
+        type=Path,
+        nargs='+',
+        help="Journal files to replay."
+    )
+    parser.add_argument(
+        "--maze-dir",
+        type=Path,
+        help="Directory containing the mazes of the journals (defaults to the directory of each journal)."
+    )
+
+    return parser
+
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+
+    failed = 0
+    for path in args.journals:
+        try:
+            stats = replay(path, args.maze_dir)
+        except ValueError as e:
+            failed += 1
+            print(f'{path}: FAILED - {e}')
+            continue
+
+        rate = stats['commands'] / stats['seconds'] if stats['seconds'] else float('inf')
+        print(f'{path}: OK - {stats["rounds"]} rounds, {stats["commands"]} commands, '
+              f'{"solved" if stats["solved"] else "not solved"}, {rate:.0f} commands/s')
+
+    return failed
+
+if __name__ == "__main__":
+    exit(main())
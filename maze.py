@@ -1,14 +1,19 @@
 import argparse
-from collections import deque
 from pathlib import Path
 import random
-from typing import List
+from typing import Dict, List, Set, Tuple
 
-from common.game_elements import Map, Pos, GameState, Dir
+import numpy as np
+
+from common.game_elements import Dir, Map, Pos
+from common.pushes import Outcome, PushTable
+from common.search import FlatGrid
+from common.solver import solve
 import common.tiles as tiles
 
 FIRST_PREFFERENCE = 70 # percent
 MAX_NUM_TRAPS_REDIRECT = 4
+DRAWS_BLOCK = 4096 # random numbers drawn at once while carving
 
 def retry(times: int, first_different: bool=True):
     """
@@ -73,6 +78,11 @@ def get_parser():
         action="store_true",
         help="Enable the generation of portals. (note - does nothing when max-traps=0)"
     )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Solve the generated maze to check that its exit can be reached."
+    )
 
     return parser
 
@@ -96,114 +106,126 @@ def neighbors(maze: Map, cell: Pos, value: int, search=True, generate_maze: bool
 
     return neighbors
 
-def maze_order(maze: Map, start = Pos(1,1), first_try: bool=True):
-    visited = maze.copy()
-    visited[start] = tiles.Wall.code
-    prev = {}
-
-    max_dist = 0
-    furthest = start
-
-    # The queue contains the position and the minimum distance to it
-    queue = deque()
-    queue.append((start, 0))
-    while queue:
-        pos, dist = queue.popleft()
-        dist += 1
-        max_dist, furthest = max((max_dist, furthest), (dist, pos))
-
-        # Explore the neighboring nodes
-        for neighbor in neighbors(visited, pos, tiles.Path.code):
-            visited[neighbor] = tiles.Wall.code
-            queue.append((neighbor, dist))
-            prev[neighbor] = pos
-
-    if first_try:
-        # Start from one of the furthest ends of the maze
-        print("First try:", max_dist) # TODO remove
-        return maze_order(maze, furthest, first_try=False)
-    else:
-        print("Second try:", max_dist) # TODO remove
-        order = []
-        pos = furthest
-
-        while pos != start:
-            order.append(pos)
-            pos = prev[pos]
-
-        order.append(start)
-        return order
-
-def generate_walls(width, height):
+def maze_order(grid: FlatGrid, start = Pos(1,1)) -> np.ndarray:
+    """ Returns the flat indices of the longest path of the maze, found with two searches from `start` """
+    return grid.diameter_path(grid.index(start))
+
+def generate_walls(width, height, rng: random.Random):
+    """ Carves a maze with a randomized depth-first search over the cells (the odd coordinates), preferring to keep
+    going in the first free direction (N, W, S, E) to decrease branching. Works on flat indices of a padded cell grid,
+    so each step is a few list lookups; the random numbers are drawn in bulk with a numpy Generator seeded from
+    `rng`, so the walls only depend on its state. """
     # Fill maze with walls
     maze = Map(width=width, height=height)
     maze.fill(tiles.Wall.code)
 
-    # Randomly choose start location
-    start = Pos(random.randint(1, height-3) | 1, random.randint(1, width-3) | 1)
-    path_count = 1
-
-    maze[start] = tiles.Path.code
-
-    open_cells = [start]
-
-    while open_cells:
-        # Needs to be empty for the first iteration of the loop
-        n = []
-        # Add unnecessary element for elegance of code
-        # Allows open_cells.pop() at beginning of do while loop
-        open_cells.append((-1, -1))
+    cells_h, cells_w = (height - 1) // 2, (width - 1) // 2
+    stride = cells_w + 2 # one cell of padding on each side, marked as visited, so no bounds checks are needed
 
-        # Define current cell as last element in open_cells
-        # and get neighbors, discarding "locked" cells
-        while len(n) == 0:
-            open_cells.pop()
-            if not open_cells:
-                break
-
-            cell = open_cells[-1]
-            n = neighbors(maze, cell, value=tiles.Wall.code, generate_maze=True)
+    visited = np.ones((cells_h + 2, stride), dtype=np.uint8)
+    visited[1:-1, 1:-1] = 0
+    visited = bytearray(visited.tobytes())
 
-        # If we're done, don't bother continuing
-        if len(n) == 0:
-            break
+    # Same order as neighbors(): N, W, S, E
+    offsets = (-stride, -1, stride, 1)
 
-        # Choose random neighbor and add it to open_cells, but...
-        # ... simply vastly prefer the first neighbor to decrease branching
-        rest_len = len(n) - 1
-        if not rest_len:
+    # Randomly choose start location
+    start_x, start_y = rng.randint(1, height-3) | 1, rng.randint(1, width-3) | 1
+    start = (start_x // 2 + 1) * stride + start_y // 2 + 1
+    visited[start] = 1
+
+    num_cells = cells_h * cells_w
+    stack = [0] * num_cells
+    stack[0] = start
+    top = 0
+    # Every carved cell and the cell it was carved from
+    carved = [0] * num_cells
+    carved_from = [0] * num_cells
+    num_carved = 0
+
+    draws_rng = np.random.default_rng(rng.getrandbits(64))
+    first = FIRST_PREFFERENCE / 100
+    # Maps a draw in [first, 1) uniformly to one of the other k - 1 neighbors
+    rest_scale = [0, 0] + [(k - 1) / (1 - first) for k in range(2, 5)]
+    draws = []
+    next_draw = 0
+
+    while top >= 0:
+        cell = stack[top]
+        n = [cell + offset for offset in offsets if not visited[cell + offset]]
+
+        if not n:
+            top -= 1
+            continue
+
+        # Choose random neighbor, but simply vastly prefer the first neighbor to decrease branching
+        if len(n) == 1:
             choice = n[0]
         else:
-            choice = random.choices(n, [FIRST_PREFFERENCE] + rest_len * [(100 - FIRST_PREFFERENCE)/rest_len])[0]
-        # choice = random.choice(n)
-        open_cells.append(choice)
-
-        # Set neighbor to path
-        # Set connecting node between cell and choice to path
-        maze[choice] = tiles.Path.code
-        maze[(choice.x + cell.x) // 2, (choice.y + cell.y) // 2] = tiles.Path.code
-        path_count += 2
+            if next_draw == len(draws):
+                draws = draws_rng.random(DRAWS_BLOCK).tolist()
+                next_draw = 0
+            u = draws[next_draw]
+            next_draw += 1
+
+            choice = n[0] if u < first else n[1 + int((u - first) * rest_scale[len(n)])]
+
+        visited[choice] = 1
+        top += 1
+        stack[top] = choice
+        carved[num_carved] = choice
+        carved_from[num_carved] = cell
+        num_carved += 1
+
+    # Set the carved cells and the walls between them and the cells they were carved from to path
+    cells = np.array([start] + carved[:num_carved], dtype=np.int64)
+    parents = np.array(carved_from[:num_carved], dtype=np.int64)
+    cell_x, cell_y = 2 * (cells // stride) - 1, 2 * (cells % stride) - 1
+    parent_x, parent_y = 2 * (parents // stride) - 1, 2 * (parents % stride) - 1
+
+    maze[cell_x, cell_y] = tiles.Path.code
+    maze[(cell_x[1:] + parent_x) // 2, (cell_y[1:] + parent_y) // 2] = tiles.Path.code
+    path_count = 1 + 2 * num_carved
 
     print("Path count:", path_count)
     return maze, path_count
 
-@retry(times=3) # TODO subject to change
-def generate_maze(width, height, seed=None, * , max_traps=0, retry=False, portals=True):
-    if not retry:
-        random.seed(seed)
+def generate_maze(width, height, seed=None, * , max_traps=0, portals=True, rng: random.Random | None = None,
+                  validate=False):
+    """ Generates a maze from `seed`, or from the state of `rng` when given. Every stage draws from that generator
+    only, so the result doesn't depend on anything else running in the process (e.g. other threads generating) """
+    if rng is None:
+        rng = random.Random(seed)
+
+    return generate_maze_from(width, height, rng, max_traps=max_traps, portals=portals, validate=validate)
 
+@retry(times=3, first_different=False) # TODO subject to change
+def generate_layout(width, height, rng: random.Random):
+    """ Carves the walls and finds the longest path of the maze. This is the only stage that can fail (when the
+    longest path is too short for the 50% rule), and only it is redone; retries keep drawing from the same generator,
+    so they are reproducible too """
+    maze, path_count = generate_walls(width, height, rng)
+    grid = FlatGrid(maze)
+    loop_order = maze_order(grid)
+
+    if len(loop_order) <= path_count // 2:
+        raise ValueError(f"The longest path ({len(loop_order)} tiles) is too short for the 50% rule "
+                         f"({path_count // 2})")
+
+    return maze, path_count, grid, loop_order
+
+def generate_maze_from(width, height, rng: random.Random, * , max_traps=0, portals=True, validate=False):
     # Make them odd
     width  |= 1
     height |= 1
 
-    maze, path_count = generate_walls(width, height)
-    loop_order = maze_order(maze)
+    maze, path_count, grid, loop_order = generate_layout(width, height, rng)
 
     # Randomly choose entrance and exit locations with respect to the 50% rule
-    entrance_idx = random.randint(0, len(loop_order) - path_count // 2 - 1)
-    entrance = loop_order[entrance_idx]
+    entrance_idx = rng.randint(0, len(loop_order) - path_count // 2 - 1)
+    entrance = grid.pos(loop_order[entrance_idx])
     exit_idx = entrance_idx + path_count // 2
-    exit = loop_order[exit_idx]
+    exit = grid.pos(loop_order[exit_idx])
     loop_order = loop_order[entrance_idx : exit_idx + 1]
 
     maze[entrance] = tiles.Entrance.code
@@ -217,150 +239,214 @@ def generate_maze(width, height, seed=None, * , max_traps=0, retry=False, portal
     max_traps = min(total_max_traps // len(all_traps), max_traps)
     print("Max traps for current maze:", max_traps)
 
-    generate_traps(maze, all_traps, max_traps, loop_order)
+    # The placement stages can't fail: a tile that doesn't fit is tried elsewhere, and a stage that runs out of
+    # candidates places fewer tiles
+    pool = CandidatePool(maze, rng, grid.coords(loop_order))
 
-    generate_aux_tiles(maze, max_traps)
+    generate_traps(maze, all_traps, max_traps, grid.coords(loop_order), rng, pool)
 
-    if portals:
-        generate_portals(maze, max_traps)
+    generate_aux_tiles(maze, max_traps, rng, pool)
 
-    return maze
+    if portals:
+        generate_portals(maze, max_traps, rng, pool)
 
-def generate_traps(maze: Map, all_traps: List[tiles.Trap], max_traps: int, loop_order: list):
-    height, width = maze.shape
+    if validate:
+        # Play the finished maze with the same rules as the server
+        solution = solve(maze)
+        if solution is None:
+            raise ValueError("The exit can't be reached")
+        print(f"Solution: {solution.rounds} rounds, {solution.num_commands} commands")
 
-    path_to_sol = Map(width=width, height=height)
-    path_to_sol.fill(0)
+    return maze
 
-    for pos in loop_order:
-        path_to_sol[pos] = 1 # is part of the solution path
+class CandidatePool:
+    """ The cells where tiles can still be placed: Path cells with no special tile (anything but Path or Wall) next to
+    them. The masks are computed once with numpy, the cells are shuffled once and every kind of tile walks that order
+    with its own cursor, skipping the cells that stopped being free or that its mask excludes. Placing a tile takes
+    its cell and the 4 neighbors out of the pool, so no two special tiles are ever next to each other. """
+    TILE = 'tile'                   # any free cell (X-Ray points, Fogs, Towers, portals, MovesTraps)
+    TRAP = 'trap'                   # free cells off the solution path
+    STRAIGHT_TRAP = 'straight_trap' # ... also with walls on both sides or on neither, horizontally and vertically
+
+    def __init__(self, maze: Map, rng: random.Random, solution: Tuple[np.ndarray, np.ndarray] | None = None):
+        self.width = maze.shape[1]
+
+        maze = np.asarray(maze)
+        path = maze == tiles.Path.code
+        wall = maze == tiles.Wall.code
+        special = ~path & ~wall
+
+        near_special = np.zeros_like(special)
+        near_special[1:] |= special[:-1]
+        near_special[:-1] |= special[1:]
+        near_special[:, 1:] |= special[:, :-1]
+        near_special[:, :-1] |= special[:, 1:]
+        free = path & ~near_special
+
+        off_solution = np.ones_like(path)
+        if solution is not None:
+            off_solution[solution] = False
+
+        # A push trap with a Wall on one side and a Path on the other fails whatever its strength: a ForwardTrap
+        # pushes into the wall, a BackwardTrap bounces between the wall and itself forever. The cells left still need
+        # checking, pushes of strength 2 to 5 reach further than the neighbors (see PushChecker)
+        straight = np.zeros_like(path)
+        straight[1:-1, 1:-1] = (wall[1:-1, :-2] == wall[1:-1, 2:]) & (wall[:-2, 1:-1] == wall[2:, 1:-1])
+
+        # bytearrays, since they are indexed one cell at a time
+        self.free = bytearray(free.tobytes())
+        self.masks = {
+            self.TILE: None,
+            self.TRAP: bytearray(off_solution.tobytes()),
+            self.STRAIGHT_TRAP: bytearray((off_solution & straight).tobytes()),
+        }
+        self.cursors = {kind: 0 for kind in self.masks}
+
+        self.order = np.random.default_rng(rng.getrandbits(64)).permutation(np.flatnonzero(free)).tolist()
+
+    def take(self, kind: str = TILE) -> Pos | None:
+        """ Returns the next candidate for a kind of tile (without placing it), or None when there are no more """
+        order, free, mask = self.order, self.free, self.masks[kind]
+
+        cursor = self.cursors[kind]
+        while cursor < len(order):
+            cell = order[cursor]
+            cursor += 1
+            if free[cell] and (mask is None or mask[cell]):
+                self.cursors[kind] = cursor
+                return Pos(*divmod(cell, self.width))
+
+        self.cursors[kind] = cursor
+        return None
+
+    def place(self, pos: Pos):
+        cell = int(pos[0]) * self.width + int(pos[1])
+        for neighbor in (cell, cell - self.width, cell - 1, cell + self.width, cell + 1):
+            self.free[neighbor] = 0
+
+def generate_traps(maze: Map, all_traps: List[tiles.Trap], max_traps: int, solution: Tuple[np.ndarray, np.ndarray],
+                   rng: random.Random, pool: CandidatePool | None = None):
+    """ `solution` holds the x and y coordinates of the cells on the path from the entrance to the exit """
+    if pool is None:
+        pool = CandidatePool(maze, rng, solution)
+    checker = PushChecker(maze)
 
     total_max_traps = len(all_traps) * max_traps
 
     # generate traps
     for idx, trap_type in enumerate(all_traps):
         max_traps = min(total_max_traps // (len(all_traps) - idx), max_traps)
-        num_trap = random.randint(0, max_traps)
+        num_trap = rng.randint(0, max_traps)
         total_max_traps -= num_trap
 
-        for _ in range(num_trap):
-            while True:
-                i = random.randint(0, height - 1)
-                j = random.randint(0, width - 1)
-                pos = Pos(i, j)
-
-                if trap_type != tiles.MovesTrap and path_to_sol[pos]:
-                    continue
-
-                if maze[pos] != tiles.Path.code:
-                    continue
-
-                if trap_type == tiles.ForwardTrap:
-                    left_right_neigh = [Dir.move(pos, Dir.W), Dir.move(pos, Dir.E)]
-                    walls = [maze[neigh] == tiles.Wall.code for neigh in left_right_neigh]
-                    if any(walls) and not all(walls):
-                        continue
-
-                    up_down_neigh = [Dir.move(pos, Dir.N), Dir.move(pos, Dir.S)]
-                    walls = [maze[neigh] == tiles.Wall.code for neigh in up_down_neigh]
-                    if any(walls) and not all(walls):
-                        continue
-
-                trap_powers = [1, 2, 3, 4, 5]
-                random.shuffle(trap_powers)
-
-                for n in trap_powers:
-                    maze[pos] = trap_type(n).code
-                    valid = True
-                    for neigh in neighbors(maze, pos, tiles.Path.code, False):
-                        if maze[neigh] != tiles.Path.code and maze[neigh] != tiles.Wall.code:
-                            valid = False
-                            break
-
-                        # Only try visiting the trap when coming from a Path, can't start on a Wall
-                        if maze[neigh] == tiles.Path.code:
-                            try:
-                                state = GameState(maps=[maze], pos=pos)
-                                state.perform_command(Dir.get_direction(neigh, pos), max_num_traps_redirect=MAX_NUM_TRAPS_REDIRECT)
-                            except:
-                                valid = False
-                                break           
-
-                    if valid:
-                        break
-
-                if valid:
-                    break
-
-                maze[pos] = tiles.Path.code
-
-def generate_aux_tiles(maze: Map, max_aux_tiles: int):
-    height, width = maze.shape
+        if trap_type == tiles.MovesTrap:
+            kind = CandidatePool.TILE
+        elif trap_type in (tiles.ForwardTrap, tiles.BackwardTrap):
+            kind = CandidatePool.STRAIGHT_TRAP
+        else:
+            kind = CandidatePool.TRAP
+
+        placed = 0
+        while placed < num_trap:
+            pos = pool.take(kind)
+            if pos is None: # no more room for this type of trap
+                break
+
+            if trap_type in (tiles.ForwardTrap, tiles.BackwardTrap):
+                strengths = [1, 2, 3, 4, 5]
+                rng.shuffle(strengths)
+                if not any(checker.fits(pos, trap_type(n).code) for n in strengths):
+                    continue # tried elsewhere
+            else:
+                maze[pos] = trap_type(rng.randint(1, 5)).code
+
+            pool.place(pos)
+            placed += 1
+
+class PushChecker:
+    """ Checks that stepping on the push traps (ForwardTrap, BackwardTrap) of a maze being generated works out, from
+    a Path next to them or bouncing back from a Wall next to them: the chain of pushes lands somewhere, without pushing
+    into a wall, going on forever or passing more than MAX_NUM_TRAPS_REDIRECT traps. A new trap can change the chains
+    of the traps placed before it that go over its cell, so those are checked again. """
+    def __init__(self, maze: Map):
+        self.maze = maze
+        self.reach: Dict[Pos, Set[Pos]] = {} # the cells of the chains of every push trap placed, the trap included
+        self.crossing: Dict[Pos, Set[Pos]] = {} # the other way around, the traps whose chains go over every cell
+
+    def fits(self, pos: Pos, code: int) -> bool:
+        """ Places a push trap if it fits, else leaves the maze as it was """
+        self.maze[pos] = code
+        table = PushTable(self.maze) # chains are resolved when asked for, on the maze as it is now
+
+        reach = {}
+        for trap in [pos, *self.crossing.get(pos, ())]:
+            reach[trap] = self.chains(table, trap)
+            if reach[trap] is None:
+                self.maze[pos] = tiles.Path.code
+                return False
+
+        for trap, cells in reach.items():
+            for cell in self.reach.get(trap, ()):
+                self.crossing[cell].discard(trap)
+            for cell in cells:
+                self.crossing.setdefault(cell, set()).add(trap)
+            self.reach[trap] = cells
+        return True
+
+    def chains(self, table: PushTable, trap: Pos) -> Set[Pos] | None:
+        """ The cells of the chains started by stepping on `trap`, None if one fails """
+        cells = {trap}
+        for direction in [Dir.N, Dir.S, Dir.W, Dir.E]:
+            # The neighbors of a trap are Path or Wall, only a trap between two walls can't be stepped on that way
+            came_from, towards = Dir.move(trap, Dir.OPPOSITE[direction]), Dir.move(trap, direction)
+            if self.maze[came_from] == tiles.Wall.code and self.maze[towards] == tiles.Wall.code:
+                continue
+
+            push = table.get(trap, direction)
+            if push.outcome in (Outcome.WALL, Outcome.ENDLESS) or push.redirects > MAX_NUM_TRAPS_REDIRECT:
+                return None
+            cells.update(push.visited)
+        return cells
+
+def generate_aux_tiles(maze: Map, max_aux_tiles: int, rng: random.Random, pool: CandidatePool | None = None):
+    if pool is None:
+        pool = CandidatePool(maze, rng)
+
     # generate X-RAY points, Towers and Fogs
     for tile_type in [tiles.Xray, tiles.Fog, tiles.Tower]:
-        num_tiles = random.randint(0, max_aux_tiles)
+        num_tiles = rng.randint(0, max_aux_tiles)
         for _ in range(num_tiles):
-            while True:
-                i = random.randint(0, height - 1)
-                j = random.randint(0, width - 1)
-                pos = Pos(i, j)
-
-                if maze[pos] != tiles.Path.code:
-                    continue
+            pos = pool.take()
+            if pos is None:
+                return
 
-                valid = True
-                for neigh in neighbors(maze, pos, tiles.Path.code, False):
-                    if maze[neigh] != tiles.Path.code and maze[neigh] != tiles.Wall.code:
-                        valid = False
-                        break
+            maze[pos] = tile_type.code
+            pool.place(pos)
 
-                if valid:
-                    break
-    
-            maze[i][j] = tile_type.code
-
-def generate_portals(maze: Map, max_portals: int):
-    height, width = maze.shape
+def generate_portals(maze: Map, max_portals: int, rng: random.Random, pool: CandidatePool | None = None):
+    if pool is None:
+        pool = CandidatePool(maze, rng)
 
     first_portal = tiles.Portal.first_portal()
     max_portals = min(max_portals // 2, tiles.Portal.last_portal() - first_portal + 1)
 
-    last_portal = random.randint(first_portal, first_portal + max_portals)
+    last_portal = rng.randint(first_portal, first_portal + max_portals)
     # generate portals
-    portal_codes = iter(range(first_portal, last_portal))
-    pair_portal = None
-    pair_code = None
-    for _ in range(2 * first_portal, 2 * last_portal):
-        while True:
-            i = random.randint(0, height - 1)
-            j = random.randint(0, width - 1)
-            pos = Pos(i, j)
-
-            if maze[pos] != tiles.Path.code:
-                continue
+    for pair_code in range(first_portal, last_portal):
+        pair = [pool.take(), pool.take()]
+        if None in pair: # no room left for both ends of the pair
+            return
 
-            valid = True
-            for neigh in neighbors(maze, pos, tiles.Path.code, False):
-                if maze[neigh] != tiles.Path.code and maze[neigh] != tiles.Wall.code:
-                    valid = False
-                    break
-
-            if valid:
-                break
-
-        if pair_portal is None:
-            pair_portal = Pos(i, j)
-            pair_code = next(portal_codes)
-        else:
-            maze[pair_portal] = pair_code
-            maze[i][j] = pair_code
-            pair_portal = None
+        for pos in pair:
+            maze[pos] = pair_code
+            pool.place(pos)
 
 def main(args=None):
     parser = get_parser()
     args = parser.parse_args(args)
 
-    maze = generate_maze(args.width, args.height, max_traps=args.max_traps, seed=args.seed, portals=args.portals)
+    maze = generate_maze(args.width, args.height, max_traps=args.max_traps, seed=args.seed, portals=args.portals,
+                         validate=args.validate)
 
     # Convert maze to image
     maze.write_to_file(args.output)
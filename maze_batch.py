@@ -0,0 +1,150 @@
+"""Generates a corpus of mazes in parallel, every maze from its own seed derived from a base seed"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, NamedTuple
+
+import numpy as np
+
+import common.tiles as tiles
+import maze
+
+MANIFEST = 'manifest.json'
+
+class MazeTask(NamedTuple):
+    index: int
+    seed: int
+    width: int
+    height: int
+    max_traps: int
+    portals: bool
+    output: Path
+
+def get_parser():
+    # Create the argument parser
+    parser = argparse.ArgumentParser(description="Generate a batch of mazes across a pool of processes.")
+
+    # Add arguments
+    parser.add_argument(
+        "--output-dir", "-o",
+        type=Path,
+        required=True,
+        help="Directory where the mazes and their manifest are saved."
+    )
+    parser.add_argument(
+        "--count", "-n",
+        type=int,
+        required=True,
+        help="Number of mazes to generate."
+    )
+    parser.add_argument(
+        "--width", "-W",
+        type=int,
+        nargs=2,
+        metavar=("MIN", "MAX"),
+        required=True,
+        help="Range of the widths of the mazes (inclusive)."
+    )
+    parser.add_argument(
+        "--height", "-H",
+        type=int,
+        nargs=2,
+        metavar=("MIN", "MAX"),
+        required=True,
+        help="Range of the heights of the mazes (inclusive)."
+    )
+    parser.add_argument(
+        "--seed", "-s",
+        type=int,
+        default=0,
+        help="Base seed, the seed and size of every maze are derived from it and the maze's index."
+    )
+    parser.add_argument(
+        "--max-traps",
+        type=int,
+        default=0,
+        help="Max number of traps of each type."
+    )
+    parser.add_argument(
+        "--portals", "-p",
+        action="store_true",
+        help="Enable the generation of portals. (note - does nothing when max-traps=0)"
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes."
+    )
+
+    return parser
+
+def make_tasks(args) -> list[MazeTask]:
+    """ Derives the seed and size of every maze from the base seed and the maze's index only, so the batch is the
+    same no matter how it is split between workers """
+    tasks = []
+    for index, child in enumerate(np.random.SeedSequence(args.seed).spawn(args.count)):
+        rng = np.random.default_rng(child)
+        seed = int(rng.integers(2**63))
+        width = int(rng.integers(args.width[0], args.width[1] + 1))
+        height = int(rng.integers(args.height[0], args.height[1] + 1))
+        tasks.append(MazeTask(index, seed, width, height, args.max_traps, args.portals,
+                              args.output_dir / f'maze_{index:06d}.png'))
+    return tasks
+
+def generate_one(task: MazeTask) -> Dict[str, Any]:
+    with contextlib.redirect_stdout(io.StringIO()): # the generator prints its progress
+        gen_maze = maze.generate_maze(task.width, task.height, task.seed, max_traps=task.max_traps,
+                                      portals=task.portals)
+    gen_maze.write_to_file(task.output)
+
+    arr = np.asarray(gen_maze)
+    codes, counts = np.unique(arr, return_counts=True)
+    tile_counts: Dict[str, int] = {}
+    for code, count in zip(codes.tolist(), counts.tolist()):
+        name = tiles.CODE_TO_TYPE[code].__name__
+        if name not in ['Path', 'Wall', 'Entrance', 'Exit']:
+            tile_counts[name] = tile_counts.get(name, 0) + count
+
+    return {
+        'index': task.index,
+        'file': task.output.name,
+        'seed': task.seed,
+        'width': arr.shape[1],
+        'height': arr.shape[0],
+        'entrance': [int(v) for v in np.argwhere(arr == tiles.Entrance.code)[0]],
+        'exit': [int(v) for v in np.argwhere(arr == tiles.Exit.code)[0]],
+        'tiles': tile_counts,
+    }
+
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = make_tasks(args)
+
+    if args.jobs <= 1:
+        entries = [generate_one(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            entries = list(executor.map(generate_one, tasks, chunksize=max(1, len(tasks) // (4 * args.jobs))))
+
+    manifest = {
+        'seed': args.seed,
+        'max_traps': args.max_traps,
+        'portals': args.portals,
+        'mazes': entries,
+    }
+    with open(args.output_dir / MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    print(f'Generated {len(entries)} mazes in {args.output_dir}')
+    return manifest
+
+if __name__ == "__main__":
+    main()
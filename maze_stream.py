@@ -0,0 +1,221 @@
+"""Generates mazes of any size row by row, in memory proportional to the width only, straight into a PNG or raw file"""
+import argparse
+from pathlib import Path
+import struct
+import sys
+from typing import BinaryIO, Iterator
+import zlib
+
+import numpy as np
+
+import common.tiles as tiles
+
+RUN_BREAK = 0.5 # probability that a dead-end run of a branch row ends after a cell
+MIN_WIDTH, MIN_HEIGHT = 5, 9
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+IDAT_SIZE = 1 << 20
+
+class StreamingMaze:
+    """ A perfect maze (every cell is connected to every other one by exactly one path) built from bands of cell rows.
+
+    The even cell rows are the spine: full corridors joined at alternating ends into one snake that goes from the
+    entrance (first cell) to the exit (end of the last spine row). The odd cell rows are branch rows, cut into random
+    dead-end runs; every run hangs off the spine row above or below through exactly one opening,
+    except the cell linking the two spine rows. A run of L cells adds 2L tiles and a spine row of C cells 2C - 1 plus
+    3 for its link, so the spine holds more than half of the tiles and the exit is always at least half the path away
+    from the entrance, without ever looking at more than the current band.
+    """
+    def __init__(self, width: int, height: int, seed: int | None = None):
+        # Make them odd
+        self.width = width | 1
+        self.height = height | 1
+        if self.width < MIN_WIDTH or self.height < MIN_HEIGHT:
+            raise ValueError(f'Streamed mazes must be at least {MIN_WIDTH}x{MIN_HEIGHT}')
+
+        self.cells_w = (self.width - 1) // 2
+        self.cells_h = (self.height - 1) // 2
+        self.num_spines = (self.cells_h + 1) // 2
+        self.seed = seed
+
+        last_spine = 2 * (self.num_spines - 1)
+        self.entrance = (1, 1)
+        self.exit = (2 * last_spine + 1, 2 * (self.cells_w - 1) + 1 if self.num_spines % 2 else 1)
+
+        # Tiles from the entrance to the exit, both included
+        self.spine_tiles = self.num_spines * (2 * self.cells_w - 1) + 3 * (self.num_spines - 1)
+        self.path_count = 0 # counted while the rows are generated
+
+    def link_column(self, spine: int) -> int:
+        """ Column of the cell linking spine row `spine` to the next one """
+        return self.cells_w - 1 if spine % 2 == 0 else 0
+
+    def rows(self) -> Iterator[np.ndarray]:
+        """ Yields the rows of the maze, top to bottom, as uint8 tile codes """
+        rng = np.random.default_rng(self.seed)
+        self.path_count = 0
+
+        border = np.full(self.width, tiles.Wall.code, dtype=np.uint8)
+        yield border
+
+        for spine in range(self.num_spines):
+            row = self._spine_row(spine)
+            self.path_count += np.count_nonzero(row)
+            yield row
+
+            if 2 * spine + 1 >= self.cells_h:
+                break
+
+            # The branch row under this spine row, and the openings above and below it
+            has_next = spine + 1 < self.num_spines
+            link = self.link_column(spine) if has_next else None
+            up_row, branch_row, down_row = self._branch_rows(rng, link, has_next)
+            for row in (up_row, branch_row, down_row):
+                self.path_count += np.count_nonzero(row)
+            yield up_row
+            yield branch_row
+
+            if has_next:
+                yield down_row
+
+        yield border
+
+    def _spine_row(self, spine: int) -> np.ndarray:
+        row = np.full(self.width, tiles.Wall.code, dtype=np.uint8)
+        row[1:-1] = tiles.Path.code
+
+        if spine == 0:
+            row[self.entrance[1]] = tiles.Entrance.code
+        if spine == self.num_spines - 1:
+            row[self.exit[1]] = tiles.Exit.code
+        return row
+
+    def _branch_rows(self, rng: np.random.Generator, link: int | None, has_next: bool):
+        cells_w = self.cells_w
+
+        breaks = rng.random(cells_w - 1) < RUN_BREAK # breaks[c]: cells c and c + 1 are in different runs
+        if link is not None:
+            # The link cell is a run of its own, it is already connected both ways
+            breaks[max(link - 1, 0) : link + 1] = True
+
+        starts = np.flatnonzero(np.concatenate(([True], breaks)))
+        lengths = np.diff(np.append(starts, cells_w))
+        openings = starts + (rng.random(len(starts)) * lengths).astype(np.int64)
+        up = rng.random(len(starts)) < 0.5 if has_next else np.ones(len(starts), dtype=bool)
+        if link is not None:
+            runs = openings != link
+            openings, up = openings[runs], up[runs]
+
+        branch_row = np.full(self.width, tiles.Wall.code, dtype=np.uint8)
+        branch_row[1:-1:2] = tiles.Path.code
+        branch_row[2:-1:2][~breaks] = tiles.Path.code
+
+        up_row = np.full(self.width, tiles.Wall.code, dtype=np.uint8)
+        up_row[2 * openings[up] + 1] = tiles.Path.code
+        down_row = np.full(self.width, tiles.Wall.code, dtype=np.uint8)
+        down_row[2 * openings[~up] + 1] = tiles.Path.code
+
+        if link is not None:
+            up_row[2 * link + 1] = tiles.Path.code
+            down_row[2 * link + 1] = tiles.Path.code
+
+        return up_row, branch_row, down_row
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def write_png(out: BinaryIO, width: int, height: int, rows: Iterator[np.ndarray], level: int = 1):
+    """ Writes 8 bit grayscale rows as a PNG (the format Map.load_from_file reads), compressing as they come """
+    out.write(PNG_SIGNATURE)
+    out.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+
+    compressor = zlib.compressobj(level)
+    pending = []
+    pending_size = 0
+    for row in rows:
+        data = compressor.compress(b'\x00' + row.tobytes()) # filter type 0 (None) before every row
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= IDAT_SIZE:
+            out.write(png_chunk(b'IDAT', b''.join(pending)))
+            pending, pending_size = [], 0
+
+    pending.append(compressor.flush())
+    out.write(png_chunk(b'IDAT', b''.join(pending)))
+    out.write(png_chunk(b'IEND', b''))
+
+def write_raw(out: BinaryIO, rows: Iterator[np.ndarray]):
+    for row in rows:
+        out.write(row.tobytes())
+
+def get_parser():
+    # Create the argument parser
+    parser = argparse.ArgumentParser(description="Stream a maze of any size to a file, one row at a time.")
+
+    # Add arguments
+    parser.add_argument(
+        "--output", "-o",
+        required=True,
+        help="Path where the maze will be saved, '-' for standard output."
+    )
+    parser.add_argument(
+        "--width", "-W",
+        type=int,
+        required=True,
+        help="Width of the maze."
+    )
+    parser.add_argument(
+        "--height", "-H",
+        type=int,
+        required=True,
+        help="Height of the maze."
+    )
+    parser.add_argument(
+        "--seed", "-s",
+        type=int,
+        help="Seed to be used."
+    )
+    parser.add_argument(
+        "--format", "-f",
+        choices=["png", "raw"],
+        default="png",
+        help="PNG image, or raw rows of width bytes each with no header."
+    )
+    parser.add_argument(
+        "--compression",
+        type=int,
+        choices=range(10),
+        default=1,
+        metavar="0-9",
+        help="zlib level of the PNG. Compression takes most of the time, "
+             "1 is several times faster than 6 for files about 50%% larger."
+    )
+
+    return parser
+
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+
+    try:
+        maze = StreamingMaze(args.width, args.height, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    out = sys.stdout.buffer if args.output == '-' else open(Path(args.output), 'wb', buffering=IDAT_SIZE)
+    try:
+        if args.format == 'png':
+            write_png(out, maze.width, maze.height, maze.rows(), args.compression)
+        else:
+            write_raw(out, maze.rows())
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    print(f'{maze.width}x{maze.height} maze, {maze.path_count} path tiles, entrance {maze.entrance}, '
+          f'exit {maze.exit} ({maze.spine_tiles - 1} tiles away)', file=sys.stderr)
+    return maze
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""This file contains a minimal metrics registry for the server, rendered in the Prometheus text format"""
+from abc import ABC, abstractmethod
+import bisect
+from contextlib import contextmanager
+import threading
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (in seconds) of the latency histogram buckets, the last bucket (+Inf) is implicit
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels.keys(), escaped)) + '}'
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric(ABC):
+    """ Base class for all metrics; a metric with label names holds one child per combination of label values """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: 'Registry' = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Metric] = {}
+        self._lock = threading.Lock()
+
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, **labels):
+        """ Drops the child of these label values, e.g. when what they describe is gone """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._children.pop(key, None)
+
+    @abstractmethod
+    def _new_child(self) -> 'Metric':
+        pass
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """ Returns (suffix, labels, value) for every sample of this metric """
+        if not self.labelnames:
+            return self._child_samples({})
+
+        result = []
+        for key, child in list(self._children.items()):
+            result.extend(child._child_samples(dict(zip(self.labelnames, key))))
+        return result
+
+    @abstractmethod
+    def _child_samples(self, labels: Dict[str, str]) -> List[Tuple[str, Dict[str, str], float]]:
+        pass
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation, registry=_DETACHED)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def _child_samples(self, labels):
+        return [('_total', labels, self._value)]
+
+class Gauge(Metric):
+    """ A value that can go up and down; it can also be computed on every scrape with `set_function` """
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0
+        self._function: Callable[[], float] | None = None
+
+    def _new_child(self):
+        return Gauge(self.name, self.documentation, registry=_DETACHED)
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function: Callable):
+        """ The function returns the value, or for a labelled gauge a dict of {label values tuple: value} """
+        self._function = function
+
+    def samples(self):
+        if self._function is None or not self.labelnames:
+            return super().samples()
+
+        return [('', dict(zip(self.labelnames, key)), value) for key, value in self._function().items()]
+
+    def _child_samples(self, labels):
+        return [('', labels, self._function() if self._function is not None else self._value)]
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(*args, **kwargs)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets, registry=_DETACHED)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """ Observes the duration of the wrapped block; also usable as a function decorator """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def _child_samples(self, labels):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            result.append(('_bucket', {**labels, 'le': format_value(float(bound))}, cumulative))
+        result.append(('_sum', labels, total))
+        result.append(('_count', labels, cumulative))
+        return result
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+class _DetachedRegistry(Registry):
+    """ Children of labelled metrics are rendered by their parent, so they must not be registered anywhere """
+    def register(self, metric: Metric):
+        pass
+
+REGISTRY = Registry()
+_DETACHED = _DetachedRegistry()
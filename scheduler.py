@@ -0,0 +1,121 @@
+"""This file contains the admission control of the server: per agent rate limits and a fair scheduler that caps the
+number of rounds simulated at the same time"""
+import collections
+from contextlib import contextmanager
+import threading
+import time
+from typing import Deque, Dict
+
+class Rejected(Exception):
+    """ Raised when a request is refused because of overload, the client should retry after `retry_after` seconds """
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """ Allows `rate` requests per second on average, and bursts of up to `burst` requests """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """ Takes a token, returns 0 on success or else the number of seconds until a token is available """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+class FairScheduler:
+    """ Lets at most `max_running` callers run at the same time. The others wait in a FIFO per session, and the
+    sessions take turns when a slot is freed, so an agent sending many requests only delays its own. Callers are
+    rejected right away when `max_waiting` callers (or `max_per_session` of the same session) are already waiting,
+    and after `max_wait` seconds without getting a slot. """
+    def __init__(self, max_running: int, max_waiting: int, max_per_session: int = 2, max_wait: float = 1.0):
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.max_per_session = max_per_session
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        self._queues: Dict[str, Deque[threading.Event]] = {}
+        self._turns: Deque[str] = collections.deque() # sessions with waiting callers, in the order they get a slot
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def acquire(self, session: str):
+        with self._lock:
+            if self._running < self.max_running and self._waiting == 0:
+                self._running += 1
+                return
+
+            session_queue = self._queues.get(session)
+            if self._waiting >= self.max_waiting:
+                raise Rejected('Server overloaded', self.max_wait)
+            if session_queue is not None and len(session_queue) >= self.max_per_session:
+                raise Rejected('Too many requests in flight', self.max_wait)
+
+            if session_queue is None:
+                session_queue = self._queues[session] = collections.deque()
+                self._turns.append(session)
+
+            ticket = threading.Event()
+            session_queue.append(ticket)
+            self._waiting += 1
+
+        if ticket.wait(self.max_wait):
+            return
+
+        with self._lock:
+            if ticket.is_set(): # the slot was handed over while timing out
+                return
+
+            session_queue.remove(ticket)
+            self._waiting -= 1
+            if not session_queue:
+                del self._queues[session]
+                self._turns.remove(session)
+
+        raise Rejected('Timed out waiting for a slot', self.max_wait)
+
+    def release(self):
+        with self._lock:
+            if not self._turns:
+                self._running -= 1
+                return
+
+            # The slot goes straight to the next session in turn, so _running doesn't change
+            session = self._turns.popleft()
+            session_queue = self._queues[session]
+            ticket = session_queue.popleft()
+            self._waiting -= 1
+            if session_queue:
+                self._turns.append(session)
+            else:
+                del self._queues[session]
+
+            ticket.set()
+
+    @contextmanager
+    def slot(self, session: str):
+        self.acquire(session)
+        try:
+            yield
+        finally:
+            self.release()
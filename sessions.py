@@ -0,0 +1,104 @@
+"""This file contains the stores that keep serialized agent sessions, so any server worker can resume any session"""
+from abc import ABC, abstractmethod
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+class SessionStore(ABC):
+    @abstractmethod
+    def get(self, agent_uuid: str) -> bytes | None:
+        pass
+
+    @abstractmethod
+    def put(self, agent_uuid: str, state: bytes):
+        pass
+
+    @abstractmethod
+    def delete(self, agent_uuid: str):
+        pass
+
+    # The mazes the sessions are played on, a worker resuming a session may not have generated or loaded its maze
+    @abstractmethod
+    def get_maze(self, maze_id: bytes) -> bytes | None:
+        pass
+
+    @abstractmethod
+    def put_maze(self, maze_id: bytes, maze: bytes):
+        pass
+
+class MemorySessionStore(SessionStore):
+    """ Keeps the sessions in this process only """
+    def __init__(self):
+        self._sessions: Dict[str, bytes] = {}
+        self._mazes: Dict[bytes, bytes] = {}
+
+    def get(self, agent_uuid: str) -> bytes | None:
+        return self._sessions.get(agent_uuid)
+
+    def put(self, agent_uuid: str, state: bytes):
+        self._sessions[agent_uuid] = state
+
+    def delete(self, agent_uuid: str):
+        self._sessions.pop(agent_uuid, None)
+
+    def get_maze(self, maze_id: bytes) -> bytes | None:
+        return self._mazes.get(maze_id)
+
+    def put_maze(self, maze_id: bytes, maze: bytes):
+        self._mazes[maze_id] = maze
+
+class SQLiteSessionStore(SessionStore):
+    """ Keeps the sessions in a local SQLite file shared by all the workers on the machine. WAL mode lets readers
+    work alongside the (single) writer, and each statement is its own short transaction. """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS sessions '
+                '(uuid TEXT PRIMARY KEY, state BLOB NOT NULL, updated REAL NOT NULL)'
+            )
+            connection.execute('CREATE TABLE IF NOT EXISTS mazes (id BLOB PRIMARY KEY, maze BLOB NOT NULL)')
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads, so every thread gets its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, agent_uuid: str) -> bytes | None:
+        row = self._connection().execute('SELECT state FROM sessions WHERE uuid = ?', (agent_uuid,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, agent_uuid: str, state: bytes):
+        self._connection().execute(
+            'INSERT INTO sessions (uuid, state, updated) VALUES (?, ?, ?) '
+            'ON CONFLICT(uuid) DO UPDATE SET state = excluded.state, updated = excluded.updated',
+            (agent_uuid, state, time.time())
+        )
+
+    def delete(self, agent_uuid: str):
+        self._connection().execute('DELETE FROM sessions WHERE uuid = ?', (agent_uuid,))
+
+    def get_maze(self, maze_id: bytes) -> bytes | None:
+        row = self._connection().execute('SELECT maze FROM mazes WHERE id = ?', (maze_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put_maze(self, maze_id: bytes, maze: bytes):
+        # The id is a digest of the content, a maze stored already is the same
+        self._connection().execute('INSERT OR IGNORE INTO mazes (id, maze) VALUES (?, ?)', (maze_id, maze))
+
+def open_store(spec: str) -> SessionStore:
+    """ Creates a store from its command line description: `memory` or `sqlite:<path>` """
+    if spec == 'memory':
+        return MemorySessionStore()
+    if spec.startswith('sqlite:'):
+        return SQLiteSessionStore(Path(spec[len('sqlite:'):]))
+    raise ValueError(f'"{spec}" is not a valid session store, use "memory" or "sqlite:<path>"')
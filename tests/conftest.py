@@ -0,0 +1,38 @@
+import pytest
+
+import app
+from common.game_elements import GameState, Map, Pos
+
+# Module level state of the server, given a fresh value for every test
+SERVER_STATE = ['AGENTS', 'AGENT_VIEWER', 'AGENTS_TIME', 'AGENTS_STATS', 'AGENTS_MAZE_ID', 'EVENT_LOGS', 'RATE_LIMITS',
+                'MAZES', 'PUSH_TABLES', 'DISTANCES_TO_EXIT', 'MAZE_AGENTS']
+
+def start_race_server(monkeypatch: pytest.MonkeyPatch, maze_map: Map, *args: str):
+    """ Sets up the in-process server to race on `maze_map`, `args` being more command line arguments. Everything is
+    set through `monkeypatch`, so undoing it restores the server as it was. Returns a test client. """
+    for name in SERVER_STATE:
+        monkeypatch.setattr(app, name, {})
+    monkeypatch.setattr(app, 'LAST_AGENT_UUID', None)
+    monkeypatch.setattr(app, 'ARGS', app.get_parser().parse_args(['--race', *args]))
+    monkeypatch.setattr(app, 'RACE_MODE', True)
+    monkeypatch.setattr(app, 'MAZE', None)
+    monkeypatch.setattr(app, 'MAZE_ID', None)
+    monkeypatch.setattr(app, 'MAZE_SEED', None)
+    monkeypatch.setattr(app, 'JOURNAL', None)
+    monkeypatch.setattr(app, 'SESSION_STORE', None)
+
+    app.set_maze(maze_map)
+    return app.server.test_client()
+
+def register_agent(client) -> tuple[str, GameState]:
+    """ Registers a new agent, returns its UUID and the game state it starts from, as an agent builds it """
+    response = client.post('/api/register_agent', json={}).get_json()
+
+    agent_uuid = response.pop('UUID')
+    response['pos'] = Pos(int(response.pop('x')), int(response.pop('y')))
+    return agent_uuid, GameState(**response, agent=True)
+
+@pytest.fixture
+def race_server(monkeypatch):
+    """ Starts the in-process server on a maze: race_server(maze_map, *args) -> test client """
+    return lambda maze_map, *args: start_race_server(monkeypatch, maze_map, *args)
@@ -0,0 +1,108 @@
+import numpy as np
+
+import agentV2
+import app
+import maze
+from common import tiles
+from common.game_elements import Dir, GameState, Map, Pos
+from tests.conftest import register_agent
+
+def play(client, max_rounds: int = 5000, known_maps=None, finish: bool = True):
+    """ Plays agentV2 against the in-process server, returns the last response, the commands of every round and the
+    game state. Unless `finish` is False, the agent must reach the end within `max_rounds`. """
+    uuid, game_state = register_agent(client)
+    if known_maps is None:
+        known_maps = {}
+
+    rounds = []
+    discovered_forward_traps = set()
+    for _ in range(max_rounds):
+        commands, temp_visited, visited_pos = agentV2.plan(game_state, known_maps)
+        rounds.append(commands)
+
+        response = app.check_moves(uuid, ''.join(commands))
+        if 'end' in response:
+            break
+        agentV2.update(game_state, response, temp_visited, visited_pos, discovered_forward_traps)
+    else:
+        if finish:
+            raise AssertionError('The agent did not finish')
+
+    return response, rounds, game_state
+
+def test_solves_maze(race_server):
+    np.random.seed(4)
+    response, rounds, _ = play(race_server(Map(nparr=np.asarray(maze.generate_maze(41, 41, 7, max_traps=8)))))
+
+    assert int(response.get('end', 0))
+    assert all(1 <= len(commands) <= GameState.MAX_MOVES_PER_TURN for commands in rounds)
+
+def test_known_maps_follow_views(monkeypatch, race_server):
+    # The maps behind portals are made as big as any maze can be, way more than needed here
+    monkeypatch.setattr(Map, 'MAX_WIDTH', 121)
+    monkeypatch.setattr(Map, 'MAX_HEIGHT', 121)
+    monkeypatch.setattr(Map, 'AGENT_ANCHOR', Pos(60, 60))
+
+    np.random.seed(5)
+    known_maps = {}
+    _, _, game_state = play(race_server(Map(nparr=np.asarray(maze.generate_maze(61, 61, 6, max_traps=10)))), 60,
+                            known_maps, finish=False)
+
+    agentV2.known_map(game_state, known_maps)
+    assert len(known_maps) >= 2 # went through a portal
+    for known in known_maps.values():
+        assert (known.grid[1:-1, 1:-1] == np.asarray(known.map)).all()
+        assert (known.grid[0] == agentV2.OUTSIDE).all() and (known.grid[:, -1] == agentV2.OUTSIDE).all()
+
+        portals = {known.pos(index): known.portal_pair(index) for cells in known.portals.values() for index in cells}
+        assert portals == known.map.portals
+
+def test_frontier_planner_solves_maze(monkeypatch, race_server):
+    monkeypatch.setattr(Map, 'MAX_WIDTH', 81)
+    monkeypatch.setattr(Map, 'MAX_HEIGHT', 81)
+    monkeypatch.setattr(Map, 'AGENT_ANCHOR', Pos(40, 40))
+
+    np.random.seed(4)
+    uuid, game_state = register_agent(race_server(Map(nparr=np.asarray(maze.generate_maze(41, 41, 6, max_traps=8)))))
+    planner = agentV2.FrontierPlanner(game_state, {})
+
+    for _ in range(1000):
+        commands = planner.plan()
+        assert 1 <= len(commands) <= GameState.MAX_MOVES_PER_TURN
+        assert 'P' not in commands[:-1] # nothing is planned after entering a portal
+
+        response = app.check_moves(uuid, ''.join(commands))
+        if 'end' in response:
+            break
+        agentV2.update_frontier(game_state, response)
+
+    assert int(response.get('end', 0))
+
+def frontier_plan(rows, pos: Pos, moves: int = GameState.MAX_MOVES_PER_TURN):
+    """ The round the frontier planner makes on a map drawn with # . ? for the walls, paths and unknown tiles, M and F
+    for MovesTraps and ForwardTraps of strength 1 """
+    codes = {'#': tiles.Wall.code, '.': tiles.Path.code, '?': tiles.UnknownTile.code,
+             'M': tiles.MovesTrap.base_code + 1, 'F': tiles.ForwardTrap.base_code + 1}
+    arr = np.array([[codes[char] for char in row] for row in rows], dtype=np.uint8)
+    game_state = GameState(maps=[Map(nparr=arr, anchor=pos)], pos=pos, moves=moves, agent=True)
+    return agentV2.FrontierPlanner(game_state, {}).plan()
+
+def test_frontier_planner_uses_all_moves():
+    # Every step east shows more unknown tiles, each one is worth going on for
+    rows = ['#' * 6 + '?' * 24] * 2 + ['#' + '.' * 28 + '#'] + ['#' * 6 + '?' * 24] * 2
+    assert frontier_plan(rows, Pos(2, 1), moves=7) == [Dir.E] * 7
+    assert frontier_plan(rows, Pos(2, 1)) == [Dir.E] * GameState.MAX_MOVES_PER_TURN
+
+def test_frontier_planner_weighs_traps():
+    # Two ways of the same length around the wall in the middle, to the unknown tiles in the east
+    def rows(north, south):
+        return ['#' * 16 + '?' * 8,
+                '#....' + north + '....######' + '?' * 8,
+                '#.#######.......' + '?' * 8,
+                '#....' + south + '....######' + '?' * 8,
+                '#' * 16 + '?' * 8]
+
+    # A MovesTrap costs the moves it takes, a ForwardTrap may throw the agent anywhere on the way
+    assert frontier_plan(rows('F', 'M'), Pos(2, 1)) == [Dir.S] + [Dir.E] * 8 + [Dir.N]
+    assert frontier_plan(rows('M', 'F'), Pos(2, 1)) == [Dir.N] + [Dir.E] * 8 + [Dir.S]
+    assert frontier_plan(rows('.', 'M'), Pos(2, 1))[0] == Dir.N
@@ -0,0 +1,53 @@
+import csv
+import json
+import math
+
+import numpy as np
+
+import analyze
+from common.game_elements import Map
+import common.tiles as tiles
+import maze
+
+def test_perfect_maze():
+    gen_maze = maze.generate_maze(41, 31, 7)
+    metrics = analyze.analyze(gen_maze)
+
+    # A tree: every junction of degree d adds d - 2 dead ends, plus the two ends of a path
+    degrees = analyze.open_degrees(np.asarray(gen_maze))
+    assert metrics['dead_ends'] == 2 + int((degrees[degrees >= 3] - 2).sum())
+    assert metrics['traps'] == metrics['portals'] == 0
+    assert metrics['optimal_commands'] == metrics['solution_length']
+    assert metrics['optimal_rounds'] == math.ceil(metrics['solution_length'] / 10)
+
+def test_no_way_out():
+    arr = np.asarray(maze.generate_maze(21, 21, 1)).copy()
+    no_exit = np.where(arr == tiles.Exit.code, tiles.Path.code, arr)
+
+    # The exit walled in
+    walled = arr.copy()
+    x, y = np.argwhere(arr == tiles.Exit.code)[0]
+    walled[x - 1 : x + 2, y - 1 : y + 2] = tiles.Wall.code
+    walled[x, y] = tiles.Exit.code
+
+    for broken in [no_exit, walled]:
+        metrics = analyze.analyze(broken)
+        assert metrics['solution_length'] is metrics['optimal_rounds'] is metrics['optimal_commands'] is None
+
+def test_corpus(tmp_path):
+    for seed in range(3):
+        maze.generate_maze(31, 31, seed, max_traps=4, portals=True).write_to_file(tmp_path / f'{seed}.png')
+
+    analyze.main([str(tmp_path), '-o', str(tmp_path / 'metrics.json'), '-j', '1'])
+    analyze.main([str(tmp_path), '-o', str(tmp_path / 'metrics.csv'), '-j', '2', '--no-solve'])
+
+    with open(tmp_path / 'metrics.json') as f:
+        results = json.load(f)
+    with open(tmp_path / 'metrics.csv') as f:
+        rows = list(csv.DictReader(f))
+
+    assert [result['file'] for result in results] == [row['file'] for row in rows] == ['0.png', '1.png', '2.png']
+    for result, row in zip(results, rows):
+        assert result == analyze.analyze(Map.load_from_file(tmp_path / result['file'])) | {'file': result['file']}
+        assert int(row['solution_length']) == result['solution_length'] and row['optimal_rounds'] == ''
+        assert result['optimal_rounds'] is not None
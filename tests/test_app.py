@@ -0,0 +1,125 @@
+import random
+import sys
+
+import numpy as np
+
+import app
+import maze
+import sessions
+from common.game_elements import Dir, Map
+
+def test_memoized_views_match(monkeypatch, race_server):
+    client = race_server(Map(nparr=np.asarray(maze.generate_maze(30, 30, 4, max_traps=6))))
+    memoized, fresh = (client.post('/api/register_agent', json={}).get_json()['UUID'] for _ in range(2))
+
+    rng = random.Random(2)
+    for _ in range(40):
+        commands = ''.join(rng.choice('NSEWXP') for _ in range(app.AGENTS[memoized].moves))
+
+        first = app.check_moves(memoized, commands)
+        with monkeypatch.context() as patch:
+            patch.setattr(app, 'round_view', lambda game_state, pos, _: app.disguise_traps(game_state, pos))
+            second = app.check_moves(fresh, commands)
+
+        assert first == second
+        if 'end' in first:
+            break
+
+def test_leaderboard_distance(race_server):
+    client = race_server(Map(nparr=np.asarray(maze.generate_maze(30, 30, 5))))
+    agent_uuid = client.post('/api/register_agent', json={}).get_json()['UUID']
+    start = app.AGENTS_STATS[agent_uuid]['distance_to_exit']
+    assert start == app.DISTANCES_TO_EXIT[app.MAZE_ID][app.MAZE.entrance] > 0
+
+    # Walk towards the exit for a round
+    game_state = app.AGENTS[agent_uuid]
+    distance = app.DISTANCES_TO_EXIT[app.MAZE_ID]
+    commands = ''
+    pos = game_state.pos
+    for _ in range(game_state.moves):
+        direction, pos = min(((d, Dir.move(pos, d)) for d in 'NSEW'), key=lambda move: (
+            distance[move[1]] < 0, distance[move[1]]))
+        commands += direction
+    app.check_moves(agent_uuid, commands)
+
+    entry, = [entry for entry in client.get('/leaderboard').get_json() if entry['UUID'] == agent_uuid]
+    assert entry['distance_to_exit'] == max(0, start - game_state.MAX_MOVES_PER_TURN)
+
+def test_healthz(race_server):
+    client = race_server(Map(nparr=np.asarray(maze.generate_maze(20, 20, 1))))
+    assert client.get('/healthz').get_json() == {'status': 'ok', 'sessions': 0}
+
+    client.post('/api/register_agent', json={})
+    response = client.get('/healthz')
+    assert response.status_code == 200 and response.get_json()['sessions'] == 1
+
+def test_large_requests_refused(monkeypatch, race_server):
+    client = race_server(Map(nparr=np.asarray(maze.generate_maze(20, 20, 1))))
+    agent_uuid = client.post('/api/register_agent', json={}).get_json()['UUID']
+    monkeypatch.setitem(app.server.config, 'MAX_CONTENT_LENGTH', 256)
+
+    response = client.post('/api/receive_moves', json={'UUID': agent_uuid, 'input': 'N' * 300})
+    assert response.status_code == 413
+    assert client.post('/api/receive_moves', json={'UUID': agent_uuid, 'input': 'N'}).status_code == 200
+
+def test_character_position_of_the_agent_watched(monkeypatch, race_server):
+    client = race_server(Map(nparr=np.asarray(maze.generate_maze(20, 20, 1))), '--production', '--maze', 'maze.png')
+    monkeypatch.setattr(app, 'RACE_MODE', False)
+    monkeypatch.setattr(app, 'SESSION_STORE', sessions.MemorySessionStore())
+    first, last = (client.post('/api/register_agent', json={}).get_json()['UUID'] for _ in range(2))
+
+    assert client.get('/character_position').get_json()['agent_uuid'] == last
+    response = client.get('/character_position', query_string={'agent_uuid': first}).get_json()
+    assert response['agent_uuid'] == first and first in app.EVENT_LOGS # the viewer follows /events/<UUID>
+    assert (int(response['entrance_x']), int(response['entrance_y'])) == app.MAZE.entrance
+
+def test_production_starts_no_viewer(monkeypatch, race_server):
+    race_server(Map(nparr=np.asarray(maze.generate_maze(20, 20, 1))), '--production', '--maze', 'maze.png')
+    monkeypatch.setattr(app, 'RACE_MODE', False)
+    monkeypatch.setitem(sys.modules, 'viewerV2', None) # importing it fails
+
+    agent_uuid = app.register_new_agent()['UUID']
+    assert agent_uuid in app.EVENT_LOGS # viewers can still follow the agent
+
+def test_refused_rounds_keep_last_activity(race_server):
+    race_server(Map(nparr=np.asarray(maze.generate_maze(20, 20, 1))), '--rate-limit', '0.001', '--burst', '1')
+    agent_uuid = app.register_new_agent()['UUID']
+    assert app.process_moves(agent_uuid, 'X')[1] == 200
+
+    last_seen = app.AGENTS_TIME[agent_uuid] = app.AGENTS_TIME[agent_uuid] - 10
+    assert app.process_moves(agent_uuid, 'X')[1] == 429
+    assert app.AGENTS_TIME[agent_uuid] == last_seen
+
+def test_mazes_freed_when_unused(race_server):
+    race_server(Map(nparr=np.asarray(maze.generate_maze(20, 20, 1))))
+    first_id = app.MAZE_ID
+    first = app.register_new_agent()['UUID']
+
+    # The maze of the new agents changes, the first one is still played
+    app.set_maze(Map(nparr=np.asarray(maze.generate_maze(20, 20, 2))))
+    second_id = app.MAZE_ID
+    second = app.register_new_agent()['UUID']
+    assert first_id in app.MAZES and app.MAZE_AGENTS == {first_id: 1, second_id: 1}
+
+    app.end_game(first)
+    assert first not in app.AGENTS and first in app.AGENTS_STATS
+    assert first_id not in app.MAZES and first_id not in app.PUSH_TABLES and first_id not in app.DISTANCES_TO_EXIT
+    app.end_game(first) # again, e.g. timed out afterwards
+
+    # Kept for the new agents
+    app.end_game(second)
+    assert second_id in app.MAZES and not app.MAZE_AGENTS
+    app.set_maze(Map(nparr=np.asarray(maze.generate_maze(20, 20, 3))))
+    assert list(app.MAZES) == [app.MAZE_ID]
+
+def test_event_log_size_has_no_agent_label(monkeypatch, race_server):
+    client = race_server(Map(nparr=np.asarray(maze.generate_maze(20, 20, 1))), '--production', '--maze', 'maze.png')
+    monkeypatch.setattr(app, 'RACE_MODE', False)
+    for _ in range(2):
+        agent_uuid = app.register_new_agent()['UUID']
+        app.check_moves(agent_uuid, 'NSEW')
+
+    total = sum(len(event_log) for event_log in app.EVENT_LOGS.values())
+    samples = [line for line in client.get('/metrics').get_data(as_text=True).splitlines()
+               if line.startswith('maze_event_log_size')]
+    assert total > 0 and samples == [f'maze_event_log_size {total}']
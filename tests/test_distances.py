@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from common.game_elements import Map
+from common.search import FlatGrid
+import common.tiles as tiles
+import distances
+import maze
+
+def test_fields_match_bfs():
+    gen_maze = Map(nparr=np.asarray(maze.generate_maze(61, 41, 2, max_traps=5, portals=False)))
+    fields = distances.compute(gen_maze)
+
+    grid = FlatGrid(gen_maze)
+    for field, pos in [(fields.to_exit, gen_maze.exit), (fields.to_entrance, gen_maze.entrance)]:
+        assert (field == grid.unpad(grid.bfs([grid.index(pos)]).dist)).all()
+        assert field.dtype == np.int32
+
+    assert fields.to_exit[gen_maze.entrance] == fields.to_entrance[gen_maze.exit]
+    assert (fields.to_exit[np.asarray(gen_maze) == tiles.Wall.code] == -1).all()
+
+def test_cache(tmp_path, monkeypatch):
+    path = tmp_path / 'maze.png'
+    maze.generate_maze(41, 31, 3).write_to_file(path)
+    fields = distances.load(path)
+    assert distances.cache_path(path).exists()
+
+    # Read back from the cache
+    with monkeypatch.context() as patch:
+        patch.setattr(distances, 'compute', lambda *args: pytest.fail('computed again'))
+        cached = distances.load(path)
+    assert all((a == b).all() for a, b in zip(fields, cached))
+
+    # A different maze under the same name is computed again
+    maze.generate_maze(41, 31, 4).write_to_file(path)
+    fields = distances.load(path)
+    assert (fields.to_exit == distances.compute(Map.load_from_file(path)).to_exit).all()
+
+def test_cache_is_optional(tmp_path):
+    path = tmp_path / 'maze.png'
+    maze.generate_maze(41, 31, 3).write_to_file(path)
+    # Nothing can be read from or written to a directory
+    distances.cache_path(path).mkdir()
+
+    fields = distances.load(path)
+    assert (fields.to_exit == distances.compute(Map.load_from_file(path)).to_exit).all()
+
+@pytest.mark.parametrize('damage', [lambda data: data[:len(data) // 2], lambda data: b'', lambda data: b'not a cache'])
+def test_corrupt_cache_is_replaced(tmp_path, damage):
+    path = tmp_path / 'maze.png'
+    maze.generate_maze(41, 31, 3).write_to_file(path)
+    fields = distances.load(path)
+
+    cache = distances.cache_path(path)
+    cache.write_bytes(damage(cache.read_bytes()))
+    assert all((a == b).all() for a, b in zip(fields, distances.load(path)))
+    with np.load(cache) as cached: # written again
+        assert cached['maze_id'].tobytes() == Map.load_from_file(path).digest()
@@ -0,0 +1,52 @@
+import threading
+
+import events
+
+def test_subscribers_see_every_event():
+    event_log = events.EventLog()
+    received = {name: [] for name in ['viewer', 'recorder']}
+
+    subscribed = threading.Barrier(len(received) + 1)
+
+    def follow(name):
+        subscription = event_log.subscribe(timeout=1)
+        subscribed.wait()
+        for item in subscription:
+            if item is not None:
+                received[name].append(item)
+
+    threads = [threading.Thread(target=follow, args=(name,)) for name in received]
+    for thread in threads:
+        thread.start()
+    subscribed.wait(timeout=5)
+
+    for i in range(100):
+        event_log.publish(str(i))
+    event_log.close()
+
+    for thread in threads:
+        thread.join(timeout=5)
+
+    expected = [(i + 1, str(i)) for i in range(100)]
+    assert received['viewer'] == expected
+    assert received['recorder'] == expected
+
+def test_closing_keeps_unread_events():
+    event_log = events.EventLog()
+    for i in range(100):
+        event_log.publish(str(i))
+    event_log.close()
+
+    # A subscriber that was behind still gets everything published before the log was closed, then stops
+    assert list(event_log.subscribe(90, timeout=1)) == [(i + 1, str(i)) for i in range(90, 100)]
+
+def test_resume_and_overflow():
+    event_log = events.EventLog(capacity=10)
+    for i in range(25):
+        event_log.publish(str(i))
+
+    # Reconnecting after event 20 resumes with event 21
+    assert event_log.read(20) == [(21, '20'), (22, '21'), (23, '22'), (24, '23'), (25, '24')]
+    # Events that fell out of the buffer are skipped
+    assert event_log.read(0)[0] == (16, '15')
+    assert event_log.read(25, timeout=0) == []
@@ -0,0 +1,50 @@
+import numpy as np
+import random
+
+from common.game_elements import Map, GameState, Pos
+import common.tiles as tiles
+import maze
+
+def small_map():
+    W, P = tiles.Wall.code, tiles.Path.code
+    return Map(nparr=np.array([
+        [W, W, W, W, W],
+        [W, tiles.Entrance.code, tiles.Xray.code, P, W],
+        [W, W, W, tiles.Exit.code, W],
+        [W, W, W, W, W],
+    ], dtype=np.uint8))
+
+def test_shared_map_overlay():
+    shared = small_map()
+    state = GameState(maps=[shared], shared_map=True)
+    other = GameState(maps=[shared], shared_map=True)
+
+    assert state.perform_command('E') == '1'
+    assert state.xray_points == GameState.START_XRAY_POINTS + 1
+
+    # The X-Ray point is only consumed for the agent that picked it up
+    assert shared[1][2] == tiles.Xray.code
+    assert state.tile(Pos(1, 2)) == tiles.Path.code
+    assert other.tile(Pos(1, 2)) == tiles.Xray.code
+    assert state.view()[2][2] == tiles.Path.code
+    assert other.view(Pos(1, 2))[2][2] == tiles.Xray.code
+
+def test_serialization_round_trip():
+    gen_maze = Map(nparr=np.asarray(maze.generate_maze(40, 40, 11, max_traps=5)))
+    mazes = {gen_maze.digest(): gen_maze}
+
+    rng = random.Random(5)
+    state = GameState(maps=[gen_maze], shared_map=True)
+    for _ in range(30):
+        copy = GameState.from_bytes(state.to_bytes(gen_maze.digest()), mazes)
+        assert copy.to_bytes(gen_maze.digest()) == state.to_bytes(gen_maze.digest())
+
+        # Both copies must behave the same from now on, rewinds included
+        commands = [rng.choice('NSEWXP') for _ in range(state.moves)]
+        for game_state in [state, copy]:
+            game_state.results = [game_state.perform_command(command) for command in commands]
+            game_state.new_round()
+
+        assert state.results == copy.results
+        assert state.pos == copy.pos
+        assert state.overlay == copy.overlay
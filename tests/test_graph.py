@@ -0,0 +1,49 @@
+import numpy as np
+
+from common.game_elements import Map, Pos
+from common.graph import MazeGraph
+from common.search import FlatGrid
+import common.tiles as tiles
+import maze
+
+def test_matches_flat_grid():
+    gen_maze = maze.generate_maze(61, 41, 6, max_traps=10, portals=False)
+    graph = MazeGraph(gen_maze)
+    grid = FlatGrid(gen_maze)
+
+    assert len(graph) == int((np.asarray(gen_maze) != tiles.Wall.code).sum())
+    assert graph.num_arcs == 2 * (len(graph) - 1) # a tree
+
+    for node in [0, graph.entrance, len(graph) - 1]:
+        pos = graph.pos(node)
+        assert graph.node(pos) == node
+        open_neighbors = [neigh for neigh in maze.neighbors(gen_maze, pos, tiles.Wall.code, search=False)
+                          if gen_maze[neigh] != tiles.Wall.code]
+        assert [graph.pos(neighbor) for neighbor in graph.neighbors(node)] == open_neighbors
+
+    dist = graph.field(graph.bfs([graph.entrance]).dist)
+    assert (dist == grid.unpad(grid.bfs([grid.index(graph.pos(graph.entrance))]).dist)).all()
+
+    assert len(graph.traps) == len(gen_maze.traps)
+    assert (graph.codes[graph.traps] >= 96).all()
+
+def test_portal_arcs():
+    W, P = tiles.Wall.code, tiles.Path.code
+    portal, lone = tiles.Portal.first_portal(), tiles.Portal.first_portal() + 1
+    gen_maze = Map(nparr=np.array([
+        [W, W, W, W, W, W, W],
+        [W, tiles.Entrance.code, portal, W, portal, tiles.Exit.code, W],
+        [W, lone, W, W, W, W, W],
+        [W, W, W, W, W, W, W],
+    ], dtype=np.uint8))
+
+    graph = MazeGraph(gen_maze)
+    a, b = graph.node(Pos(1, 2)), graph.node(Pos(1, 4))
+    assert b in graph.neighbors(a) and a in graph.neighbors(b)
+    assert graph.bfs([graph.entrance]).dist[graph.exit] == 3
+
+    # A portal without a pair leads nowhere
+    assert graph.portal_pairs[graph.node(Pos(2, 1))] == -1
+    assert len(graph.neighbors(graph.node(Pos(2, 1)))) == 1
+
+    assert MazeGraph(gen_maze, portals=False).bfs([graph.entrance]).dist[graph.exit] == -1
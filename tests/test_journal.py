@@ -0,0 +1,85 @@
+import random
+
+import numpy as np
+import pytest
+
+import app
+from common.game_elements import GameState, Map, Pos
+from common.pushes import PushTable
+import journal
+import maze
+
+def test_record_and_replay(tmp_path):
+    gen_maze = maze.generate_maze(30, 30, 7, max_traps=2)
+    gen_maze.write_to_file(tmp_path / 'maze.png')
+    loaded = maze.Map.load_from_file(tmp_path / 'maze.png')
+
+    writer = journal.JournalWriter(tmp_path)
+    writer.open_session('1', loaded, 7)
+
+    rng = random.Random(3)
+    game_state = GameState(maps=[loaded], shared_map=True)
+    for _ in range(20):
+        commands = ''.join(rng.choice('NSEWXP') for _ in range(game_state.moves))
+        recorded, end_reached = journal.replay_round(game_state, commands)
+        writer.record_round('1', recorded.commands, recorded.results, recorded.moves, recorded.positions)
+        if end_reached:
+            writer.record_end('1')
+            break
+    writer.close()
+
+    path, = tmp_path.glob('*.mzj')
+    header, _ = journal.read_journal(path)
+    assert header.seed == 7
+    assert header.maze_id == loaded.digest()
+
+    stats = journal.replay(path)
+    assert stats['rounds'] > 0
+
+def test_round_out_of_range():
+    with pytest.raises(ValueError):
+        journal.encode_round('N', '1', 256, [])
+    with pytest.raises(ValueError):
+        journal.encode_round('N', '1', 10, [Pos(70000, 1)])
+
+def test_writer_survives_bad_records(tmp_path):
+    gen_maze = maze.generate_maze(20, 20, 1)
+    writer = journal.JournalWriter(tmp_path)
+    writer.open_session('bad', gen_maze)
+    writer.open_session('good', gen_maze)
+
+    writer.record_round('bad', 'N', '1', 300, []) # too many moves for the record
+    writer.record_round('bad', 'N', '1', 10, [])
+    writer.record_round('good', 'N', '0', 10, [])
+    writer.close()
+
+    journals = {path.stem.split('-', 1)[1]: list(journal.read_journal(path)[1]) for path in tmp_path.glob('*.mzj')}
+    assert journals == {'bad': [], 'good': [journal.JournalRound('N', '0', 10, [])]}
+
+def test_server_journal_replays(tmp_path, monkeypatch, race_server):
+    race_server(Map(nparr=np.asarray(maze.generate_maze(30, 30, 9, max_traps=6))))
+    writer = journal.JournalWriter(tmp_path)
+    monkeypatch.setattr(app, 'JOURNAL', writer)
+    agent_uuid = app.register_new_agent()['UUID']
+    server_state = app.AGENTS[agent_uuid] # dropped when the game ends
+
+    rng = random.Random(5)
+    for _ in range(30):
+        commands = ''.join(rng.choice('NSEWXP') for _ in range(app.AGENTS[agent_uuid].moves))
+        if 'end' in app.check_moves(agent_uuid, commands):
+            break
+    writer.close()
+
+    path, = tmp_path.glob('*.mzj')
+    assert journal.replay(path)['rounds'] > 0
+
+    # Replaying what the server wrote ends in the state of the server
+    header, rounds = journal.read_journal(path)
+    game_state = GameState(maps=[app.MAZE], shared_map=True, push_table=PushTable(app.MAZE))
+    for recorded in rounds:
+        if recorded is not None:
+            journal.replay_round(game_state, recorded.commands)
+    assert header.maze_id == app.MAZE_ID
+    for name in ['pos', 'moves', 'next_round_moves', 'xray_points', 'xray_on', 'in_rewind', 'first_trap', 'overlay',
+                 'prev_moves']:
+        assert getattr(game_state, name) == getattr(server_state, name), name
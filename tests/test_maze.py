@@ -1,7 +1,13 @@
 from pathlib import Path
+import random
+import threading
+
+import numpy as np
 import pytest
 
-from common.game_elements import Map
+from common.game_elements import Map, GameState, Pos, Dir
+from common.pushes import Outcome, PushTable
+from common.search import FlatGrid
 import common.tiles as tiles
 import maze
 
@@ -22,8 +28,11 @@ def test_generate_requirements(tmp_path,  width, height, seed):
     assert int((gen_maze == tiles.Exit.code).sum()) == 1
 
     path_tiles = int((gen_maze != tiles.Wall.code).sum())
-    # TODO check minimum 50% distance
-    
+    arr = np.asarray(gen_maze)
+    grid = FlatGrid(arr)
+    entrance, exit = (grid.index(Pos(*np.argwhere(arr == code)[0])) for code in [tiles.Entrance.code, tiles.Exit.code])
+    assert grid.bfs([entrance]).dist[exit] >= path_tiles // 2
+
 @pytest.mark.parametrize("width,height,seed", args)
 def test_save_load(tmp_path,  width, height, seed):
     tmp_path = Path(tmp_path) / 'output.png'
@@ -43,3 +52,97 @@ def same_maze(maze1, maze2):
     for i in range(height):
         for j in range(width):
             assert maze1[i][j] == maze2[i][j]
+
+@pytest.mark.parametrize("width,height,seed", args)
+def test_walls_span_all_cells(width, height, seed):
+    walls, path_count = maze.generate_walls(width | 1, height | 1, random.Random(seed))
+
+    # Every cell is carved and connected to the others through exactly one wall opening (a spanning tree)
+    assert (walls[1::2, 1::2] == tiles.Path.code).all()
+    num_cells = walls[1::2, 1::2].size
+    assert path_count == 2 * num_cells - 1
+    assert int((walls != tiles.Wall.code).sum()) == path_count
+
+def test_placement_constraints():
+    gen_maze = maze.generate_maze(80, 60, 21, max_traps=60)
+    arr = np.asarray(gen_maze)
+
+    special = (arr != tiles.Path.code) & (arr != tiles.Wall.code)
+    assert not (special[1:] & special[:-1]).any()
+    assert not (special[:, 1:] & special[:, :-1]).any()
+
+    # The path between the entrance and the exit is unique, only MovesTraps may be on it
+    grid = FlatGrid(arr)
+    entrance, exit = (Pos(*np.argwhere(arr == code)[0]) for code in [tiles.Entrance.code, tiles.Exit.code])
+    solution = grid.path(grid.bfs([grid.index(entrance)]), grid.index(exit))
+
+    for pos in gen_maze.traps:
+        trap = tiles.from_code(gen_maze[pos])
+        if not isinstance(trap, tiles.MovesTrap):
+            assert grid.index(pos) not in solution
+
+        # Stepping on the trap from any side must work out
+        for neigh in maze.neighbors(gen_maze, pos, tiles.Path.code):
+            state = GameState(maps=[gen_maze], pos=pos)
+            state.perform_command(Dir.get_direction(neigh, pos), max_num_traps_redirect=maze.MAX_NUM_TRAPS_REDIRECT)
+
+@pytest.mark.parametrize("seed", range(10))
+def test_push_chains_land(seed):
+    # Strong pushes reach other traps, a trap placed later must not break the chains of the earlier ones
+    gen_maze = maze.generate_maze(41, 41, seed, max_traps=30)
+    table = PushTable(gen_maze)
+
+    for pos in gen_maze.traps:
+        # From a Path neighbor, or bouncing back from a Wall
+        for direction in [Dir.N, Dir.S, Dir.W, Dir.E]:
+            push = table.get(pos, direction)
+            sides = [gen_maze[Dir.move(pos, direction)], gen_maze[Dir.move(pos, Dir.OPPOSITE[direction])]]
+            if push is not None and tiles.Path.code in sides:
+                assert push.outcome not in (Outcome.WALL, Outcome.ENDLESS)
+                assert push.redirects <= maze.MAX_NUM_TRAPS_REDIRECT
+
+def test_reproducible_across_threads():
+    expected = [maze.generate_maze(60, 40, seed, max_traps=8) for seed in range(4)]
+
+    results = {}
+    def generate(seed):
+        results[seed] = maze.generate_maze(60, 40, seed, max_traps=8)
+
+    def disturb(stop):
+        while not stop.is_set():
+            random.seed()
+            random.random()
+
+    stop = threading.Event()
+    disturber = threading.Thread(target=disturb, args=(stop,))
+    disturber.start()
+    threads = [threading.Thread(target=generate, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    disturber.join()
+
+    for seed in range(4):
+        assert (np.asarray(results[seed]) == np.asarray(expected[seed])).all()
+
+def test_only_the_layout_is_retried(monkeypatch):
+    calls = {'order': 0, 'traps': 0}
+    maze_order, generate_traps = maze.maze_order, maze.generate_traps
+
+    def short_first_order(grid, *args):
+        calls['order'] += 1
+        order = maze_order(grid, *args)
+        return order[:3] if calls['order'] == 1 else order
+
+    def counted_traps(*args, **kwargs):
+        calls['traps'] += 1
+        return generate_traps(*args, **kwargs)
+
+    monkeypatch.setattr(maze, 'maze_order', short_first_order)
+    monkeypatch.setattr(maze, 'generate_traps', counted_traps)
+
+    gen_maze = maze.generate_maze(40, 40, 1, max_traps=5)
+    assert calls == {'order': 2, 'traps': 1}
+    assert int((gen_maze == tiles.Exit.code).sum()) == 1
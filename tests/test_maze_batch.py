@@ -0,0 +1,11 @@
+import maze_batch
+
+def test_same_batch_for_any_number_of_workers(tmp_path):
+    common = ['-n', '6', '-W', '15', '40', '-H', '15', '40', '-s', '4', '--max-traps', '3', '-p']
+    serial = maze_batch.main(['-o', str(tmp_path / 'serial'), '-j', '1'] + common)
+    parallel = maze_batch.main(['-o', str(tmp_path / 'parallel'), '-j', '3'] + common)
+
+    assert serial == parallel
+    for entry in serial['mazes']:
+        serial_file, parallel_file = tmp_path / 'serial' / entry['file'], tmp_path / 'parallel' / entry['file']
+        assert serial_file.read_bytes() == parallel_file.read_bytes()
@@ -0,0 +1,31 @@
+import io
+
+import numpy as np
+import pytest
+
+from common.game_elements import Map, Pos
+from common.search import FlatGrid
+import common.tiles as tiles
+import maze_stream
+
+@pytest.mark.parametrize("width,height,seed", [(5, 9, 1), (40, 10, 3), (101, 57, 4), (6, 11, 6)])
+def test_streamed_maze(width, height, seed):
+    streamed = maze_stream.StreamingMaze(width, height, seed)
+    png = io.BytesIO()
+    maze_stream.write_png(png, streamed.width, streamed.height, streamed.rows())
+    png.seek(0)
+    loaded = np.asarray(Map.load_from_file(png))
+
+    assert loaded.shape == (streamed.height, streamed.width)
+    assert loaded[streamed.entrance] == tiles.Entrance.code
+    assert loaded[streamed.exit] == tiles.Exit.code
+
+    # A perfect maze: all the cells are carved and connected without cycles
+    path_tiles = int((loaded != tiles.Wall.code).sum())
+    assert path_tiles == streamed.path_count == 2 * loaded[1::2, 1::2].size - 1
+    assert (loaded[1::2, 1::2] != tiles.Wall.code).all()
+
+    grid = FlatGrid(loaded)
+    dist = grid.bfs([grid.index(Pos(*streamed.entrance))]).dist[grid.index(Pos(*streamed.exit))]
+    assert dist == streamed.spine_tiles - 1
+    assert dist >= path_tiles // 2
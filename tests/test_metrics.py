@@ -0,0 +1,41 @@
+import metrics
+
+def test_render():
+    registry = metrics.Registry()
+    requests = metrics.Counter('requests', 'Requests handled', ('route',), registry=registry)
+    sessions = metrics.Gauge('sessions', 'Open sessions', registry=registry)
+    duration = metrics.Histogram('duration_seconds', 'Time spent', buckets=(0.5, 0.1), registry=registry)
+
+    requests.labels(route='move').inc()
+    requests.labels(route='move').inc(2)
+    requests.labels(route='a "quoted"\nroute').inc()
+    sessions.set(3)
+    for value in [0.05, 0.1, 0.3, 7]:
+        duration.observe(value)
+
+    assert registry.render() == '\n'.join([
+        '# HELP requests Requests handled',
+        '# TYPE requests counter',
+        'requests_total{route="move"} 3',
+        r'requests_total{route="a \"quoted\"\nroute"} 1',
+        '# HELP sessions Open sessions',
+        '# TYPE sessions gauge',
+        'sessions 3',
+        '# HELP duration_seconds Time spent',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{le="0.1"} 2',
+        'duration_seconds_bucket{le="0.5"} 3',
+        'duration_seconds_bucket{le="+Inf"} 4',
+        'duration_seconds_sum 7.45',
+        'duration_seconds_count 4',
+    ]) + '\n'
+
+def test_remove_labels():
+    registry = metrics.Registry()
+    size = metrics.Gauge('size', 'Size by agent', ('agent',), registry=registry)
+    size.labels(agent='1').set(4)
+    size.labels(agent='2').set(5)
+
+    size.remove(agent='1')
+    size.remove(agent='3') # never set
+    assert registry.render().splitlines()[2:] == ['size{agent="2"} 5']
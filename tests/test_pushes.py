@@ -0,0 +1,67 @@
+import random
+
+import numpy as np
+
+from common.game_elements import GameState, Map, Pos
+from common.pushes import Outcome, PushTable
+import common.tiles as tiles
+
+W, P = tiles.Wall.code, tiles.Path.code
+
+def random_map(rng: random.Random, height: int = 9, width: int = 11) -> Map:
+    """ Walls, paths, X-Rays and traps of every kind packed together, so chains run into each other """
+    codes = [W] * 6 + [P] * 12 + [tiles.Xray.code] * 2 + list(range(96, 116))
+    arr = np.array([[rng.choice(codes) for _ in range(width)] for _ in range(height)], dtype=np.uint8)
+    arr[0, :] = arr[-1, :] = W
+    arr[:, 0] = arr[:, -1] = W
+    return Map(nparr=arr)
+
+def play(gen_maze, pos, command, limit, push_table):
+    state = GameState(maps=[gen_maze], pos=pos, shared_map=True, push_table=push_table)
+    try:
+        state.perform_command(command, max_num_traps_redirect=limit)
+    except (ValueError, RecursionError):
+        return None
+    return (state.pos, state.next_round_moves, state.xray_points, state.overlay, state.current_move_visited_pos,
+            state.current_move)
+
+def test_table_matches_simulation():
+    rng = random.Random(3)
+    outcomes = set()
+    for _ in range(12):
+        gen_maze = random_map(rng)
+        table = PushTable(gen_maze)
+
+        for x, y in np.argwhere(np.isin(np.asarray(gen_maze), [P, tiles.Xray.code, *range(96, 101)])).tolist():
+            for command in 'NSEW':
+                for limit in [None, 2]:
+                    assert play(gen_maze, Pos(x, y), command, limit, table) == \
+                        play(gen_maze, Pos(x, y), command, limit, None)
+        outcomes |= {push.outcome for push in table.pushes.values()}
+
+    assert outcomes == set(Outcome)
+
+def test_chain():
+    forward, backward = tiles.ForwardTrap(2).code, tiles.BackwardTrap(1).code
+    moves, xray = tiles.MovesTrap(3).code, tiles.Xray.code
+    gen_maze = Map(nparr=np.array([
+        [W, W, W, W, W, W, W],
+        [W, P, forward, xray, moves, W, W],
+        [W, W, W, W, W, W, W],
+    ], dtype=np.uint8))
+    table = PushTable(gen_maze)
+
+    # Pushed over the X-Ray onto the MovesTrap
+    push = table.get(Pos(1, 2), 'E')
+    assert push == (Outcome.LANDED, Pos(1, 4), (Pos(1, 3), Pos(1, 4)), (Pos(1, 3),), 3, 1)
+
+    # Stepping on it from the east pushes the agent back, bouncing off the wall
+    push = table.get(Pos(1, 2), 'W')
+    assert (push.landing, push.visited, push.moves_lost) == (Pos(1, 1), (Pos(1, 1),), 0)
+
+    gen_maze[1, 2] = backward
+    push = PushTable(gen_maze).get(Pos(1, 2), 'E')
+    assert (push.landing, push.visited) == (Pos(1, 1), (Pos(1, 1),))
+
+    gen_maze[1, 2], gen_maze[1, 3] = forward, W
+    assert PushTable(gen_maze).get(Pos(1, 2), 'E').outcome == Outcome.WALL
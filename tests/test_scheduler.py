@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+import scheduler
+
+def test_sessions_take_turns():
+    fair = scheduler.FairScheduler(max_running=1, max_waiting=10, max_per_session=3, max_wait=5)
+    order = []
+    started = []
+
+    def run(session):
+        started.append(session)
+        with fair.slot(session):
+            order.append(session)
+
+    fair.acquire('holder')
+    threads = []
+    for session in ['greedy', 'greedy', 'greedy', 'polite']:
+        threads.append(threading.Thread(target=run, args=(session,)))
+        threads[-1].start()
+        while fair.waiting < len(threads): # queue them in this exact order
+            pass
+
+    # A fourth waiting request of the same session is refused right away
+    with pytest.raises(scheduler.Rejected):
+        fair.acquire('greedy')
+
+    fair.release()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == ['greedy', 'polite', 'greedy', 'greedy']
+    assert fair.running == 0 and fair.waiting == 0
+
+def test_wait_timeout():
+    fair = scheduler.FairScheduler(max_running=1, max_waiting=10, max_wait=0.05)
+    fair.acquire('a')
+    with pytest.raises(scheduler.Rejected):
+        fair.acquire('b')
+    fair.release()
+    assert fair.running == 0 and fair.waiting == 0
+
+def test_token_bucket():
+    bucket = scheduler.TokenBucket(rate=1, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert 0 < bucket.take() <= 1
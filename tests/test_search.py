@@ -0,0 +1,33 @@
+import random
+
+import numpy as np
+
+from common.game_elements import Pos
+from common.search import FlatGrid
+import common.tiles as tiles
+import maze
+
+def test_diameter_path():
+    walls, _ = maze.generate_walls(41, 31, random.Random(8))
+    grid = FlatGrid(walls)
+
+    path = maze.maze_order(grid)
+    assert grid.pos(path[-1]) != grid.pos(path[0])
+    assert len(set(path.tolist())) == len(path)
+    assert set(np.abs(np.diff(path)).tolist()) <= {1, grid.stride}
+
+    # No cell is further from either end than the other end
+    for end in [path[0], path[-1]]:
+        dist = grid.bfs([end]).dist
+        assert dist.max() == len(path) - 1
+
+def test_distances():
+    W, P = tiles.Wall.code, tiles.Path.code
+    grid = FlatGrid(np.array([
+        [P, P, P],
+        [W, W, P],
+        [P, W, P],
+    ], dtype=np.uint8))
+
+    dist = grid.unpad(grid.bfs([grid.index(Pos(0, 0))]).dist)
+    assert dist.tolist() == [[0, 1, 2], [-1, -1, 3], [-1, -1, 4]]
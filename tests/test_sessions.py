@@ -0,0 +1,66 @@
+import numpy as np
+
+import app
+from common.game_elements import Map
+import maze
+import sessions
+
+def test_sqlite_store(tmp_path):
+    store = sessions.SQLiteSessionStore(tmp_path / 'sessions.db')
+    assert store.get('agent') is None
+
+    store.put('agent', b'first')
+    store.put('agent', b'second')
+    store.put_maze(b'id', b'maze')
+    store.put_maze(b'id', b'maze')
+
+    # Another worker opens the same file
+    other = sessions.SQLiteSessionStore(tmp_path / 'sessions.db')
+    assert other.get('agent') == b'second'
+    assert other.get_maze(b'id') == b'maze'
+    assert other.get_maze(b'other') is None
+
+    other.delete('agent')
+    assert store.get('agent') is None
+
+def test_sessions_resume_in_another_worker(tmp_path, monkeypatch, race_server):
+    store = sessions.SQLiteSessionStore(tmp_path / 'sessions.db')
+    client = race_server(Map(nparr=np.asarray(maze.generate_maze(30, 30, 8, max_traps=4))))
+    # A maze generated by this worker, the other one knows nothing about it
+    monkeypatch.setattr(app, 'SESSION_STORE', store)
+    app.set_maze(app.MAZE)
+    agent_uuid = client.post('/api/register_agent', json={}).get_json()['UUID']
+
+    response, status = app.process_moves(agent_uuid, 'NSEW')
+    assert status == 200
+    saved = store.get(agent_uuid)
+    maze_id = app.AGENTS_MAZE_ID[agent_uuid]
+    last_seen, stats = app.AGENTS_TIME[agent_uuid], app.AGENTS_STATS[agent_uuid]
+
+    # The other worker
+    for name in ['AGENTS', 'AGENTS_TIME', 'AGENTS_STATS', 'AGENTS_MAZE_ID', 'MAZES', 'PUSH_TABLES', 'DISTANCES_TO_EXIT',
+                 'MAZE_AGENTS']:
+        monkeypatch.setattr(app, name, {})
+
+    assert app.load_session(agent_uuid)
+    assert app.AGENTS[agent_uuid].to_bytes(maze_id) == saved[app.SESSION_HEADER.size:]
+    assert app.MAZES[maze_id].digest() == maze_id
+    assert app.AGENTS_TIME[agent_uuid] == last_seen
+    assert app.AGENTS_STATS[agent_uuid] == stats
+
+    response, status = app.process_moves(agent_uuid, 'X')
+    assert status == 200 and response['command_1']['successful'] == '1'
+
+def test_time_limit_holds_across_workers(tmp_path, monkeypatch, race_server):
+    store = sessions.SQLiteSessionStore(tmp_path / 'sessions.db')
+    race_server(Map(nparr=np.asarray(maze.generate_maze(20, 20, 1))))
+    monkeypatch.setattr(app, 'SESSION_STORE', store)
+    agent_uuid = app.register_new_agent()['UUID']
+
+    app.AGENTS_TIME[agent_uuid] -= app.MAX_TIME_ALLOWED + 1
+    app.save_session(agent_uuid)
+
+    # The other worker has never seen the agent, it doesn't start its clock again
+    for name in ['AGENTS', 'AGENTS_TIME', 'AGENTS_STATS', 'AGENTS_MAZE_ID', 'MAZE_AGENTS']:
+        monkeypatch.setattr(app, name, {})
+    assert app.process_moves(agent_uuid, 'X') == ({'end': '0'}, 200)
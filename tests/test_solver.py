@@ -0,0 +1,85 @@
+import math
+
+import numpy as np
+import pytest
+
+from common.game_elements import GameState, Map, Pos
+from common.search import FlatGrid
+from common.solver import DIRECTIONS, Solver, solve
+import common.tiles as tiles
+import maze
+
+W, P, EN, EX = tiles.Wall.code, tiles.Path.code, tiles.Entrance.code, tiles.Exit.code
+
+def corridor(*tiles_codes):
+    row = [W, *tiles_codes, W]
+    return Map(nparr=np.array([[W] * len(row), row, [W] * len(row)], dtype=np.uint8))
+
+def play(gen_maze, solution):
+    """ Sends the commands of a solution through a GameState, round by round, returns the round the exit is reached """
+    arr = np.asarray(gen_maze)
+    state = GameState(maps=[gen_maze], pos=Pos(*np.argwhere(arr == EN)[0]), shared_map=True)
+    for round, commands in enumerate(solution.commands, 1):
+        assert len(commands) <= state.moves
+        for command in commands:
+            state.perform_command(command)
+            if gen_maze[state.pos] == EX:
+                return round
+        state.new_round()
+
+def test_moves_match_game_state():
+    gen_maze = maze.generate_maze(41, 31, 5, max_traps=12, portals=False)
+    solver = Solver(gen_maze)
+
+    for pos in map(tuple, np.argwhere(np.asarray(gen_maze) != W)):
+        if tiles.CODE_TO_TYPE[gen_maze[pos]] in (tiles.ForwardTrap, tiles.BackwardTrap, tiles.RewindTrap):
+            continue # the agent never stands on those
+
+        for direction, command in enumerate(DIRECTIONS):
+            result = solver.resolve(solver.grid.index(Pos(*pos)), direction)
+            if result is None:
+                continue
+
+            state = GameState(maps=[gen_maze], pos=Pos(*pos), shared_map=True)
+            state.perform_command(command)
+            assert solver.grid.pos(result[0]) == state.pos
+            assert max(0, GameState.MAX_MOVES_PER_TURN - result[1]) == state.next_round_moves
+
+@pytest.mark.parametrize("seed", range(6))
+def test_solutions_play_out(seed):
+    gen_maze = maze.generate_maze(61, 41, seed, max_traps=15, portals=True)
+    solution = solve(gen_maze)
+
+    assert play(gen_maze, solution) == solution.rounds
+    assert len(solution.commands) == solution.rounds
+
+def test_validate_large_maze(capsys):
+    maze.generate_maze(301, 301, 9, max_traps=150, portals=True, validate=True)
+    assert 'Solution:' in capsys.readouterr().out
+
+def test_no_traps_shortest_path():
+    gen_maze = maze.generate_maze(80, 60, 3)
+    arr = np.asarray(gen_maze)
+    grid = FlatGrid(arr)
+    entrance, exit = (grid.index(Pos(*np.argwhere(arr == code)[0])) for code in [EN, EX])
+    dist = int(grid.bfs([entrance]).dist[exit])
+
+    solution = solve(gen_maze)
+    assert solution.num_commands == dist
+    assert solution.rounds == math.ceil(dist / GameState.MAX_MOVES_PER_TURN)
+
+def test_traps():
+    forward = tiles.ForwardTrap(3).code
+    moves = tiles.MovesTrap(5).code
+    rewind = tiles.RewindTrap(1).code
+
+    # Pushed 3 tiles further by the first step, so the exit is 10 commands away instead of 13
+    solution = solve(corridor(EN, forward, *[P] * 11, EX))
+    assert (solution.rounds, solution.num_commands) == (1, 10)
+
+    # The MovesTrap leaves 5 moves for the second round, not enough for the last 6 tiles
+    solution = solve(corridor(EN, moves, *[P] * 14, EX))
+    assert (solution.rounds, solution.commands[:2]) == (3, ['E' * 10, 'E' * 5])
+
+    # A RewindTrap can't be walked over
+    assert solve(corridor(EN, P, rewind, P, EX)) is None
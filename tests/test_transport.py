@@ -0,0 +1,33 @@
+import numpy as np
+
+import app
+from common.game_elements import Map, Pos
+from common.transport import StreamClient, decode_frame, encode_frame
+import maze
+
+def test_frames():
+    message = {'UUID': '1', 'input': 'NSEWXP', 'nested': {'view': [1, 2]}}
+    frame = encode_frame(message)
+    assert frame.endswith(b'\n') and frame.count(b'\n') == 1
+    assert decode_frame(frame) == message
+
+def test_stream_exchange(race_server):
+    race_server(Map(nparr=np.asarray(maze.generate_maze(30, 30, 3))))
+    stream_server = app.start_stream_server('127.0.0.1', 0)
+    client = StreamClient(*stream_server.server_address, timeout=5)
+    try:
+        registration = client.request({})
+        assert Pos(int(registration['x']), int(registration['y'])) == app.MAZE.entrance
+
+        # Valid JSON that is not an object, or an input that is not a string, gets an error and the connection stays up
+        agent_uuid = registration['UUID']
+        for message in [5, [], {'UUID': agent_uuid, 'input': 5}, {'UUID': agent_uuid, 'input': None}]:
+            client.sock.sendall(encode_frame(message))
+            assert 'error' in decode_frame(client.rfile.readline())
+
+        response = client.request({'UUID': agent_uuid, 'input': 'X'})
+        assert response['command_1']['name'] == 'X' and response['command_1']['successful'] == '1'
+    finally:
+        client.close()
+        stream_server.shutdown()
+        stream_server.server_close()
@@ -18,6 +18,8 @@ INITIAL_SCALE = 4.0
 PAN_SPEED = 0.05
 REFRESH_INTERVAL = 200 # ms
 
+SERVER_URL = 'http://127.0.0.1:5000' # set by the server when it listens elsewhere
+
 IMG_LAYER = 0
 PATH_LAYER = 1
 TRAP_LAYER = 2
@@ -318,10 +320,11 @@ class ViewerApp:
 
     def on_click_button(self):
         print("GATA")
-        requests.get(f'http://127.0.0.1:5000/wait_for_input/{self.uuid}')
+        requests.get(f'{SERVER_URL}/wait_for_input/{self.uuid}')
 
-def get_character_position(app: ViewerApp):
-    character_pos_response = requests.get('http://127.0.0.1:5000/character_position')
+def get_character_position(app: ViewerApp, agent_uuid: str | None = None):
+    params = {'agent_uuid': agent_uuid} if agent_uuid is not None else {}
+    character_pos_response = requests.get(f'{SERVER_URL}/character_position', params=params)
     # print(character_pos_response.json())
 
     # Invert positions, not sure why
@@ -356,7 +359,7 @@ def get_character_position(app: ViewerApp):
 def listen_to_server(app: ViewerApp):
     # print(app)
 
-    server_url = f"http://127.0.0.1:5000/events/{app.uuid}"
+    server_url = f"{SERVER_URL}/events/{app.uuid}"
 
     events = SSEClient(server_url)
 
@@ -375,7 +378,7 @@ def listen_to_server(app: ViewerApp):
 
 main_root = None
 
-def create_viewer(await_for_input=False, fog=False):
+def create_viewer(await_for_input=False, fog=False, agent_uuid=None):
     global main_root
     is_first = False
 
@@ -388,7 +391,7 @@ def create_viewer(await_for_input=False, fog=False):
     # Create a new Toplevel window for the viewer
     root = tk.Toplevel(main_root)
     app = ViewerApp(root, await_for_input, fog)
-    get_character_position(app)
+    get_character_position(app, agent_uuid)
 
     if is_first:
         threading.Thread(target=listen_to_server, args=(app,), daemon=True).start()